@@ -0,0 +1,294 @@
+# Benchmark de carga sin red: levanta el Airtable y el Google Geocoding de pruebas (servidores_stub.py) y la app
+# con uvicorn apuntando a ellos, reproduce una mezcla de búsquedas contra /api/getRestaurantsPrueba y saca
+# p50/p95/p99, throughput y cuántas llamadas han llegado a Airtable y a Google.
+# La mezcla por defecto: zona suelta, varias zonas, coordenadas en zonas densas y coordenadas en áreas poco
+# densas (las que obligan a ampliar el radio). Con --json se guarda el resultado y con --comparar se enfrenta a
+# uno anterior, para ver el efecto de un cambio antes de desplegarlo.
+#   python benchmarks/bench_carga.py --peticiones 500 --concurrencia 8 --catalogo --json base.json
+#   python benchmarks/bench_carga.py --peticiones 500 --concurrencia 8 --catalogo --comparar base.json
+# Con --workers N la app corre con N workers de uvicorn, y con --cache-compartida sqlite|redis comparten la caché
+# (redis contra el Redis de pruebas de servidores_stub.py), para medir cuántas llamadas se ahorran entre procesos
+#   python benchmarks/bench_carga.py --workers 4 --cache-compartida redis --comparar sin_compartir.json
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRECTORIO)
+from servidores_stub import CIUDADES, COCINAS, PLATOS, PRECIOS
+
+# Tipo de búsqueda -> peso en la mezcla
+MEZCLA_POR_DEFECTO = "zona=35,multizona=15,coordenadas=35,dispersas=15"
+# Las coordenadas "dispersas" quedan al menos a esta distancia (grados, ~2,5 km) de cualquier zona conocida
+SEPARACION_DISPERSAS = 0.025
+
+def _leer_mezcla(texto: str) -> Dict[str, float]:
+    mezcla = {}
+    for parte in texto.split(","):
+        tipo, _, peso = parte.partition("=")
+        if tipo.strip() not in ("zona", "multizona", "coordenadas", "dispersas"):
+            raise ValueError(f"Tipo de búsqueda desconocido en la mezcla: {tipo!r}")
+        mezcla[tipo.strip()] = float(peso)
+    return mezcla
+
+def _filtros_aleatorios(rnd: random.Random) -> dict:
+    filtros = {}
+    if rnd.random() < 0.4:
+        filtros["cocina"] = rnd.choice(COCINAS)
+    if rnd.random() < 0.15:
+        filtros["price_range"] = rnd.choice(PRECIOS)
+    if rnd.random() < 0.1:
+        filtros["dish"] = rnd.choice(PLATOS)
+    if rnd.random() < 0.05:
+        filtros["diet"] = "vegano"
+    return filtros
+
+def _punto_disperso(rnd: random.Random, ciudad: str) -> Tuple[float, float]:
+    lat_min, lat_max, lng_min, lng_max, _, zonas = CIUDADES[ciudad]
+    for _ in range(100):
+        lat, lng = rnd.uniform(lat_min, lat_max), rnd.uniform(lng_min, lng_max)
+        if all(math.hypot(lat - zl, lng - zg) > SEPARACION_DISPERSAS for zl, zg in zonas.values()):
+            return lat, lng
+    return lat, lng
+
+# Una búsqueda de la mezcla: (tipo, parámetros de la petición)
+def busqueda_aleatoria(rnd: random.Random, mezcla: Dict[str, float]) -> Tuple[str, dict]:
+    tipo = rnd.choices(list(mezcla), weights=list(mezcla.values()))[0]
+    ciudad = rnd.choices(list(CIUDADES), weights=[c[4] for c in CIUDADES.values()])[0]
+    zonas = list(CIUDADES[ciudad][5])
+    params = {"city": ciudad, **_filtros_aleatorios(rnd)}
+    if tipo == "zona":
+        # De vez en cuando una zona que Google no encuentra
+        params["zona"] = rnd.choice(zonas) if rnd.random() > 0.03 else "Zona Inexistente"
+    elif tipo == "multizona":
+        params["zona"] = ", ".join(rnd.sample(zonas, min(len(zonas), rnd.randint(2, 3))))
+    elif tipo == "coordenadas":
+        lat_zona, lng_zona = rnd.choice(list(CIUDADES[ciudad][5].values()))
+        params["coordenadas"] = f"{rnd.gauss(lat_zona, 0.003):.6f},{rnd.gauss(lng_zona, 0.003):.6f}"
+    else:
+        lat, lng = _punto_disperso(rnd, ciudad)
+        params["coordenadas"] = f"{lat:.6f},{lng:.6f}"
+    return tipo, params
+
+# Las búsquedas se repiten como en producción: un conjunto de 'distintas' con popularidad tipo Zipf.
+# Con distintas=0 cada petición es nueva
+def generar_busquedas(n: int, distintas: int, mezcla: Dict[str, float], semilla: int) -> List[Tuple[str, dict]]:
+    rnd = random.Random(semilla)
+    if distintas <= 0:
+        return [busqueda_aleatoria(rnd, mezcla) for _ in range(n)]
+    conjunto = [busqueda_aleatoria(rnd, mezcla) for _ in range(distintas)]
+    pesos = [1 / (i + 1) for i in range(distintas)]
+    return rnd.choices(conjunto, weights=pesos, k=n)
+
+def _esperar(url: str, segundos: float, proceso: subprocess.Popen, condicion=None):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El proceso de {url} ha terminado con código {proceso.returncode}")
+        try:
+            respuesta = httpx.get(url, timeout=2)
+            if respuesta.status_code == 200 and (condicion is None or condicion(respuesta.json())):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} no ha respondido en {segundos:.0f} s")
+
+def arrancar_servidores(args, directorio_temporal: str) -> Tuple[subprocess.Popen, subprocess.Popen]:
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(DIRECTORIO, "servidores_stub.py"),
+        "--puerto", str(args.puerto_stub), "--restaurantes", str(args.restaurantes),
+        "--latencia-airtable-ms", str(args.latencia_airtable_ms), "--latencia-geo-ms", str(args.latencia_geo_ms),
+        "--jitter-ms", str(args.jitter_ms), "--errores-airtable", str(args.errores_airtable),
+        "--errores-geo", str(args.errores_geo), "--limite-rps", str(args.limite_rps),
+        "--puerto-resp", str(args.puerto_resp if args.cache_compartida == "redis" else 0),
+    ])
+    salida = None if args.logs else subprocess.DEVNULL
+    _esperar(f"http://127.0.0.1:{args.puerto_stub}/__stats", 120, stub)
+
+    base_stub = f"http://127.0.0.1:{args.puerto_stub}"
+    entorno = {
+        **os.environ,
+        "BASE_ID": "appBENCHMARK",
+        "AIRTABLE_PAT": "pat-benchmark",
+        "GOOGLE_MAPS_API_KEY": "clave-benchmark",
+        "AIRTABLE_API_URL": f"{base_stub}/v0",
+        "GEOCODING_API_URL": f"{base_stub}/maps/api/geocode/json",
+        # Cachés en disco vacías en cada ejecución
+        "GEOCODE_CACHE_PATH": os.path.join(directorio_temporal, "geocodes.sqlite3"),
+        "CATALOGO_SNAPSHOT_PATH": os.path.join(directorio_temporal, "catalogo.snapshot"),
+        "CATALOGO_ACTIVO": "1" if args.catalogo else "0",
+        "HISTORIAL_PATH": os.path.join(directorio_temporal, "consultas.log"),
+        "CACHE_COMPARTIDA_URL": {
+            "sqlite": f"sqlite://{os.path.join(directorio_temporal, 'compartida.sqlite3')}",
+            "redis": f"redis://127.0.0.1:{args.puerto_resp}/0",
+        }.get(args.cache_compartida, ""),
+    }
+    entorno.pop("N8N_WEBHOOK_URL", None)
+    if args.sin_cache:
+        entorno.update({"RESULT_CACHE_TTL": "0", "RESULT_CACHE_STALE": "0", "RESULT_CACHE_TTL_VACIOS": "0"})
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.puerto_app),
+         "--log-level", "warning", "--workers", str(args.workers)],
+        cwd=os.path.dirname(DIRECTORIO), env=entorno, stdout=salida, stderr=salida
+    )
+    base_app = f"http://127.0.0.1:{args.puerto_app}"
+    _esperar(f"{base_app}/", 60, app)
+    if args.catalogo:
+        _esperar(f"{base_app}/api/catalogo/stats", 600, app, lambda datos: datos.get("listo"))
+    return stub, app
+
+async def reproducir(base_app: str, busquedas: List[Tuple[str, dict]], concurrencia: int) -> List[tuple]:
+    resultados = []
+    pendientes = iter(busquedas)
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=base_app, timeout=60, limits=limites) as cliente:
+        async def trabajador():
+            for tipo, params in pendientes:
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.get("/api/getRestaurantsPrueba", params=params)
+                    estado = respuesta.status_code
+                    encontrados = len(respuesta.json().get("restaurants", [])) if estado == 200 else 0
+                except httpx.HTTPError as e:
+                    estado, encontrados = type(e).__name__, 0
+                resultados.append((tipo, time.perf_counter() - inicio, estado, encontrados))
+
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    return resultados
+
+def _percentiles(latencias: List[float]) -> dict:
+    ms = np.array(latencias) * 1000
+    return {
+        "n": len(ms),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+def resumir(resultados: List[tuple], segundos: float, upstream: dict, args) -> dict:
+    por_tipo = defaultdict(list)
+    for tipo, latencia, _, _ in resultados:
+        por_tipo[tipo].append(latencia)
+    n = len(resultados)
+    return {
+        "configuracion": {
+            "peticiones": args.peticiones, "concurrencia": args.concurrencia, "distintas": args.distintas,
+            "restaurantes": args.restaurantes, "catalogo": args.catalogo, "sin_cache": args.sin_cache,
+            "latencia_airtable_ms": args.latencia_airtable_ms, "latencia_geo_ms": args.latencia_geo_ms,
+            "errores_airtable": args.errores_airtable, "errores_geo": args.errores_geo, "mezcla": args.mezcla,
+            "workers": args.workers, "cache_compartida": args.cache_compartida,
+        },
+        "segundos": segundos,
+        "throughput": n / segundos if segundos else 0.0,
+        "latencia_ms": {"total": _percentiles([r[1] for r in resultados]),
+                        **{tipo: _percentiles(lat) for tipo, lat in sorted(por_tipo.items())}},
+        "estados": dict(Counter(str(r[2]) for r in resultados)),
+        "sin_resultados": sum(1 for r in resultados if r[2] == 200 and r[3] == 0),
+        "upstream": upstream,
+        "llamadas_por_peticion": {
+            "airtable": upstream["airtable"]["llamadas"] / n if n else 0.0,
+            "geocoding": upstream["geocoding"]["llamadas"] / n if n else 0.0,
+        },
+    }
+
+def imprimir(resumen: dict, anterior: Optional[dict] = None):
+    def delta(actual, previo):
+        if previo is None or not previo:
+            return ""
+        return f" ({(actual - previo) / previo * 100:+.0f}%)"
+
+    previo_lat = (anterior or {}).get("latencia_ms", {})
+    print(f"\n{resumen['configuracion']['peticiones']} peticiones en {resumen['segundos']:.1f} s -> "
+          f"{resumen['throughput']:.1f} req/s{delta(resumen['throughput'], (anterior or {}).get('throughput'))}")
+    print(f"{'':>12} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}   (ms)")
+    for tipo, datos in resumen["latencia_ms"].items():
+        fila = f"{tipo:>12} {datos['n']:>5} {datos['p50']:>9.1f} {datos['p95']:>9.1f} {datos['p99']:>9.1f} {datos['max']:>9.1f}"
+        if tipo in previo_lat:
+            fila += "   " + " ".join(
+                f"{m}{delta(datos[m], previo_lat[tipo][m])}" for m in ("p50", "p95", "p99")
+            )
+        print(fila)
+    print(f"estados: {resumen['estados']}  (200 sin resultados: {resumen['sin_resultados']})")
+    airtable, geocoding = resumen["upstream"]["airtable"], resumen["upstream"]["geocoding"]
+    por_peticion = resumen["llamadas_por_peticion"]
+    previo_pp = (anterior or {}).get("llamadas_por_peticion", {})
+    print(f"Airtable: {airtable['llamadas']} llamadas ({por_peticion['airtable']:.2f} por petición"
+          f"{delta(por_peticion['airtable'], previo_pp.get('airtable'))}), {airtable['429_limite']} 429 por límite, "
+          f"{airtable['errores_inyectados']} errores inyectados, {airtable['registros_servidos']} registros")
+    print(f"Geocoding: {geocoding['llamadas']} llamadas ({por_peticion['geocoding']:.2f} por petición"
+          f"{delta(por_peticion['geocoding'], previo_pp.get('geocoding'))}), "
+          f"{geocoding['errores_inyectados']} errores inyectados, {geocoding['sin_resultados']} sin resultados")
+
+def parsear_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga de /api/getRestaurantsPrueba sin red")
+    parser.add_argument("--peticiones", type=int, default=300)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--distintas", type=int, default=100, help="búsquedas distintas (0 = todas nuevas)")
+    parser.add_argument("--mezcla", default=MEZCLA_POR_DEFECTO, help="pesos por tipo de búsqueda")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--catalogo", action="store_true", help="con el catálogo local (descarga inicial incluida)")
+    parser.add_argument("--sin-cache", action="store_true", help="sin caché de resultados")
+    parser.add_argument("--restaurantes", type=int, default=20000)
+    parser.add_argument("--latencia-airtable-ms", type=float, default=150)
+    parser.add_argument("--latencia-geo-ms", type=float, default=60)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--errores-airtable", type=float, default=0.0)
+    parser.add_argument("--errores-geo", type=float, default=0.0)
+    parser.add_argument("--limite-rps", type=float, default=5)
+    parser.add_argument("--puerto-stub", type=int, default=8765)
+    parser.add_argument("--puerto-app", type=int, default=8766)
+    parser.add_argument("--puerto-resp", type=int, default=8767, help="puerto del Redis de pruebas")
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn")
+    parser.add_argument("--cache-compartida", choices=["", "sqlite", "redis"], default="",
+                        help="nivel compartido de las cachés entre workers")
+    parser.add_argument("--logs", action="store_true", help="muestra los logs de la app")
+    parser.add_argument("--json", help="guarda el resultado en este fichero")
+    parser.add_argument("--comparar", help="resultado anterior (--json) con el que comparar")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parsear_argumentos(argv)
+    mezcla = _leer_mezcla(args.mezcla)
+    busquedas = generar_busquedas(args.peticiones, args.distintas, mezcla, args.semilla)
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="bistrohunter-bench-") as directorio_temporal:
+        stub, app = arrancar_servidores(args, directorio_temporal)
+        try:
+            # Solo cuentan las llamadas de la reproducción, no las de la carga inicial del catálogo
+            httpx.delete(f"http://127.0.0.1:{args.puerto_stub}/__stats")
+            inicio = time.perf_counter()
+            resultados = asyncio.run(reproducir(f"http://127.0.0.1:{args.puerto_app}", busquedas, args.concurrencia))
+            segundos = time.perf_counter() - inicio
+            upstream = httpx.get(f"http://127.0.0.1:{args.puerto_stub}/__stats").json()
+        finally:
+            for proceso in (app, stub):
+                proceso.terminate()
+                proceso.wait(timeout=10)
+
+    resumen = resumir(resultados, segundos, upstream, args)
+    imprimir(resumen, anterior)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# Microbenchmark del merge/de-duplicado de resultados: 20 iteraciones (radios o zonas) x 80 registros.
+# Compara la versión antigua (r not in lista, comparando dicts enteros) con el set de ids.
+#   python benchmarks/bench_merge.py
+import os
+import sys
+import copy
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bistrohunter import agregar_sin_duplicados
+
+ITERACIONES = 20
+POR_ITERACION = 80
+
+def registro(i: int) -> dict:
+    return {
+        "id": f"rec{i:06d}",
+        "createdTime": "2024-01-01T00:00:00.000Z",
+        "fields": {
+            "cid": str(10 ** 12 + i),
+            "title": f"Restaurante {i}",
+            "NBH2": i % 97,
+            "location/lat": 40.4 + i * 1e-5,
+            "location/lng": -3.7 - i * 1e-5,
+            "categories_string": "española, tapas, bar",
+            "price_range": ["€€"],
+            "google_reviews": "Muy buena comida y servicio " * 20,
+        },
+    }
+
+# Cada iteración devuelve las anteriores más 40 nuevas (como al ampliar el radio). Copias profundas,
+# igual que cuando cada respuesta de Airtable se parsea por separado
+paginas = [
+    [copy.deepcopy(registro(j)) for j in range(i * 40, i * 40 + POR_ITERACION)]
+    for i in range(ITERACIONES)
+]
+
+def merge_lista():
+    encontrados = []
+    for pagina in paginas:
+        nuevos = [r for r in pagina if r not in encontrados]
+        encontrados.extend(nuevos)
+    return encontrados
+
+def merge_set():
+    encontrados = []
+    vistos = set()
+    for pagina in paginas:
+        agregar_sin_duplicados(encontrados, vistos, pagina)
+    return encontrados
+
+if __name__ == "__main__":
+    assert [r["id"] for r in merge_lista()] == [r["id"] for r in merge_set()]
+    for nombre, funcion in (("lista (r not in)", merge_lista), ("set de ids", merge_set)):
+        repeticiones = 20
+        segundos = min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones
+        print(f"{nombre:>18}: {segundos * 1e6:10.1f} µs por búsqueda")
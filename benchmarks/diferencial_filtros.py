@@ -0,0 +1,79 @@
+# Comprobación diferencial de los filtros: para consultas aleatorias (incluidas comillas, barras, tildes, mayúsculas,
+# trozos de palabra y campos vacíos) la fórmula de Airtable, el predicado local, la evaluación vectorizada y
+# Catalogo.filtrar (sin índice de texto y con él) tienen que devolver exactamente los mismos registros.
+# Sale con código 1 si alguna no coincide.
+#   python benchmarks/diferencial_filtros.py [n_consultas]
+import os
+import sys
+import random
+import asyncio
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filtros import ConsultaRestaurantes, construir_columnas, evaluar_columnas
+from catalogo import Catalogo
+from geo import calcular_bounding_box
+from formula_airtable import evaluar_formula
+
+PALABRAS = [
+    "italiana", "Italiana", "pizza", "japonesa", "sushi", "española", "tapas", "vegano", "vegetariano",
+    "sin gluten", "café", "cafe", "paella", "l'arròs", "O'Donnell", "a\\b", "100%", "€", "€€", "€€€", "",
+    "Paella", "PIZZA", "aell", "zza", "ana, piz", "gluten", "Café", "arr",
+]
+
+def registro_aleatorio(i: int, rnd: random.Random) -> dict:
+    fields = {
+        "cid": str(i),
+        "title": f"Restaurante {i}",
+        "NBH2": rnd.randint(0, 100),
+        "location/lat": 40.42 + rnd.uniform(-0.05, 0.05),
+        "location/lng": -3.70 + rnd.uniform(-0.05, 0.05),
+        "categories_string": ", ".join(rnd.sample(PALABRAS[:16], rnd.randint(0, 3))),
+        "price_range": [rnd.choice(["€", "€€", "€€€"])],
+        "google_reviews": " ".join(rnd.choice(PALABRAS) for _ in range(rnd.randint(0, 8))),
+    }
+    # Algunos registros con campos vacíos o sin coordenadas
+    for campo in list(fields):
+        if campo not in ("cid",) and rnd.random() < 0.05:
+            del fields[campo]
+    return {"id": f"rec{i:06d}", "fields": fields}
+
+def consulta_aleatoria(rnd: random.Random) -> ConsultaRestaurantes:
+    def valores(n_max):
+        return ",".join(rnd.choice(PALABRAS) for _ in range(rnd.randint(1, n_max))) if rnd.random() < 0.5 else None
+    consulta = ConsultaRestaurantes.desde_parametros(
+        price_range=valores(2), cocina=valores(3), diet=valores(1), dish=valores(2)
+    )
+    return consulta.con_bbox(calcular_bounding_box(40.42 + rnd.uniform(-0.03, 0.03), -3.70, rnd.uniform(0.5, 5)))
+
+# Ids que devuelve Catalogo.filtrar sobre todas las filas, en el orden de los registros
+def filtrar_catalogo(catalogo: Catalogo, consulta: ConsultaRestaurantes) -> list:
+    posiciones = catalogo.filtrar(np.arange(len(catalogo.registros)), consulta)
+    return [catalogo.registros[p]["id"] for p in np.sort(posiciones)]
+
+def main(n_consultas: int = 500) -> int:
+    rnd = random.Random(1234)
+    registros = [registro_aleatorio(i, rnd) for i in range(2000)]
+    columnas = construir_columnas(registros)
+    sin_indice = Catalogo(registros)
+    con_indice = Catalogo(registros)
+    asyncio.run(con_indice.indexar_texto())
+    fallos = 0
+    for _ in range(n_consultas):
+        consulta = consulta_aleatoria(rnd)
+        formula = consulta.a_formula()
+        predicado = consulta.predicado()
+        por_formula = [r["id"] for r in registros if evaluar_formula(formula, r)]
+        por_predicado = [r["id"] for r in registros if predicado(r["fields"])]
+        por_columnas = [registros[p]["id"] for p in evaluar_columnas(consulta, columnas).nonzero()[0]]
+        por_catalogo = filtrar_catalogo(sin_indice, consulta)
+        por_indice = filtrar_catalogo(con_indice, consulta)
+        if not (por_formula == por_predicado == por_columnas == por_catalogo == por_indice):
+            fallos += 1
+            print(f"DIFERENCIA en {consulta}: fórmula={len(por_formula)} predicado={len(por_predicado)} "
+                  f"columnas={len(por_columnas)} catálogo={len(por_catalogo)} índice={len(por_indice)}\n  {formula}")
+    print(f"{n_consultas} consultas, {fallos} diferencias")
+    return 1 if fallos else 0
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,175 @@
+# Intérprete mínimo de fórmulas filterByFormula de Airtable, solo con lo que genera BistroHunter
+# (AND, OR, NOT, FIND, SEARCH, ARRAYJOIN, LOWER, SUBSTITUTE, RECORD_ID, LAST_MODIFIED_TIME, IS_AFTER, comparaciones).
+# Lo usan el Airtable de pruebas de los benchmarks y la comprobación diferencial de filtros
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Tuple
+
+_TOKENS = re.compile(r"""
+    (?P<espacio>\s+)
+  | (?P<numero>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+  | (?P<cadena>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+  | (?P<campo>\{[^}]*\})
+  | (?P<nombre>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<operador>>=|<=|!=|>|<|=|&|-)
+  | (?P<simbolo>[(),])
+""", re.VERBOSE)
+
+def _tokenizar(formula: str) -> List[Tuple[str, str]]:
+    tokens = []
+    posicion = 0
+    while posicion < len(formula):
+        m = _TOKENS.match(formula, posicion)
+        if not m:
+            raise ValueError(f"Fórmula no válida cerca de: {formula[posicion:posicion + 20]!r}")
+        posicion = m.end()
+        if m.lastgroup != "espacio":
+            tokens.append((m.lastgroup, m.group()))
+    return tokens
+
+def _leer_cadena(literal: str) -> str:
+    return re.sub(r"\\(.)", lambda m: {"n": "\n", "t": "\t"}.get(m.group(1), m.group(1)), literal[1:-1])
+
+class _Parser:
+    def __init__(self, formula: str):
+        self.tokens = _tokenizar(formula)
+        self.i = 0
+
+    def _ver(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def _tomar(self, valor=None):
+        tipo, texto = self._ver()
+        if valor is not None and texto != valor:
+            raise ValueError(f"Se esperaba {valor!r} y llegó {texto!r}")
+        self.i += 1
+        return tipo, texto
+
+    def parsear(self):
+        arbol = self._comparacion()
+        if self.i != len(self.tokens):
+            raise ValueError(f"Sobra texto en la fórmula: {self.tokens[self.i:]}")
+        return arbol
+
+    def _comparacion(self):
+        izquierda = self._concatenacion()
+        tipo, texto = self._ver()
+        if tipo == "operador" and texto in (">=", "<=", ">", "<", "=", "!="):
+            self._tomar()
+            return ("cmp", texto, izquierda, self._concatenacion())
+        return izquierda
+
+    def _concatenacion(self):
+        izquierda = self._primario()
+        while self._ver() == ("operador", "&"):
+            self._tomar()
+            izquierda = ("concat", izquierda, self._primario())
+        return izquierda
+
+    def _primario(self):
+        tipo, texto = self._tomar()
+        if tipo == "numero":
+            return ("const", float(texto))
+        if tipo == "cadena":
+            return ("const", _leer_cadena(texto))
+        if tipo == "campo":
+            return ("campo", texto[1:-1])
+        if (tipo, texto) == ("operador", "-"):
+            return ("neg", self._primario())
+        if (tipo, texto) == ("simbolo", "("):
+            arbol = self._comparacion()
+            self._tomar(")")
+            return arbol
+        if tipo == "nombre":
+            self._tomar("(")
+            argumentos = []
+            if self._ver() != ("simbolo", ")"):
+                argumentos.append(self._comparacion())
+                while self._ver() == ("simbolo", ","):
+                    self._tomar()
+                    argumentos.append(self._comparacion())
+            self._tomar(")")
+            return ("func", texto.upper(), argumentos)
+        raise ValueError(f"Token inesperado: {texto!r}")
+
+@lru_cache(maxsize=1024)
+def compilar_formula(formula: str):
+    return _Parser(formula).parsear()
+
+def _fecha(valor) -> datetime:
+    if isinstance(valor, datetime):
+        return valor
+    return datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+
+def _evaluar(arbol, registro: dict) -> Any:
+    tipo = arbol[0]
+    if tipo == "const":
+        return arbol[1]
+    if tipo == "campo":
+        return registro.get("fields", {}).get(arbol[1])
+    if tipo == "neg":
+        return -_evaluar(arbol[1], registro)
+    if tipo == "concat":
+        return f"{_evaluar(arbol[1], registro) or ''}{_evaluar(arbol[2], registro) or ''}"
+    if tipo == "cmp":
+        izquierda, derecha = _evaluar(arbol[2], registro), _evaluar(arbol[3], registro)
+        if izquierda is None or derecha is None:
+            return False
+        try:
+            if isinstance(izquierda, str) and isinstance(derecha, float):
+                izquierda = float(izquierda)
+            if isinstance(derecha, str) and isinstance(izquierda, float):
+                derecha = float(derecha)
+        except ValueError:
+            return False
+        return {
+            ">=": izquierda >= derecha, "<=": izquierda <= derecha, ">": izquierda > derecha,
+            "<": izquierda < derecha, "=": izquierda == derecha, "!=": izquierda != derecha,
+        }[arbol[1]]
+
+    nombre, argumentos = arbol[1], arbol[2]
+    if nombre == "AND":
+        return all(_evaluar(a, registro) for a in argumentos)
+    if nombre == "OR":
+        return any(_evaluar(a, registro) for a in argumentos)
+    if nombre == "NOT":
+        return not _evaluar(argumentos[0], registro)
+    valores = [_evaluar(a, registro) for a in argumentos]
+    if nombre in ("FIND", "SEARCH"):
+        aguja, pajar = str(valores[0] or ""), valores[1]
+        if pajar is None:
+            return 0 if nombre == "FIND" else None
+        posicion = str(pajar).find(aguja) + 1
+        return posicion if posicion or nombre == "FIND" else None
+    if nombre == "ARRAYJOIN":
+        valor = valores[0]
+        separador = valores[1] if len(valores) > 1 else ","
+        if valor is None:
+            return ""
+        return separador.join(str(v) for v in valor) if isinstance(valor, list) else str(valor)
+    if nombre == "LOWER":
+        return str(valores[0] or "").lower()
+    if nombre == "SUBSTITUTE":
+        texto, viejo, nuevo = (str(v or "") for v in valores[:3])
+        return texto.replace(viejo, nuevo) if viejo else texto
+    if nombre == "RECORD_ID":
+        return registro.get("id")
+    if nombre == "LAST_MODIFIED_TIME":
+        return registro.get("lastModifiedTime") or registro.get("createdTime")
+    if nombre == "IS_AFTER":
+        if valores[0] is None or valores[1] is None:
+            return False
+        return _fecha(valores[0]) > _fecha(valores[1])
+    if nombre == "TRUE":
+        return True
+    if nombre == "FALSE":
+        return False
+    if nombre == "BLANK":
+        return None
+    raise ValueError(f"Función no soportada: {nombre}")
+
+def evaluar_formula(formula: str, registro: dict) -> bool:
+    if not formula:
+        return True
+    return bool(_evaluar(compilar_formula(formula), registro))
@@ -0,0 +1,365 @@
+# Airtable y Google Geocoding de pruebas para los benchmarks, en un solo servidor local:
+#   GET /v0/{base}/{tabla}         -> filterByFormula, sort, maxRecords, pageSize/offset y fields[] como Airtable
+#   GET /maps/api/geocode/json     -> centroides de las zonas de CIUDADES ("Sol, Madrid")
+#   GET /__stats                   -> llamadas, errores inyectados y registros servidos
+# y, con --puerto-resp, un Redis mínimo en memoria (GET/SET/DEL/INCR por RESP) para la caché compartida
+# Los restaurantes son sintéticos pero caen dentro de los límites reales de cada ciudad: la mayoría alrededor de
+# las zonas conocidas y el resto repartidos por toda la ciudad, para que haya áreas poco densas donde la búsqueda
+# por coordenadas tenga que ampliar el radio. Latencia, tasa de errores y tamaño se configuran por línea de comandos.
+#   python benchmarks/servidores_stub.py --puerto 8765 --restaurantes 20000 --latencia-airtable-ms 150
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import unicodedata
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from formula_airtable import compilar_formula, _evaluar
+
+# Ciudad -> (lat_min, lat_max, lng_min, lng_max, peso en el total de restaurantes, {zona: (lat, lng)})
+CIUDADES: Dict[str, tuple] = {
+    "Madrid": (40.36, 40.50, -3.78, -3.60, 0.35, {
+        "Sol": (40.4169, -3.7035), "Malasaña": (40.4265, -3.7040), "Chueca": (40.4229, -3.6975),
+        "Lavapiés": (40.4086, -3.7010), "La Latina": (40.4110, -3.7100), "Salamanca": (40.4300, -3.6780),
+        "Chamberí": (40.4340, -3.7040), "Retiro": (40.4110, -3.6830),
+    }),
+    "Barcelona": (41.34, 41.46, 2.10, 2.23, 0.25, {
+        "Gràcia": (41.4036, 2.1565), "El Born": (41.3850, 2.1820), "Eixample": (41.3910, 2.1650),
+        "Barceloneta": (41.3800, 2.1890), "Gòtic": (41.3830, 2.1770), "Poblenou": (41.4000, 2.2000),
+    }),
+    "Valencia": (39.43, 39.51, -0.42, -0.32, 0.12, {
+        "Ruzafa": (39.4620, -0.3740), "El Carmen": (39.4790, -0.3800), "Cabanyal": (39.4700, -0.3300),
+        "Benimaclet": (39.4860, -0.3600),
+    }),
+    "Sevilla": (37.34, 37.42, -6.03, -5.93, 0.12, {
+        "Triana": (37.3850, -6.0030), "Santa Cruz": (37.3860, -5.9900), "Alameda": (37.3990, -5.9940),
+        "Nervión": (37.3830, -5.9720),
+    }),
+    "Bilbao": (43.24, 43.29, -2.97, -2.90, 0.08, {
+        "Casco Viejo": (43.2590, -2.9240), "Indautxu": (43.2610, -2.9400), "Abando": (43.2630, -2.9300),
+    }),
+    "Málaga": (36.68, 36.75, -4.50, -4.37, 0.08, {
+        "Centro": (36.7210, -4.4210), "Soho": (36.7160, -4.4240), "Pedregalejo": (36.7220, -4.3850),
+    }),
+}
+
+COCINAS = [
+    "italiana", "pizza", "japonesa", "sushi", "española", "tapas", "mexicana", "india", "china", "peruana",
+    "mediterránea", "asador", "marisquería", "vegetariano", "vegano", "sin gluten", "café", "brunch",
+]
+PLATOS = ["paella", "croquetas", "tortilla", "ramen", "tacos", "pulpo", "cachopo", "ceviche", "burger", "gyozas"]
+PRECIOS = ["€", "€€", "€€€", "€€€€"]
+
+# Fracción de restaurantes que se agrupa alrededor de las zonas (el resto, uniforme en la ciudad)
+FRACCION_EN_ZONAS = 0.7
+# Dispersión alrededor del centroide de cada zona (en grados; 0.004 ~ 400 m)
+DISPERSION_ZONA = 0.004
+
+def _iso(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def normalizar(texto: str) -> str:
+    sin_tildes = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return " ".join(sin_tildes.lower().split())
+
+# Restaurantes sintéticos (siempre los mismos para la misma semilla), ordenados por NBH2 descendente como la vista
+def generar_restaurantes(n: int, semilla: int = 42) -> List[dict]:
+    rnd = random.Random(semilla)
+    ahora = time.time()
+    pesos = [c[4] for c in CIUDADES.values()]
+    registros = []
+    for i in range(n):
+        ciudad = rnd.choices(list(CIUDADES), weights=pesos)[0]
+        lat_min, lat_max, lng_min, lng_max, _, zonas = CIUDADES[ciudad]
+        if rnd.random() < FRACCION_EN_ZONAS:
+            lat_zona, lng_zona = rnd.choice(list(zonas.values()))
+            lat = min(max(rnd.gauss(lat_zona, DISPERSION_ZONA), lat_min), lat_max)
+            lng = min(max(rnd.gauss(lng_zona, DISPERSION_ZONA), lng_min), lng_max)
+        else:
+            lat, lng = rnd.uniform(lat_min, lat_max), rnd.uniform(lng_min, lng_max)
+        fields = {
+            "cid": str(10 ** 15 + i),
+            "title": f"Restaurante {i} ({ciudad})",
+            "bh_message": f"Un sitio recomendado en {ciudad}",
+            "price_range": [rnd.choice(PRECIOS)],
+            "url": f"https://maps.google.com/?cid={10 ** 15 + i}",
+            "location/lat": round(lat, 7),
+            "location/lng": round(lng, 7),
+            "categories_string": ", ".join(rnd.sample(COCINAS, rnd.randint(1, 3))),
+            "google_reviews": " ".join(rnd.sample(PLATOS, rnd.randint(0, 3))),
+        }
+        # Como en la base real, a algunos restaurantes les falta la nota
+        if rnd.random() > 0.03:
+            fields["NBH2"] = rnd.randint(0, 100)
+        creado = ahora - rnd.uniform(0, 365 * 24 * 3600)
+        registros.append({
+            "id": f"rec{i:014d}",
+            "createdTime": _iso(creado),
+            "lastModifiedTime": _iso(creado),
+            "fields": fields,
+        })
+    registros.sort(key=lambda r: -r["fields"].get("NBH2", -1))
+    return registros
+
+# Condiciones de bbox sobre {location/lat}/{location/lng} que van directamente dentro del AND principal.
+# Sirven para descartar con numpy casi todos los registros antes de evaluar la fórmula completa
+def _bbox_formula(arbol) -> List[Tuple[str, str, float]]:
+    if arbol[0] != "func" or arbol[1] != "AND":
+        return []
+    condiciones = []
+    for arg in arbol[2]:
+        if arg[0] == "cmp" and arg[2][0] == "campo" and arg[2][1] in ("location/lat", "location/lng") \
+                and arg[3][0] in ("const", "neg") and arg[1] in (">=", "<=", ">", "<"):
+            valor = arg[3][1] if arg[3][0] == "const" else -arg[3][1][1]
+            if isinstance(valor, float):
+                condiciones.append((arg[2][1], arg[1], valor))
+    return condiciones
+
+class AirtableStub:
+    def __init__(self, registros: List[dict], latencia: float, jitter: float, errores: float,
+                 limite_rps: float, retry_after: float, semilla: int = 7):
+        self.registros = registros
+        self.columnas = {
+            campo: np.array([r["fields"].get(campo, np.nan) for r in registros], dtype=float)
+            for campo in ("location/lat", "location/lng")
+        }
+        self.latencia = latencia
+        self.jitter = jitter
+        self.errores = errores
+        self.limite_rps = limite_rps
+        self.retry_after = retry_after
+        self.rnd = random.Random(semilla)
+        self._ultimas: deque = deque()
+        self.stats = {"llamadas": 0, "429_limite": 0, "errores_inyectados": 0, "registros_servidos": 0, "paginas": 0}
+        self._filtrar = lru_cache(maxsize=256)(self._filtrar_sin_cache)
+
+    def _filtrar_sin_cache(self, formula: str) -> Tuple[int, ...]:
+        if not formula:
+            return tuple(range(len(self.registros)))
+        arbol = compilar_formula(formula)
+        mascara = np.ones(len(self.registros), dtype=bool)
+        for campo, operador, valor in _bbox_formula(arbol):
+            columna = self.columnas[campo]
+            mascara &= {">=": columna >= valor, "<=": columna <= valor,
+                        ">": columna > valor, "<": columna < valor}[operador]
+        return tuple(int(p) for p in np.flatnonzero(mascara) if _evaluar(arbol, self.registros[p]))
+
+    def _supera_limite(self) -> bool:
+        if not self.limite_rps:
+            return False
+        ahora = time.monotonic()
+        while self._ultimas and ahora - self._ultimas[0] > 1.0:
+            self._ultimas.popleft()
+        if len(self._ultimas) >= self.limite_rps:
+            return True
+        self._ultimas.append(ahora)
+        return False
+
+    async def listar(self, request: Request):
+        self.stats["llamadas"] += 1
+        await asyncio.sleep(max(0.0, self.rnd.gauss(self.latencia, self.jitter)))
+        cabeceras = {"Retry-After": f"{self.retry_after:g}"} if self.retry_after else {}
+        if self._supera_limite():
+            self.stats["429_limite"] += 1
+            return JSONResponse({"errors": [{"error": "RATE_LIMIT_REACHED"}]}, status_code=429, headers=cabeceras)
+        if self.rnd.random() < self.errores:
+            self.stats["errores_inyectados"] += 1
+            if self.rnd.random() < 0.5:
+                return JSONResponse({"errors": [{"error": "RATE_LIMIT_REACHED"}]}, status_code=429, headers=cabeceras)
+            return JSONResponse({"error": "SERVICE_UNAVAILABLE"}, status_code=503)
+
+        params = request.query_params
+        try:
+            posiciones = self._filtrar(params.get("filterByFormula", ""))
+        except ValueError as e:
+            return JSONResponse({"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": str(e)}}, status_code=422)
+        if "maxRecords" in params:
+            posiciones = posiciones[:int(params["maxRecords"])]
+        tamano = min(100, int(params.get("pageSize", 100)))
+        inicio = int(params.get("offset", "itr0")[3:] or 0)
+        campos = params.getlist("fields[]")
+
+        pagina = []
+        for p in posiciones[inicio:inicio + tamano]:
+            registro = self.registros[p]
+            fields = registro["fields"]
+            pagina.append({
+                "id": registro["id"],
+                "createdTime": registro["createdTime"],
+                "fields": {c: fields[c] for c in campos if c in fields} if campos else fields,
+            })
+        self.stats["paginas"] += 1
+        self.stats["registros_servidos"] += len(pagina)
+        respuesta = {"records": pagina}
+        if inicio + tamano < len(posiciones):
+            respuesta["offset"] = f"itr{inicio + tamano}"
+        return JSONResponse(respuesta)
+
+class GeocodingStub:
+    def __init__(self, latencia: float, jitter: float, errores: float, semilla: int = 11):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.errores = errores
+        self.rnd = random.Random(semilla)
+        self.zonas = {
+            (normalizar(zona), normalizar(ciudad)): centro
+            for ciudad, datos in CIUDADES.items() for zona, centro in datos[5].items()
+        }
+        self.stats = {"llamadas": 0, "errores_inyectados": 0, "sin_resultados": 0}
+
+    def resolver(self, direccion: str) -> Optional[Tuple[float, float]]:
+        zona, _, ciudad = direccion.rpartition(",")
+        return self.zonas.get((normalizar(zona), normalizar(ciudad)))
+
+    async def geocodificar(self, request: Request):
+        self.stats["llamadas"] += 1
+        await asyncio.sleep(max(0.0, self.rnd.gauss(self.latencia, self.jitter)))
+        if self.rnd.random() < self.errores:
+            self.stats["errores_inyectados"] += 1
+            return JSONResponse({"status": "OVER_QUERY_LIMIT", "results": []})
+        centro = self.resolver(request.query_params.get("address", ""))
+        if centro is None:
+            self.stats["sin_resultados"] += 1
+            return JSONResponse({"status": "ZERO_RESULTS", "results": []})
+        lat, lng = centro
+        return JSONResponse({"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}]})
+
+# Lo justo de Redis para CacheCompartidaRedis: PING, AUTH, SELECT, GET, SET (con PX), DEL, INCR y FLUSHDB, en memoria
+class RedisStub:
+    def __init__(self):
+        self.datos: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.stats = {"comandos": 0, "get": 0, "get_aciertos": 0, "set": 0, "bytes": 0}
+
+    @staticmethod
+    def _respuesta(valor) -> bytes:
+        if valor is None:
+            return b"$-1\r\n"
+        if isinstance(valor, int):
+            return b":%d\r\n" % valor
+        if isinstance(valor, str):
+            return b"+" + valor.encode() + b"\r\n"
+        return b"$%d\r\n%s\r\n" % (len(valor), valor)
+
+    def _leer(self, clave: bytes) -> Optional[bytes]:
+        entrada = self.datos.get(clave)
+        if entrada is None:
+            return None
+        if entrada[1] is not None and entrada[1] <= time.monotonic():
+            del self.datos[clave]
+            return None
+        return entrada[0]
+
+    def ejecutar(self, partes: List[bytes]) -> bytes:
+        self.stats["comandos"] += 1
+        comando = partes[0].upper()
+        if comando in (b"PING", b"AUTH", b"SELECT"):
+            return self._respuesta("OK" if comando != b"PING" else "PONG")
+        if comando == b"GET":
+            self.stats["get"] += 1
+            valor = self._leer(partes[1])
+            self.stats["get_aciertos"] += valor is not None
+            return self._respuesta(valor)
+        if comando == b"SET":
+            caduca = None
+            if len(partes) >= 5 and partes[3].upper() == b"PX":
+                caduca = time.monotonic() + int(partes[4]) / 1000
+            self.datos[partes[1]] = (partes[2], caduca)
+            self.stats["set"] += 1
+            self.stats["bytes"] += len(partes[2])
+            return self._respuesta("OK")
+        if comando == b"DEL":
+            return self._respuesta(sum(self.datos.pop(c, None) is not None for c in partes[1:]))
+        if comando == b"INCR":
+            valor = int(self._leer(partes[1]) or 0) + 1
+            self.datos[partes[1]] = (str(valor).encode(), None)
+            return self._respuesta(valor)
+        if comando == b"FLUSHDB":
+            self.datos.clear()
+            return self._respuesta("OK")
+        return b"-ERR comando no soportado\r\n"
+
+    async def atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                cabecera = await lector.readline()
+                if not cabecera:
+                    break
+                partes = []
+                for _ in range(int(cabecera[1:])):
+                    largo = int((await lector.readline())[1:])
+                    partes.append((await lector.readexactly(largo + 2))[:-2])
+                escritor.write(self.ejecutar(partes))
+                await escritor.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            escritor.close()
+
+def crear_app(args, redis: Optional[RedisStub] = None) -> Starlette:
+    inicio = time.perf_counter()
+    registros = generar_restaurantes(args.restaurantes, args.semilla)
+    airtable = AirtableStub(
+        registros, args.latencia_airtable_ms / 1000, args.jitter_ms / 1000, args.errores_airtable,
+        args.limite_rps, args.retry_after
+    )
+    geocoding = GeocodingStub(args.latencia_geo_ms / 1000, args.jitter_ms / 1000, args.errores_geo)
+    print(f"{len(registros)} restaurantes sintéticos generados en {time.perf_counter() - inicio:.1f} s", flush=True)
+
+    async def stats(request: Request):
+        if request.method == "DELETE":
+            for contadores in (airtable.stats, geocoding.stats):
+                for clave in contadores:
+                    contadores[clave] = 0
+            if redis is not None:
+                for clave in redis.stats:
+                    redis.stats[clave] = 0
+        stats = {"airtable": airtable.stats, "geocoding": geocoding.stats}
+        if redis is not None:
+            stats["redis"] = redis.stats
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v0/{base}/{tabla}", airtable.listar),
+        Route("/maps/api/geocode/json", geocoding.geocodificar),
+        Route("/__stats", stats, methods=["GET", "DELETE"]),
+    ])
+
+def parsear_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Airtable y Google Geocoding locales para los benchmarks")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--restaurantes", type=int, default=20000)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--latencia-airtable-ms", type=float, default=150)
+    parser.add_argument("--latencia-geo-ms", type=float, default=60)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--errores-airtable", type=float, default=0.0, help="fracción de 429/503 inyectados")
+    parser.add_argument("--errores-geo", type=float, default=0.0, help="fracción de OVER_QUERY_LIMIT inyectados")
+    parser.add_argument("--limite-rps", type=float, default=5, help="429 por encima de N req/s como Airtable (0 = sin límite)")
+    parser.add_argument("--retry-after", type=float, default=1,
+                        help="segundos de Retry-After en los 429 (0 = no mandarlo, como Airtable)")
+    parser.add_argument("--puerto-resp", type=int, default=0, help="puerto del Redis de pruebas (0 = sin él)")
+    return parser.parse_args(argv)
+
+async def servir(args):
+    redis = RedisStub() if args.puerto_resp else None
+    servidor = uvicorn.Server(uvicorn.Config(crear_app(args, redis), host="127.0.0.1", port=args.puerto,
+                                             log_level="warning"))
+    if redis is not None:
+        await asyncio.start_server(redis.atender, "127.0.0.1", args.puerto_resp)
+    await servidor.serve()
+
+if __name__ == "__main__":
+    asyncio.run(servir(parsear_argumentos()))
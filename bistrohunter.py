@@ -1,14 +1,27 @@
 # IMPORTS (NO TOCAR)
 import os
-from typing import Optional, List, Tuple
-from fastapi import FastAPI, Query, HTTPException, Request
-from datetime import datetime
-import requests
+from typing import Optional, List, Tuple, Sequence, AsyncIterator
+from fastapi import HTTPException
+from datetime import datetime, timezone
+import time
+import math
+import asyncio
+import contextvars
+import httpx
 import logging
-from math import radians, cos, sin, asin, sqrt
-
-# Desplegar fast api (no tocar)
-app = FastAPI()
+from urllib.parse import quote
+from geo import haversine, calcular_bounding_box, leer_coordenada, ordenar_por_proximidad, dentro_del_radio
+from singleflight import vuelo_geocodificacion, vuelo_airtable
+from metricas import metricas
+from planificador import planificador_airtable, AirtableError, PRIORIDAD_INTERACTIVA, PRIORIDAD_FONDO
+from nomenclator import nomenclator
+from cache import cache_geocodificacion, cache_resultados, clave_busqueda
+from filtros import ConsultaRestaurantes, CAMPO_FILTRO, FILTROS, escapar_cadena, formula_y, formula_fuera_de_bbox
+from catalogo import (
+    catalogo, clave_nbh2, TABLA_RESTAURANTES, VISTA_RESTAURANTES, CATALOGO_ACTIVO, CATALOGO_REFRESCO_SEGUNDOS,
+    CATALOGO_SNAPSHOT_PATH, CATALOGO_SNAPSHOT_RETRASO_SEGUNDOS, CATALOGO_SYNC_SEGUNDOS, CATALOGO_SYNC_SOLAPE_SEGUNDOS
+)
+from snapshot import Snapshot, escribir_snapshot
 
 # Configuración del logging
 logging.basicConfig(level=logging.INFO)
@@ -18,61 +31,123 @@ BASE_ID = os.getenv('BASE_ID')
 AIRTABLE_PAT = os.getenv('AIRTABLE_PAT')
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL')
+# URLs de las APIs externas. Los benchmarks las apuntan a los servidores de pruebas de benchmarks/servidores_stub.py
+AIRTABLE_API_URL = os.getenv('AIRTABLE_API_URL', 'https://api.airtable.com/v0').rstrip('/')
+GEOCODING_API_URL = os.getenv('GEOCODING_API_URL', 'https://maps.googleapis.com/maps/api/geocode/json')
+# Token con el que n8n llama a /api/catalogo/webhook (sin token el webhook está desactivado)
+CATALOGO_WEBHOOK_TOKEN = os.getenv('CATALOGO_WEBHOOK_TOKEN')
 
-# Calcula la distancia haversiana entre dos puntos (lo uso para el filtro de zona)
-def haversine(lon1, lat1, lon2, lat2):
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    km = 6367 * c
-    return km
-    
-# Calculamos la bounding_box dependiendo del punto central de búsqueda (coordenadas del centro de la ciudad o del "centro" de la zona que pide el cliente)
-def calcular_bounding_box(lat, lon, radio_km=1):
-    # Aproximación: 1 grado de latitud ~ 111.32 km
-    km_por_grado_lat = 111.32
-    delta_lat = radio_km / km_por_grado_lat
-
-    # Para la longitud, depende de la latitud
-    cos_lat = cos(radians(lat))
-    km_por_grado_lon = 111.32 * cos_lat
-    delta_lon = radio_km / km_por_grado_lon
-
-    lat_min = lat - delta_lat
-    lat_max = lat + delta_lat
-    lon_min = lon - delta_lon
-    lon_max = lon + delta_lon
+# Campos de Airtable que necesita la respuesta de /api/getRestaurantsPrueba (fields[] en las peticiones).
+# El catálogo local necesita además google_reviews para poder filtrar por plato
+CAMPOS_RESPUESTA = [
+    "cid", "title", "bh_message", "price_range", "NBH2", "url",
+    "location/lat", "location/lng", "categories_string"
+]
+CAMPOS_CATALOGO = CAMPOS_RESPUESTA + ["google_reviews"]
+
+# Radio máximo (km) hasta el que se amplía la búsqueda por coordenadas
+RADIO_MAXIMO_KM = 20
+# Llamadas a Airtable (páginas incluidas) que puede hacer una búsqueda por coordenadas sin catálogo local
+RADIO_MAX_LLAMADAS = int(os.getenv('RADIO_MAX_LLAMADAS', 5))
+# Registros que se quieren en la caja final de una búsqueda por coordenadas: su círculo inscrito (pi/4 del área)
+# tiene entonces unos 110, margen de sobra para los 80
+RADIO_OBJETIVO_CAJA = 140
+# Parte del radio consultado que se da por cerrada al ir dando resultados por partes (la bbox se calcula con
+# 111,32 km/grado y la distancia con haversine, que no coinciden del todo en los bordes)
+MARGEN_RADIO_CONFIRMADO = 0.98
+
+# Búsquedas con varias zonas: cuántas zonas se resuelven a la vez y cuánto esperamos como mucho a cada una
+ZONAS_CONCURRENCIA = int(os.getenv('ZONAS_CONCURRENCIA', 4))
+ZONA_TIMEOUT_SEGUNDOS = float(os.getenv('ZONA_TIMEOUT_SEGUNDOS', 8))
+
+# Búsquedas en lote (POST /api/getRestaurantsPrueba/lote): máximo de búsquedas por lote y cuántas van a la vez
+LOTE_MAX_BUSQUEDAS = int(os.getenv('LOTE_MAX_BUSQUEDAS', 20))
+LOTE_CONCURRENCIA = int(os.getenv('LOTE_CONCURRENCIA', 4))
+# Las cajas que se solapan se descargan juntas si su envolvente no pasa de estas veces la suma de sus áreas
+LOTE_REGION_MAX_AREA = float(os.getenv('LOTE_REGION_MAX_AREA', 2))
+
+# Cliente HTTP compartido para Airtable y Google (pool keep-alive por host, timeouts explícitos y concurrencia acotada)
+HTTP_TIMEOUT = httpx.Timeout(
+    connect=float(os.getenv('HTTP_CONNECT_TIMEOUT', 3)),
+    read=float(os.getenv('HTTP_READ_TIMEOUT', 10)),
+    write=10.0,
+    pool=float(os.getenv('HTTP_POOL_TIMEOUT', 5))
+)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv('HTTP_MAX_CONNECTIONS', 40)),
+    max_keepalive_connections=int(os.getenv('HTTP_MAX_KEEPALIVE', 20)),
+    keepalive_expiry=30.0
+)
+HTTP_MAX_CONCURRENCIA = int(os.getenv('HTTP_MAX_CONCURRENCIA', 20))
 
+_cliente_http: Optional[httpx.AsyncClient] = None
+_semaforo_http: Optional[asyncio.Semaphore] = None
+
+def obtener_cliente_http() -> httpx.AsyncClient:
+    global _cliente_http
+    if _cliente_http is None or _cliente_http.is_closed:
+        _cliente_http = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    return _cliente_http
+
+# Se llama al apagar la app para liberar las conexiones del pool
+async def cerrar_cliente_http():
+    global _cliente_http
+    if _cliente_http is not None and not _cliente_http.is_closed:
+        await _cliente_http.aclose()
+    _cliente_http = None
+
+# GET asíncrono a través del cliente compartido. El semáforo limita las peticiones simultáneas hacia fuera
+async def http_get(url: str, **kwargs) -> httpx.Response:
+    global _semaforo_http
+    if _semaforo_http is None:
+        _semaforo_http = asyncio.Semaphore(HTTP_MAX_CONCURRENCIA)
+    async with _semaforo_http:
+        return await obtener_cliente_http().get(url, **kwargs)
+
+# Función que obtiene las coordenadas de la zona que ha especificado el cliente
+async def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optional[dict]:
+    # Primero el nomenclátor de zonas (sin red, admite variantes y erratas). Si la zona tiene polígono va en la
+    # respuesta para filtrar por la forma real del barrio
+    zona_conocida = nomenclator.buscar(zona, ciudad)
+    if zona_conocida is not None:
+        return {
+            "location": zona_conocida.location,
+            "bounding_box": zona_conocida.bounding_box(radio_km),
+            "zona": zona_conocida
+        }
+
+    # Las zonas se repiten mucho: miramos primero la caché (memoria y disco) antes de llamar a Google.
+    # Si ya hay una geocodificación idéntica en marcha esperamos a esa en vez de lanzar otra
+    location = await cache_geocodificacion.obtener_compartida(zona, ciudad)
+    if location is None:
+        location = await vuelo_geocodificacion.ejecutar(
+            cache_geocodificacion.clave(zona, ciudad),
+            lambda: geocodificar_zona(zona, ciudad)
+        )
+    if location is None:
+        return None
     return {
-        "lat_min": lat_min,
-        "lat_max": lat_max,
-        "lon_min": lon_min,
-        "lon_max": lon_max
+        "location": location,
+        "bounding_box": calcular_bounding_box(location['lat'], location['lng'], radio_km)
     }
 
-# Función que obtiene las coordenadas de la zona que ha especificado el cliente
-def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optional[dict]:
+# Llamada a la API de geocodificación de Google. Devuelve la location ({lat, lng}) o None
+async def geocodificar_zona(zona: str, ciudad: str) -> Optional[dict]:
     try:
-        url = f"https://maps.googleapis.com/maps/api/geocode/json"
+        url = GEOCODING_API_URL
         params = {
             "address": f"{zona}, {ciudad}",
             "key": GOOGLE_MAPS_API_KEY,
             "components": "country:ES"
         }
-        response = requests.get(url, params=params)
+        response = await http_get(url, params=params)
         data = response.json()
         if data['status'] == 'OK':
             geometry = data['results'][0]['geometry']
             location = geometry['location']
-            lat_central = location['lat']
-            lon_central = location['lng']
-            bounding_box = calcular_bounding_box(lat_central, lon_central, radio_km)
-            return {
-                "location": location,
-                "bounding_box": bounding_box
-            }
+            await cache_geocodificacion.guardar(zona, ciudad, location)
+            nomenclator.aprender(zona, ciudad, location)
+            return location
         else:
             logging.error(f"Error en la geocodificación: {data['status']}")
             return None
@@ -81,14 +156,406 @@ def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optiona
         return None
 
 # Petición a Airtable en la vista de BistroHunter
-def airtable_request(url, headers, params, view_id: Optional[str] = None):
+# Pasa por el planificador (límite de 5 req/s, prioridad y reintentos). Si Airtable no responde bien lanza AirtableError,
+# para no confundir un 429/5xx con "no hay restaurantes"
+async def airtable_request(url, headers, params, view_id: Optional[str] = None, prioridad: int = PRIORIDAD_INTERACTIVA):
     if view_id:
         params["view"] = view_id
-    response = requests.get(url, headers=headers, params=params)
-    return response.json() if response.status_code == 200 else None
+    # Peticiones idénticas simultáneas comparten una sola llamada a Airtable. La prioridad va en la clave: una búsqueda
+    # de usuario no se queda esperando a una petición de fondo (que hace cola detrás y tiene un deadline de minutos)
+    clave = (url, tuple(sorted((k, str(v)) for k, v in params.items())), prioridad)
+    # Lo que espera quien llama (cola del planificador y reintentos incluidos); el trabajo de fondo va aparte
+    tipo = "interactiva" if prioridad == PRIORIDAD_INTERACTIVA else "fondo"
+    with metricas.medir("airtable" if prioridad == PRIORIDAD_INTERACTIVA else "airtable_fondo"):
+        response_data = await vuelo_airtable.ejecutar(clave, lambda: airtable_get(url, headers, params, prioridad))
+    metricas.observar(metricas.airtable_registros, len(response_data.get('records', [])), tipo)
+    return response_data
+
+async def airtable_get(url, headers, params, prioridad: int = PRIORIDAD_INTERACTIVA):
+    response = await planificador_airtable.ejecutar(
+        lambda: http_get(url, headers=headers, params=params),
+        prioridad=prioridad
+    )
+    return response.json()
+
+# Recorre las páginas de una consulta a Airtable siguiendo el 'offset'. Es un generador: quien lo usa puede
+# parar en cuanto tenga bastantes registros y así no se piden más páginas de la cuenta
+async def paginar_airtable(url, headers, params, view_id: Optional[str] = None, max_registros: Optional[int] = None,
+                           prioridad: int = PRIORIDAD_INTERACTIVA) -> AsyncIterator[List[dict]]:
+    params = dict(params)
+    recogidos = 0
+    while True:
+        if max_registros is not None:
+            params["pageSize"] = max(1, min(100, max_registros - recogidos))
+        response_data = await airtable_request(url, headers, dict(params), view_id=view_id, prioridad=prioridad)
+        registros = response_data.get('records', [])
+        if max_registros is not None:
+            registros = registros[:max_registros - recogidos]
+        recogidos += len(registros)
+        yield registros
+
+        offset = response_data.get('offset')
+        if not offset or (max_registros is not None and recogidos >= max_registros):
+            return
+        params["offset"] = offset
+
+# Consulta paginada de la vista de BistroHunter hasta juntar max_registros. Con 'campos' solo se descargan esos fields
+async def airtable_buscar(url, headers, params, max_registros: int = 80, campos: Optional[List[str]] = None) -> dict:
+    params = dict(params)
+    if campos:
+        params["fields[]"] = list(campos)
+    registros = []
+    async for pagina in paginar_airtable(url, headers, params, view_id=VISTA_RESTAURANTES, max_registros=max_registros):
+        registros.extend(pagina)
+    return {"records": registros}
+
+# Regiones que el lote en curso ya ha descargado de Airtable: [(bounding_box, registros por NBH2 desc, corte)].
+# El corte es la clave NBH2 del último registro si la descarga se quedó sin todos (None si está entera)
+_regiones_lote: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("regiones_lote", default=None)
+
+def _bbox_contenida(interior: dict, exterior: dict) -> bool:
+    return (exterior['lat_min'] <= interior['lat_min'] and interior['lat_max'] <= exterior['lat_max']
+            and exterior['lon_min'] <= interior['lon_min'] and interior['lon_max'] <= exterior['lon_max'])
+
+# Registro con solo los fields pedidos (las regiones del lote traen además los campos por los que se filtra)
+def proyectar_registro(registro: dict, campos: Optional[List[str]]) -> dict:
+    if not campos:
+        return registro
+    fields = registro.get('fields', {})
+    return {**registro, 'fields': {campo: fields[campo] for campo in campos if campo in fields}}
+
+# Consulta de una bounding box: si el catálogo local está listo se resuelve en memoria, si no vamos a Airtable.
+# Dentro de un lote, si la caja cae en una región ya descargada se filtra en local (mismo resultado que la fórmula:
+# mismo orden por NBH2 y el predicado equivalente). Si la región no se descargó entera solo vale cuando los
+# max_registros primeros quedan por encima del corte (todos los de más NBH2 que el corte sí han llegado)
+async def consultar_restaurantes(url, headers, params, consulta: ConsultaRestaurantes, bounding_box: dict,
+                                 campos: Optional[List[str]] = None):
+    max_registros = params.get("maxRecords", 80)
+    if catalogo.listo:
+        with metricas.medir("catalogo"):
+            return {"records": catalogo.buscar_bbox(bounding_box, consulta, max_registros)}
+    for region, registros, corte in _regiones_lote.get() or ():
+        if _bbox_contenida(bounding_box, region):
+            predicado = consulta.con_bbox(bounding_box).predicado()
+            encontrados = []
+            for registro in registros:
+                if corte is not None and clave_nbh2(registro) >= corte:
+                    break
+                if predicado(registro.get('fields', {})):
+                    encontrados.append(proyectar_registro(registro, campos))
+                    if len(encontrados) >= max_registros:
+                        break
+            if corte is None or len(encontrados) >= max_registros:
+                return {"records": encontrados}
+            break
+    return await airtable_buscar(url, headers, params, max_registros=max_registros, campos=campos)
+
+# Descargamos la tabla entera de la vista (paginando con offset) para el catálogo local.
+# Solo los campos que usan las búsquedas (CAMPOS_CATALOGO). Con 'formula' solo los registros que la cumplen
+async def descargar_restaurantes(formula: Optional[str] = None, prioridad: int = PRIORIDAD_FONDO) -> List[dict]:
+    url = f"{AIRTABLE_API_URL}/{BASE_ID}/{TABLA_RESTAURANTES}"
+    headers = {
+        "Authorization": f"Bearer {AIRTABLE_PAT}",
+    }
+    params = {"pageSize": 100, "fields[]": CAMPOS_CATALOGO}
+    if formula:
+        params["filterByFormula"] = formula
+    registros = []
+    async for pagina in paginar_airtable(url, headers, params, view_id=VISTA_RESTAURANTES, prioridad=prioridad):
+        registros.extend(pagina)
+    return registros
+
+# Registros concretos de la vista, por id (de 50 en 50 para no hacer URLs enormes)
+async def descargar_restaurantes_por_id(ids: List[str], prioridad: int = PRIORIDAD_INTERACTIVA) -> List[dict]:
+    registros = []
+    for inicio in range(0, len(ids), 50):
+        condiciones = ", ".join(f"RECORD_ID() = '{escapar_cadena(i)}'" for i in ids[inicio:inicio + 50])
+        registros.extend(await descargar_restaurantes(f"OR({condiciones})", prioridad=prioridad))
+    return registros
+
+# Comprueba si un registro sigue existiendo en la tabla, pidiéndolo por id (sin vista ni fórmula). False solo cuando
+# Airtable responde 404; cualquier otro fallo se propaga como AirtableError
+async def registro_existe(id_registro: str, prioridad: int = PRIORIDAD_INTERACTIVA) -> bool:
+    url = f"{AIRTABLE_API_URL}/{BASE_ID}/{TABLA_RESTAURANTES}/{quote(id_registro, safe='')}"
+    headers = {
+        "Authorization": f"Bearer {AIRTABLE_PAT}",
+    }
+    try:
+        await planificador_airtable.ejecutar(lambda: http_get(url, headers=headers), prioridad=prioridad)
+    except AirtableError as e:
+        if e.status_code == 404:
+            return False
+        raise
+    return True
+
+# Snapshot en disco todavía válido (lo acaba de escribir este u otro worker), o None
+def abrir_snapshot_reciente() -> Optional[Snapshot]:
+    if not CATALOGO_SNAPSHOT_PATH or not os.path.exists(CATALOGO_SNAPSHOT_PATH):
+        return None
+    try:
+        snapshot = Snapshot(CATALOGO_SNAPSHOT_PATH)
+    except (OSError, ValueError) as e:
+        logging.warning(f"No se pudo abrir el snapshot del catálogo {CATALOGO_SNAPSHOT_PATH}: {e}")
+        return None
+    if time.time() - snapshot.metadatos.get('descargado_en', snapshot.creado_en) >= CATALOGO_REFRESCO_SEGUNDOS:
+        return None
+    return snapshot
+
+# Escribe el snapshot en un hilo (son unos cientos de ms con la tabla entera) y lo devuelve abierto
+async def guardar_snapshot(registros: List[dict], descargado_en: float, marca_agua: float,
+                           creado_en: Optional[float] = None) -> Snapshot:
+    metadatos = {"descargado_en": descargado_en, "marca_agua": marca_agua}
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: escribir_snapshot(registros, CATALOGO_SNAPSHOT_PATH, creado_en=creado_en, metadatos=metadatos)
+    )
+    return Snapshot(CATALOGO_SNAPSHOT_PATH)
+
+# Reescritura del snapshot con los cambios que han llegado por el webhook, para que los demás workers recojan también
+# las bajas. No se hace en cada webhook: se espera CATALOGO_SNAPSHOT_RETRASO_SEGUNDOS y se escribe una vez con todo lo
+# que haya llegado (si llega algo mientras se escribe, se vuelve a programar)
+_snapshot_pendiente = False
+_tarea_snapshot: Optional[asyncio.Task] = None
+
+def programar_snapshot():
+    global _snapshot_pendiente, _tarea_snapshot
+    _snapshot_pendiente = True
+    if _tarea_snapshot is None or _tarea_snapshot.done():
+        _tarea_snapshot = asyncio.create_task(reescribir_snapshot())
+
+async def reescribir_snapshot():
+    global _snapshot_pendiente
+    while _snapshot_pendiente:
+        await asyncio.sleep(CATALOGO_SNAPSHOT_RETRASO_SEGUNDOS)
+        _snapshot_pendiente = False
+        if catalogo.cargado_en is None:
+            return
+        generacion, creado_en = catalogo.generacion, time.time()
+        try:
+            await guardar_snapshot(catalogo.registros_vigentes(), catalogo.descargado_en, catalogo.marca_agua,
+                                   creado_en=creado_en)
+        except (OSError, ValueError) as e:
+            logging.error(f"No se pudo reescribir el snapshot del catálogo: {e}")
+            return
+        # Lo que hay en memoria ya es lo que se acaba de escribir (o más nuevo): este worker no lo vuelve a cargar
+        if catalogo.generacion == generacion:
+            catalogo.cargado_en = max(catalogo.cargado_en, creado_en)
+
+# Descarga completa de la tabla. Se hace al arrancar (si no hay snapshot) y cada CATALOGO_REFRESCO_SEGUNDOS, que es
+# cuando se recogen las bajas que no han llegado por el webhook y los registros que han salido de la vista
+async def refrescar_catalogo():
+    inicio = time.monotonic()
+    descargado_en = time.time()
+    registros = await descargar_restaurantes()
+    if CATALOGO_SNAPSHOT_PATH:
+        try:
+            registros = await guardar_snapshot(registros, descargado_en, descargado_en)
+        except (OSError, ValueError) as e:
+            # Sin disco seguimos con los registros en memoria
+            logging.error(f"No se pudo escribir el snapshot del catálogo: {e}")
+    catalogo.reemplazar(registros, descargado_en=descargado_en)
+    logging.info(f"Catálogo local cargado: {len(registros)} restaurantes en {time.monotonic() - inicio:.1f}s")
+
+# Trae de Airtable solo los registros modificados desde la marca de agua (con un margen por si los relojes no cuadran;
+# lo que llega repetido y sin cambios se ignora) y los aplica sobre el catálogo
+async def sincronizar_cambios():
+    inicio = time.time()
+    desde = datetime.fromtimestamp(catalogo.marca_agua - CATALOGO_SYNC_SOLAPE_SEGUNDOS, timezone.utc)
+    registros = await descargar_restaurantes(
+        f"IS_AFTER(LAST_MODIFIED_TIME(), '{desde.strftime('%Y-%m-%dT%H:%M:%S.000Z')}')"
+    )
+    if registros:
+        resumen = await aplicar_cambios_catalogo(registros)
+        if resumen["cambiados"]:
+            logging.info(f"Catálogo local: {resumen['cambiados']} restaurantes modificados, "
+                         f"{resumen['busquedas_invalidadas']} búsquedas de la caché invalidadas")
+    catalogo.marcar_sincronizado(inicio)
+
+# Mapea el snapshot del disco si es más nuevo que lo que hay en memoria (también al arrancar, antes de calentar las
+# cachés). Devuelve si lo ha cargado
+def cargar_snapshot_catalogo() -> bool:
+    if not CATALOGO_ACTIVO:
+        return False
+    snapshot = abrir_snapshot_reciente()
+    if snapshot is None or (catalogo.cargado_en is not None and snapshot.creado_en <= catalogo.cargado_en):
+        return False
+    inicio = time.monotonic()
+    catalogo.reemplazar(snapshot)
+    logging.info(f"Catálogo local cargado del snapshot: {len(snapshot)} restaurantes "
+                 f"en {time.monotonic() - inicio:.1f}s")
+    return True
+
+# Un paso de la tarea de fondo: si otro worker ha dejado un snapshot más nuevo lo mapeamos; si toca la descarga
+# completa (o no hay catálogo) la hacemos; si no, solo pedimos los cambios
+async def sincronizar_catalogo():
+    cargar_snapshot_catalogo()
+    if catalogo.descargado_en is None or time.time() - catalogo.descargado_en >= CATALOGO_REFRESCO_SEGUNDOS:
+        await refrescar_catalogo()
+    elif CATALOGO_SYNC_SEGUNDOS:
+        await sincronizar_cambios()
 
-# Buscamos los restaurantes que tenemos en ddbb en función de las variables que nos pidió el cliente
-def obtener_restaurantes_por_ciudad(
+# Tarea de fondo (se lanza al arrancar la app): carga el catálogo y lo mantiene al día con cambios incrementales cada
+# CATALOGO_SYNC_SEGUNDOS. Mientras no esté cargado, o si se queda viejo, las búsquedas siguen yendo a Airtable.
+# Después de cada carga se construye el índice de texto en un hilo (hasta entonces los filtros de texto van por columnas)
+async def tarea_refresco_catalogo():
+    if not CATALOGO_ACTIVO:
+        return
+    while True:
+        try:
+            await sincronizar_catalogo()
+        except Exception as e:
+            logging.error(f"Error al sincronizar el catálogo local: {e}")
+        try:
+            await catalogo.indexar_texto()
+        except Exception as e:
+            logging.error(f"Error al construir el índice de texto del catálogo: {e}")
+        await asyncio.sleep(CATALOGO_SYNC_SEGUNDOS or CATALOGO_REFRESCO_SEGUNDOS)
+
+# (lat, lng) de un registro, o None si no tiene coordenadas
+def punto_registro(registro: dict) -> Optional[Tuple[float, float]]:
+    fields = registro.get('fields', {})
+    lat, lng = leer_coordenada(fields, 'location/lat'), leer_coordenada(fields, 'location/lng')
+    return (lat, lng) if lat is not None and lng is not None else None
+
+def _en_bbox(bounding_box: dict, punto: Tuple[float, float]) -> bool:
+    lat, lng = punto
+    return (bounding_box['lat_min'] <= lat <= bounding_box['lat_max']
+            and bounding_box['lon_min'] <= lng <= bounding_box['lon_max'])
+
+# ¿Puede haber cambiado una búsqueda de la caché de resultados? Sí si devolvió alguno de los restaurantes cambiados o
+# si algún punto afectado cae dentro de lo que abarcó: la bbox de cada zona o, en búsquedas por coordenadas, el
+# círculo hasta el restaurante más lejano devuelto (la bbox de RADIO_MAXIMO_KM si no llegó a 80)
+def busqueda_afectada(clave: tuple, valor: tuple, ids: set, puntos: list) -> bool:
+    restaurantes, _, lat_centro, lon_centro = valor
+    if any(clave_registro(r) in ids for r in restaurantes):
+        return True
+    if not puntos:
+        return False
+    ciudad, zonas = clave[0], clave[1]
+    radio_km = dict(clave[-1]).get('radio_km', 1.0)
+    if zonas:
+        for zona_item in zonas:
+            zona_conocida = nomenclator.buscar(zona_item, ciudad, contar=False)
+            if zona_conocida is not None:
+                bounding_box = zona_conocida.bounding_box(radio_km)
+            else:
+                location = cache_geocodificacion.en_memoria(zona_item, ciudad)
+                if location is None:
+                    return True
+                bounding_box = calcular_bounding_box(location['lat'], location['lng'], radio_km)
+            if any(_en_bbox(bounding_box, punto) for punto in puntos):
+                return True
+        return False
+    if lat_centro is None or lon_centro is None:
+        return True
+    if len(restaurantes) >= 80:
+        distancias = []
+        for registro in restaurantes:
+            punto = punto_registro(registro)
+            if punto is not None:
+                distancias.append(haversine(lon_centro, lat_centro, punto[1], punto[0]))
+        alcance = max(distancias, default=RADIO_MAXIMO_KM)
+        return any(haversine(lon_centro, lat_centro, lng, lat) <= alcance for lat, lng in puntos)
+    bounding_box = calcular_bounding_box(lat_centro, lon_centro, RADIO_MAXIMO_KM)
+    return any(_en_bbox(bounding_box, punto) for punto in puntos)
+
+# Aplica cambios sueltos al catálogo local e invalida solo las búsquedas cacheadas a las que afectan.
+# Sin catálogo cargado solo queda la caché de resultados
+async def aplicar_cambios_catalogo(actualizados: List[dict], eliminados: Sequence[str] = ()) -> dict:
+    if catalogo.cargado_en is not None:
+        ids, puntos = catalogo.aplicar_cambios(actualizados, eliminados)
+    else:
+        ids = {r.get('id') for r in actualizados if r.get('id')} | set(eliminados)
+        puntos = [p for p in map(punto_registro, actualizados) if p is not None]
+    invalidadas = 0
+    if ids:
+        invalidadas = await cache_resultados.invalidar_si(lambda clave, valor: busqueda_afectada(clave, valor, ids, puntos))
+    return {"cambiados": len(ids), "busquedas_invalidadas": invalidadas}
+
+# Cambios que manda la automatización (n8n) al webhook del catálogo:
+#   "registros": registros completos de Airtable ({"id", "fields"}), que se aplican tal cual
+#   "ids": ids que se vuelven a pedir a Airtable. Los que no salen en la vista solo se dan de baja si al pedirlos
+#          por id Airtable confirma que ya no existen (404); si existen se dejan como están hasta la siguiente
+#          sincronización (una lectura de la vista a medias no puede borrar restaurantes del catálogo)
+#   "eliminados": ids de registros borrados
+# Después se programa la reescritura del snapshot para que los demás workers recojan también las bajas
+async def procesar_webhook_catalogo(datos: dict) -> dict:
+    registros = [r for r in datos.get('registros') or [] if isinstance(r, dict) and isinstance(r.get('id'), str)]
+    eliminados = [i for i in datos.get('eliminados') or [] if isinstance(i, str)]
+    ids = [i for i in datos.get('ids') or [] if isinstance(i, str)]
+    if ids:
+        recibidos = await descargar_restaurantes_por_id(ids)
+        registros.extend(recibidos)
+        encontrados = {r.get('id') for r in recibidos}
+        ausentes = list(dict.fromkeys(i for i in ids if i not in encontrados))
+        existen = await asyncio.gather(*(registro_existe(i) for i in ausentes))
+        eliminados.extend(i for i, existe in zip(ausentes, existen) if not existe)
+        sin_confirmar = [i for i, existe in zip(ausentes, existen) if existe]
+        if sin_confirmar:
+            logging.warning(f"Webhook del catálogo: {len(sin_confirmar)} registros no salen en la vista pero siguen "
+                            f"existiendo, no se dan de baja: {sin_confirmar[:10]}")
+
+    resumen = await aplicar_cambios_catalogo(registros, eliminados)
+    if resumen["cambiados"] and catalogo.cargado_en is not None and CATALOGO_SNAPSHOT_PATH:
+        programar_snapshot()
+    return resumen
+
+# Clave única de un registro de Airtable (el id del registro; si no viniera, el cid)
+def clave_registro(registro: dict):
+    return registro.get('id') or registro.get('fields', {}).get('cid') or id(registro)
+
+# Añade a 'destino' los registros que todavía no están, comprobando contra el set de claves ya vistas (O(1) por registro)
+def agregar_sin_duplicados(destino: list, claves_vistas: set, registros: list) -> int:
+    nuevos = 0
+    with metricas.medir("fusion"):
+        for registro in registros:
+            clave = clave_registro(registro)
+            if clave in claves_vistas:
+                continue
+            claves_vistas.add(clave)
+            destino.append(registro)
+            nuevos += 1
+    return nuevos
+
+# Búsqueda de una sola zona: la geocodificamos y consultamos su bounding box.
+# Devuelve (location_zona, fórmula, respuesta) o None si la zona no se encuentra
+async def buscar_en_zona(zona_item: str, city: str, radio_km: float, url: str, headers: dict,
+                         consulta: ConsultaRestaurantes,
+                         campos: Optional[List[str]] = None) -> Optional[tuple]:
+    with metricas.medir("geocodificacion"):
+        location_zona = await obtener_coordenadas_zona(zona_item, city, radio_km)
+    if not location_zona:
+        logging.error(f"Zona '{zona_item}' no encontrada.")
+        return None
+
+    bounding_box = location_zona['bounding_box']
+    final_filter_formula = consulta.con_bbox(bounding_box).a_formula()
+    logging.debug(
+        f"Fórmula de filtro construida para zona '{zona_item}': {final_filter_formula}"
+    )
+
+    params = {
+        "filterByFormula": final_filter_formula,
+        "sort[0][field]": "NBH2",
+        "sort[0][direction]": "desc",
+        "maxRecords": 80
+    }
+
+    response_data = await consultar_restaurantes(url, headers, params, consulta, bounding_box, campos)
+
+    # Zona con polígono: de la caja nos quedamos con lo que cae dentro del barrio
+    zona_conocida = location_zona.get('zona')
+    if zona_conocida is not None and zona_conocida.poligono and response_data and 'records' in response_data:
+        dentro = []
+        for registro in response_data['records']:
+            punto = punto_registro(registro)
+            if punto is not None and zona_conocida.contiene(*punto):
+                dentro.append(registro)
+        response_data = {**response_data, 'records': dentro}
+    return location_zona, final_filter_formula, response_data
+
+# Buscamos los restaurantes que tenemos en ddbb en función de las variables que nos pidió el cliente.
+# Pasa por la caché de resultados: la misma búsqueda (normalizada) se sirve de memoria durante RESULT_CACHE_TTL
+async def obtener_restaurantes_por_ciudad(
     city: str,
     dia_semana: Optional[str] = None,
     price_range: Optional[str] = None,
@@ -98,12 +565,140 @@ def obtener_restaurantes_por_ciudad(
     zona: Optional[str] = None,
     coordenadas: Optional[str] = None, 
     radio_km: float = 1.0,
-    sort_by_proximity: bool = True
+    sort_by_proximity: bool = True,
+    campos: Optional[List[str]] = None,
+    usar_cache: bool = True
 ) -> Tuple[list, Optional[str], Optional[float], Optional[float]]:
+    zona, coordenadas = normalizar_ubicacion(city, zona, coordenadas)
+
+    async def calcular():
+        return await buscar_restaurantes(
+            city=city, dia_semana=dia_semana, price_range=price_range, cocina=cocina, diet=diet, dish=dish,
+            zona=zona, coordenadas=coordenadas, radio_km=radio_km, sort_by_proximity=sort_by_proximity,
+            campos=campos
+        )
+
+    if not usar_cache:
+        return await calcular()
+
+    clave = clave_resultados(
+        city, zona=zona, coordenadas=coordenadas, price_range=price_range, cocina=cocina, diet=diet, dish=dish,
+        dia_semana=dia_semana, radio_km=radio_km, sort_by_proximity=sort_by_proximity, campos=campos
+    )
+    return await cache_resultados.obtener_o_calcular(clave, calcular)
+
+# Como obtener_restaurantes_por_ciudad pero por partes (ver buscar_restaurantes_por_partes), para responder en
+# streaming. Pasa por la caché con una sola llamada a obtener_o_calcular: si la búsqueda está (o ya la está calculando
+# otra petición) sale entera de una vez; si la calcula esta petición, las partes se van mandando según llegan por una
+# cola y al terminar queda guardada en la caché como cualquier otra
+async def obtener_restaurantes_por_partes(
+    city: str,
+    dia_semana: Optional[str] = None,
+    price_range: Optional[str] = None,
+    cocina: Optional[str] = None,
+    diet: Optional[str] = None,
+    dish: Optional[str] = None,
+    zona: Optional[str] = None,
+    coordenadas: Optional[str] = None,
+    radio_km: float = 1.0,
+    sort_by_proximity: bool = True,
+    campos: Optional[List[str]] = None
+) -> AsyncIterator[tuple]:
+    zona, coordenadas = normalizar_ubicacion(city, zona, coordenadas)
+    parametros = dict(
+        city=city, dia_semana=dia_semana, price_range=price_range, cocina=cocina, diet=diet, dish=dish,
+        zona=zona, coordenadas=coordenadas, radio_km=radio_km, sort_by_proximity=sort_by_proximity, campos=campos
+    )
+    clave = clave_resultados(**parametros)
+    partes: asyncio.Queue = asyncio.Queue()
+    calculado = []
+
+    async def calcular():
+        final = None
+        async for tipo, valor in buscar_restaurantes_por_partes(**parametros):
+            if tipo == "parcial":
+                partes.put_nowait(valor)
+            else:
+                final = valor
+        calculado.append(final)
+        return final
+
+    tarea = asyncio.ensure_future(cache_resultados.obtener_o_calcular(clave, calcular))
+    siguiente = None
+    try:
+        while not tarea.done():
+            siguiente = asyncio.ensure_future(partes.get())
+            await asyncio.wait((tarea, siguiente), return_when=asyncio.FIRST_COMPLETED)
+            if siguiente.done():
+                yield "parcial", siguiente.result()
+            siguiente.cancel()
+        valor = tarea.result()
+    finally:
+        # Si el cliente corta, la búsqueda sigue en su vuelo (singleflight) y se guarda en la caché igual
+        tarea.cancel()
+        if siguiente is not None:
+            siguiente.cancel()
+
+    # La hemos calculado aquí: quedan por mandar las últimas partes. Si no (acierto, stale o la calculaba otra
+    # petición), va entera
+    if calculado and calculado[0] is valor:
+        while not partes.empty():
+            yield "parcial", partes.get_nowait()
+    elif valor[0]:
+        yield "parcial", valor[0]
+    yield "final", valor
+
+# Las zonas del nomenclátor van por su nombre canónico ("malasana" y "Barrio de Malasaña" son la misma búsqueda).
+# Las coordenadas se buscan tal cual: solo la clave de la caché las ajusta a su celda (clave_busqueda), para que
+# búsquedas a pocos metros compartan resultado sin mover el centro de las que se calculan
+def normalizar_ubicacion(city: str, zona: Optional[str], coordenadas: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    if zona:
+        return nomenclator.canonizar(zona, city), coordenadas
+    return zona, coordenadas
+
+# Clave de la caché de resultados de una búsqueda (con la ubicación ya normalizada)
+def clave_resultados(city: str, dia_semana: Optional[str] = None, price_range: Optional[str] = None,
+                     cocina: Optional[str] = None, diet: Optional[str] = None, dish: Optional[str] = None,
+                     zona: Optional[str] = None, coordenadas: Optional[str] = None, radio_km: float = 1.0,
+                     sort_by_proximity: bool = True, campos: Optional[List[str]] = None) -> tuple:
+    return clave_busqueda(
+        city, zona=zona, coordenadas=coordenadas, price_range=price_range, cocina=cocina, diet=diet, dish=dish,
+        dia_semana=dia_semana, radio_km=radio_km, sort_by_proximity=sort_by_proximity,
+        campos=tuple(campos) if campos else None
+    )
+
+# La búsqueda en sí (sin caché)
+async def buscar_restaurantes(**parametros) -> Tuple[list, Optional[str], Optional[float], Optional[float]]:
+    resultado = None
+    async for tipo, valor in buscar_restaurantes_por_partes(**parametros):
+        if tipo == "final":
+            resultado = valor
+    return resultado
+
+# La búsqueda por partes: va dando ("parcial", [restaurantes]) en cuanto sabe que esos restaurantes están en el
+# resultado final y en su posición definitiva (juntando los parciales en orden sale el resultado entero), y al final
+# ("final", (restaurantes, fórmula, lat, lng)) igual que buscar_restaurantes.
+#   - Por zonas: cada zona en cuanto termina ella y las anteriores.
+#   - Por coordenadas contra Airtable: en cada vuelta que no llega a 80 la bbox consultada está completa, así que
+#     todo lo que está a menos de ese radio ya no se lo puede quitar nadie de los 80 más cercanos.
+async def buscar_restaurantes_por_partes(
+    city: str,
+    dia_semana: Optional[str] = None,
+    price_range: Optional[str] = None,
+    cocina: Optional[str] = None,
+    diet: Optional[str] = None,
+    dish: Optional[str] = None,
+    zona: Optional[str] = None,
+    coordenadas: Optional[str] = None, 
+    radio_km: float = 1.0,
+    sort_by_proximity: bool = True,
+    campos: Optional[List[str]] = None
+) -> AsyncIterator[tuple]:
     
+    tareas_zonas = []
     try:
         table_name = 'Restaurantes DB'
-        url = f"https://api.airtable.com/v0/{BASE_ID}/{table_name}"
+        url = f"{AIRTABLE_API_URL}/{BASE_ID}/{table_name}"
         headers = {
             "Authorization": f"Bearer {AIRTABLE_PAT}",
         }
@@ -112,59 +707,16 @@ def obtener_restaurantes_por_ciudad(
         lat_centro_busqueda = None  
         lon_centro_busqueda = None  
 
-        # 1) Construimos los filtros base (price_range, cocina, diet, dish)
-        base_filters = []
-
-        # --- price_range ---
-        if price_range:
-            ranges = price_range.split(',')
-            if len(ranges) == 1:
-                # Caso de un solo rango
-                base_filters.append(
-                    f"FIND('{price_range.strip()}', ARRAYJOIN({{price_range}}, ', ')) > 0"
-                )
-            else:
-                # Caso de varios rangos
-                conditions = [
-                    f"FIND('{r.strip()}', ARRAYJOIN({{price_range}}, ', ')) > 0"
-                    for r in ranges
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
-
-        # --- cocina ---
-        if cocina:
-            cocinas = cocina.split(',')
-            if len(cocinas) == 1:
-                base_filters.append(
-                    f"SEARCH('{cocina.strip()}', {{categories_string}}) > 0"
-                )
-            else:
-                conditions = [
-                    f"SEARCH('{c.strip()}', {{categories_string}}) > 0"
-                    for c in cocinas
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
-
-        # --- diet ---
-        if diet:
-            base_filters.append(f"SEARCH('{diet.strip()}', {{categories_string}}) > 0")
-
-        # --- dish ---
-        if dish:
-            dishes = dish.split(',')
-            if len(dishes) == 1:
-                base_filters.append(
-                    f"SEARCH('{dish.strip()}', {{google_reviews}}) > 0"
-                )
-            else:
-                conditions = [
-                    f"SEARCH('{d.strip()}', {{google_reviews}}) > 0"
-                    for d in dishes
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
+        # 1) Construimos los filtros base (price_range, cocina, diet, dish). La consulta estructurada se compila
+        # a fórmula de Airtable (con los valores escapados) o se evalúa en local sobre el catálogo
+        consulta = ConsultaRestaurantes.desde_parametros(
+            price_range=price_range, cocina=cocina, diet=diet, dish=dish
+        )
 
         restaurantes_encontrados = []
+        ids_encontrados = set()
         final_filter_formula = None  
+        emitidos = 0
 
         # 2) SI hay ZONA
         if zona:
@@ -174,54 +726,51 @@ def obtener_restaurantes_por_ciudad(
                 [zona]
             )
 
-            for index, zona_item in enumerate(zonas_list):
-                location_zona = obtener_coordenadas_zona(zona_item, city, radio_km)
-                if not location_zona:
-                    logging.error(f"Zona '{zona_item}' no encontrada.")
-                    continue
+            # Todas las zonas van en paralelo (como mucho ZONAS_CONCURRENCIA a la vez). Si una zona falla o tarda
+            # más de ZONA_TIMEOUT_SEGUNDOS se descarta sin bloquear al resto. Juntamos en el mismo orden de zonas
+            semaforo_zonas = asyncio.Semaphore(ZONAS_CONCURRENCIA)
 
-                
-                lat_centro_busqueda = location_zona['location']['lat']
-                lon_centro_busqueda = location_zona['location']['lng']
+            async def buscar_zona_limitada(zona_item):
+                async with semaforo_zonas:
+                    return await asyncio.wait_for(
+                        buscar_en_zona(zona_item, city, radio_km, url, headers, consulta, campos),
+                        timeout=ZONA_TIMEOUT_SEGUNDOS
+                    )
 
-                bounding_box = location_zona['bounding_box']
-                lat_min = bounding_box['lat_min']
-                lat_max = bounding_box['lat_max']
-                lon_min = bounding_box['lon_min']
-                lon_max = bounding_box['lon_max']
+            tareas_zonas = [asyncio.ensure_future(buscar_zona_limitada(zona_item)) for zona_item in zonas_list]
+            # CANTIDAD MÁXIMA DE RESTAURANTES QUE SE DEVUELVEN (AJUSTAR A VOLUNTAD)
+            max_total_restaurantes = len(zonas_list) * 80
 
-                
-                zone_filters = base_filters.copy()
-                zone_filters.append(f"{{location/lat}} >= {lat_min}")
-                zone_filters.append(f"{{location/lat}} <= {lat_max}")
-                zone_filters.append(f"{{location/lng}} >= {lon_min}")
-                zone_filters.append(f"{{location/lng}} <= {lon_max}")
+            errores_airtable = []
+            for zona_item, tarea in zip(zonas_list, tareas_zonas):
+                try:
+                    resultado_zona = await tarea
+                except Exception as e:
+                    resultado_zona = e
+                if isinstance(resultado_zona, Exception):
+                    logging.error(f"Error al buscar en la zona '{zona_item}': {resultado_zona!r}")
+                    if isinstance(resultado_zona, AirtableError):
+                        errores_airtable.append(resultado_zona)
+                    continue
+                if resultado_zona is None:
+                    continue
 
-                
-                final_filter_formula = f"AND({', '.join(zone_filters)})"
+                location_zona, final_filter_formula, response_data = resultado_zona
+                lat_centro_busqueda = location_zona['location']['lat']
+                lon_centro_busqueda = location_zona['location']['lng']
 
-                logging.info(
-                    f"Fórmula de filtro construida para zona '{zona_item}': {final_filter_formula}"
-                )
+                if response_data and 'records' in response_data:
+                    agregar_sin_duplicados(restaurantes_encontrados, ids_encontrados, response_data['records'])
 
-                params = {
-                    "filterByFormula": final_filter_formula,
-                    "sort[0][field]": "NBH2",
-                    "sort[0][direction]": "desc",
-                    "maxRecords": 80
-                }
+                nuevos = restaurantes_encontrados[emitidos:max_total_restaurantes]
+                if nuevos:
+                    emitidos += len(nuevos)
+                    yield "parcial", nuevos
 
-                response_data = airtable_request(url, headers, params, view_id="viw6z7g5ZZs3mpy3S")
-                if response_data and 'records' in response_data:
-                    
-                    nuevos_restaurantes = [
-                        r for r in response_data['records']
-                        if r not in restaurantes_encontrados
-                    ]
-                    restaurantes_encontrados.extend(nuevos_restaurantes)
+            # Si Airtable ha fallado y no tenemos nada, no podemos decir que "no hay restaurantes"
+            if errores_airtable and not restaurantes_encontrados:
+                raise errores_airtable[0]
 
-            # CANTIDAD MÁXIMA DE RESTAURANTES QUE SE DEVUELVEN (AJUSTAR A VOLUNTAD)
-            max_total_restaurantes = len(zonas_list) * 80
             restaurantes_encontrados = restaurantes_encontrados[:max_total_restaurantes]
 
         # 3) SI NO hay ZONA, utilizamos coordenadas (y un radio incremental)
@@ -247,172 +796,300 @@ def obtener_restaurantes_por_ciudad(
 
             logging.info(f"Coordenadas procesadas: lat={lat_centro}, lon={lon_centro}")
 
-            # Agrandamos el radio de búsqueda hasta que tengamos 80 restaurantes (esto se puede cambiar según los que queramos)
-            while len(restaurantes_encontrados) < 80:
-                bounding_box = calcular_bounding_box(lat_centro, lon_centro, radio_km)
-                lat_min = bounding_box['lat_min']
-                lat_max = bounding_box['lat_max']
-                lon_min = bounding_box['lon_min']
-                lon_max = bounding_box['lon_max']
-
-                
-                geo_filters = base_filters.copy()
-                geo_filters.extend([
-                    f"{{location/lat}} >= {lat_min}",
-                    f"{{location/lat}} <= {lat_max}",
-                    f"{{location/lng}} >= {lon_min}",
-                    f"{{location/lng}} <= {lon_max}"
-                ])
-
-                final_filter_formula = f"AND({', '.join(geo_filters)})"
-                logging.info(
-                    f"Fórmula de filtro construida: location=({lat_centro}, {lon_centro}), bounding_box={final_filter_formula}"
-                )
-
-                params = {
-                    "filterByFormula": final_filter_formula,
-                    "sort[0][field]": "NBH2",
-                    "sort[0][direction]": "desc",
-                    "maxRecords": 80
-                }
-
-                response_data = airtable_request(url, headers, params, view_id="viw6z7g5ZZs3mpy3S")
-                if response_data and 'records' in response_data:
-                    nuevos_restaurantes = [
-                        r for r in response_data['records']
-                        if r not in restaurantes_encontrados
-                    ]
-                    restaurantes_encontrados.extend(nuevos_restaurantes)
-
-                if len(restaurantes_encontrados) >= 80:
-                    break
-
-                radio_km += 1
-                # Buscamos en un radio de HASTA 20 km. Esto se puede ajustar también (hablar con JaviB).
-                if radio_km > 20:
-                    break
+            # Buscamos los 80 restaurantes más cercanos en un radio de HASTA 20 km (RADIO_MAXIMO_KM, esto se puede ajustar también, hablar con JaviB).
+            # Con el catálogo local es una sola búsqueda sobre el índice. Contra Airtable se sondea el radio
+            # (buscar_cercanos_airtable) con como mucho RADIO_MAX_LLAMADAS llamadas, páginas incluidas, en lugar de 20
+            if catalogo.listo:
+                with metricas.medir("catalogo"):
+                    restaurantes_encontrados, radio_km = catalogo.buscar_cercanos(
+                        lat_centro, lon_centro, consulta,
+                        k=80, radio_inicial_km=radio_km, radio_max_km=RADIO_MAXIMO_KM
+                    )
+                metricas.anotar("radio", f"{radio_km:g} km")
+                final_filter_formula = consulta.con_bbox(
+                    calcular_bounding_box(lat_centro, lon_centro, radio_km)
+                ).a_formula()
+            else:
+                sondeo = SondeoRadio()
+                async for confirmados in buscar_cercanos_airtable(
+                        url, headers, consulta, lat_centro, lon_centro, radio_km, sort_by_proximity, campos, sondeo):
+                    if len(confirmados) > emitidos:
+                        yield "parcial", confirmados[emitidos:]
+                        emitidos = len(confirmados)
+                restaurantes_encontrados = sondeo.registros
+                radio_km, final_filter_formula = sondeo.radio_km, sondeo.formula
 
-            # 4) Ordenar por proximidad
+            # 4) Ordenar por proximidad (vectorizado) y quedarnos con los primeros 80
             if sort_by_proximity and restaurantes_encontrados:
-                restaurantes_encontrados.sort(
-                    key=lambda r: haversine(
-                        lon_centro,
-                        lat_centro,
-                        float(r['fields'].get('location/lng', 0)),
-                        float(r['fields'].get('location/lat', 0))
+                with metricas.medir("orden_proximidad"):
+                    restaurantes_encontrados = ordenar_por_proximidad(
+                        restaurantes_encontrados, lat_centro, lon_centro, k=80
                     )
-                )
-
-            # Tomamos los primeros 80
-            restaurantes_encontrados = restaurantes_encontrados[:80]
+            else:
+                restaurantes_encontrados = restaurantes_encontrados[:80]
 
         
-        return (
+        if len(restaurantes_encontrados) > emitidos:
+            yield "parcial", restaurantes_encontrados[emitidos:]
+        yield "final", (
             restaurantes_encontrados,
             final_filter_formula,
             lat_centro_busqueda,
             lon_centro_busqueda
         )
 
+    except AirtableError as e:
+        logging.error(f"Airtable no disponible al buscar restaurantes: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Airtable no está disponible ahora mismo, inténtalo de nuevo en unos segundos"
+        )
     except Exception as e:
         logging.error(f"Error al obtener restaurantes de la ciudad: {e}")
         raise HTTPException(
             status_code=500,
             detail="Error al obtener restaurantes de la ciudad"
         )
-#Procesa las variables que nos ha dado el cliente (creo que actualmente no se usa, se usaba cuando había que transformar la fecha?)
-@app.post("/procesar-variables")
-async def procesar_variables(request: Request):
-    try:
-        data = await request.json()
-        logging.info(f"Datos recibidos: {data}")
-        
-        city = data.get('city')
-        date = data.get('date')
-        price_range = data.get('price_range')
-        cocina = data.get('cocina')
-        diet = data.get('diet')
-        dish = data.get('dish')
-        zona = data.get('zona')
-        coordenadas = data.get('coordenadas')
-
-        if not city:
-            raise HTTPException(status_code=400, detail="La variable 'city' es obligatoria.")
-
-        dia_semana = None
-        if date:
-            try:
-                fecha = datetime.strptime(date, "%Y-%m-%d")
-                dia_semana = obtener_dia_semana(fecha)
-            except ValueError:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="La fecha proporcionada no tiene el formato correcto (YYYY-MM-DD)."
-                )
-        
-        restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda = obtener_restaurantes_por_ciudad(
-            city=city,
-            dia_semana=dia_semana,
-            price_range=price_range,
-            cocina=cocina,
-            diet=diet,
-            dish=dish,
-            zona=zona,
-            coordenadas=coordenadas
+    finally:
+        # Si quien consume deja de leer a medias, las zonas que sigan en marcha no hacen falta
+        for tarea in tareas_zonas:
+            tarea.cancel()
+# Búsqueda por coordenadas contra Airtable: los 80 más cercanos dentro de la bbox de RADIO_MAXIMO_KM, con como mucho
+# RADIO_MAX_LLAMADAS llamadas (cada página de 100 cuenta). Airtable no sabe contar ni ordenar por distancia, así que
+# se sondea el radio:
+#   - cada caja se pide ordenada por NBH2, sin la parte que ya se leyó entera (formula_fuera_de_bbox);
+#   - si llega entera, lo que cae en su círculo inscrito es definitivo (se va dando por partes) y con la densidad que
+#     ha salido se calcula el radio cuya caja tendría unos RADIO_OBJETIVO_CAJA (como mucho x4 cada vez);
+#   - si no llega entera (zona densa) no sabemos cuántos hay: se prueba con un cuarto del radio (1/16 del área), o
+#     con el punto medio si ya hay un radio menor leído entero.
+# Se termina cuando una caja leída entera tiene 80 en su círculo o es la de RADIO_MAXIMO_KM. Si antes se acaban las
+# llamadas, la respuesta son los más cercanos de lo descargado, que pueden no ser los 80 más cercanos de verdad: se
+# avisa en el log y en la métrica bistrohunter_busqueda_llamadas_radio{resultado="aproximado"}.
+# Sin sort_by_proximity basta la primera caja con 80 (los 80 de más NBH2, como antes)
+class SondeoRadio:
+    def __init__(self):
+        self.registros: List[dict] = []
+        self.radio_km = 0.0
+        self.formula: Optional[str] = None
+        self.llamadas = 0
+        self.exacto = False
+
+async def buscar_cercanos_airtable(url, headers, consulta: ConsultaRestaurantes, lat_centro: float, lon_centro: float,
+                                   radio_km: float, sort_by_proximity: bool, campos: Optional[List[str]],
+                                   sondeo: SondeoRadio) -> AsyncIterator[List[dict]]:
+    ids_encontrados = set()
+    # Mayor radio cuya caja se ha leído entera y cuántos registros tiene
+    radio_completo, registros_completo = 0.0, 0
+    paginas = 1
+    radio = min(radio_km, RADIO_MAXIMO_KM)
+    while sondeo.llamadas < RADIO_MAX_LLAMADAS:
+        bounding_box = calcular_bounding_box(lat_centro, lon_centro, radio)
+        sondeo.radio_km = radio
+        sondeo.formula = consulta.con_bbox(bounding_box).a_formula()
+        formula = sondeo.formula
+        if sort_by_proximity and radio_completo > 0:
+            formula = formula_y(formula, formula_fuera_de_bbox(
+                calcular_bounding_box(lat_centro, lon_centro, radio_completo)
+            ))
+        max_registros = min(paginas, RADIO_MAX_LLAMADAS - sondeo.llamadas) * 100 if sort_by_proximity else 80
+        params = {
+            "filterByFormula": formula,
+            "sort[0][field]": "NBH2",
+            "sort[0][direction]": "desc",
+            "maxRecords": max_registros
+        }
+        if campos:
+            params["fields[]"] = list(campos)
+        registros = []
+        async for pagina in paginar_airtable(url, headers, params, view_id=VISTA_RESTAURANTES,
+                                             max_registros=max_registros):
+            sondeo.llamadas += 1
+            registros.extend(pagina)
+        agregar_sin_duplicados(sondeo.registros, ids_encontrados, registros)
+        completa = len(registros) < max_registros
+
+        if not sort_by_proximity:
+            if not completa or radio >= RADIO_MAXIMO_KM:
+                sondeo.exacto = True
+                break
+            radio = min(radio * 4, RADIO_MAXIMO_KM)
+            continue
+
+        if completa:
+            radio_completo, registros_completo = radio, registros_completo + len(registros)
+            # (margen porque la bbox usa 111.32 km/grado y haversine un radio terrestre de 6367 km)
+            confirmados = dentro_del_radio(sondeo.registros, lat_centro, lon_centro, radio * MARGEN_RADIO_CONFIRMADO)
+            yield confirmados
+            if len(confirmados) >= 80 or radio >= RADIO_MAXIMO_KM:
+                sondeo.exacto = True
+                break
+            estimado = radio * math.sqrt(RADIO_OBJETIVO_CAJA / max(registros_completo, 1))
+            radio = min(max(estimado, radio * 1.25), radio * 4, RADIO_MAXIMO_KM)
+            paginas = 2
+        else:
+            radio = (radio_completo + radio) / 2 if radio_completo > 0 else radio / 4
+            paginas = 2 if radio_completo > 0 else 1
+
+    if not sondeo.exacto:
+        logging.warning(
+            f"Búsqueda por coordenadas ({lat_centro}, {lon_centro}) aproximada: {RADIO_MAX_LLAMADAS} llamadas "
+            f"a Airtable sin cerrar los 80 más cercanos (radio leído entero: {radio_completo:g} km)"
         )
+    metricas.observar(metricas.llamadas_radio, sondeo.llamadas, "exacto" if sondeo.exacto else "aproximado")
+    metricas.anotar("radio", f"{sondeo.llamadas} llamadas, {sondeo.radio_km:g} km"
+                             + ("" if sondeo.exacto else ", aproximado"))
 
-        
-        full_url = str(request.url)
-        request_method = request.method
+# BÚSQUEDAS EN LOTE: varias búsquedas de una misma conversación (la misma zona con distintas cocinas, varias zonas
+# candidatas...) resueltas juntas. Cada zona distinta se geocodifica una sola vez; sin catálogo local, las cajas de
+# zona que se solapan se descargan de Airtable en una sola consulta sin filtros de texto y cada búsqueda se filtra
+# en local; y las búsquedas van en paralelo (LOTE_CONCURRENCIA a la vez)
+estadisticas_lote = {
+    "lotes": 0, "busquedas": 0, "zonas_geocodificadas": 0,
+    "regiones": 0, "regiones_incompletas": 0, "regiones_descartadas": 0,
+}
 
-        
-        http_request_info = f'{request_method} {full_url} HTTP/1.1 200 OK'
-        
-        # Si no se encontraron restaurantes:
-        if not restaurantes:
-            return {
-                "request_info": http_request_info,
-                "variables": {
-                    "city": city,
-                    "zone": zona,
-                    "cuisine_type": cocina,
-                    "price_range": price_range,
-                    "date": date,
-                    "alimentary_restrictions": diet,
-                    "specific_dishes": dish
-                },
-                "mensaje": "No se encontraron restaurantes con los filtros aplicados."
-            }
-        
-        
-        resultados = []
-        for restaurante in restaurantes:
-            fields = restaurante.get('fields', {})
-            resultados.append({
-                "bh_message": fields.get('bh_message', 'Sin descripción'),
-                "url": fields.get('url', 'No especificado'),
-                "lat_restaurante": fields.get('location/lat', None), 
-                "lon_restaurante": fields.get('location/lng', None),
-                "categories_string": fields.get('categories_string', None)
-            })
-        
-    
-        return {
-            "request_info": http_request_info,
-            "variables": {
-                "city": city,
-                "zone": zona,
-                "cuisine_type": cocina,
-                "price_range": price_range,
-                "date": date,
-                "alimentary_restrictions": diet,
-                "specific_dishes": dish
-            },
-            "search_center_lat": lat_centro_busqueda,  
-            "search_center_lng": lon_centro_busqueda,  
-            "resultados": resultados
-        }
-    
-    except Exception as e:
-        logging.error(f"Error al procesar variables: {e}")
-        return {"error": "Ocurrió un error al procesar las variables"}
+def _solapan(a: dict, b: dict) -> bool:
+    return (a['lat_min'] <= b['lat_max'] and b['lat_min'] <= a['lat_max']
+            and a['lon_min'] <= b['lon_max'] and b['lon_min'] <= a['lon_max'])
+
+def _envolvente(a: dict, b: dict) -> dict:
+    return {
+        "lat_min": min(a['lat_min'], b['lat_min']), "lat_max": max(a['lat_max'], b['lat_max']),
+        "lon_min": min(a['lon_min'], b['lon_min']), "lon_max": max(a['lon_max'], b['lon_max']),
+    }
+
+# Junta las cajas que se solapan (también de forma encadenada). Devuelve [(caja envolvente, nº de cajas)]
+def agrupar_cajas(cajas: List[dict]) -> List[Tuple[dict, int]]:
+    grupos = [(caja, 1) for caja in cajas]
+    juntado = True
+    while juntado:
+        juntado = False
+        resultado = []
+        for caja, n in grupos:
+            for i, (otra, m) in enumerate(resultado):
+                if _solapan(caja, otra):
+                    resultado[i] = (_envolvente(caja, otra), n + m)
+                    juntado = True
+                    break
+            else:
+                resultado.append((caja, n))
+        grupos = resultado
+    return grupos
+
+# Área de una caja en grados² (solo para comparar cajas de la misma zona entre sí)
+def _area(caja: dict) -> float:
+    return (caja['lat_max'] - caja['lat_min']) * (caja['lon_max'] - caja['lon_min'])
+
+# Campos que hay que descargar de una región para poder filtrar en local las consultas que caen en ella: los de la
+# respuesta más las coordenadas y los textos de los filtros que se usan (google_reviews solo si se filtra por plato).
+# None si la respuesta lleva todos los campos
+def campos_region(consultas: List[ConsultaRestaurantes], campos: Optional[List[str]]) -> Optional[List[str]]:
+    if not campos:
+        return None
+    necesarios = ["location/lat", "location/lng", "NBH2"]
+    for consulta in consultas:
+        necesarios.extend(CAMPO_FILTRO[filtro] for filtro in FILTROS if getattr(consulta, filtro))
+    return list(campos) + [campo for campo in dict.fromkeys(necesarios) if campo not in campos]
+
+# Los restaurantes de una región, por NBH2 descendente, en como mucho 'paginas' páginas de Airtable. Devuelve
+# (registros, corte): si no caben todos, los que han llegado (los de más NBH2) y la clave NBH2 del último, que
+# todavía sirven a las búsquedas que completan sus resultados antes de ese corte
+async def precargar_region(region: dict, paginas: int,
+                           campos: Optional[List[str]] = None) -> Tuple[List[dict], Optional[float]]:
+    url = f"{AIRTABLE_API_URL}/{BASE_ID}/{TABLA_RESTAURANTES}"
+    headers = {"Authorization": f"Bearer {AIRTABLE_PAT}"}
+    max_registros = paginas * 100
+    params = {
+        "filterByFormula": ConsultaRestaurantes().con_bbox(region).a_formula(),
+        "sort[0][field]": "NBH2",
+        "sort[0][direction]": "desc",
+        "maxRecords": max_registros
+    }
+    registros = (await airtable_buscar(url, headers, params, max_registros=max_registros, campos=campos))['records']
+    if len(registros) >= max_registros:
+        estadisticas_lote["regiones_incompletas"] += 1
+        return registros, clave_nbh2(registros[-1])
+    estadisticas_lote["regiones"] += 1
+    return registros, None
+
+# Cada búsqueda es un dict con los parámetros de /api/getRestaurantsPrueba (city, zona, coordenadas, price_range,
+# cocina, diet, dish). Devuelve, en el mismo orden, lo que devolvería obtener_restaurantes_por_ciudad para cada
+# una o la excepción con la que ha fallado (un fallo no tumba el resto del lote)
+async def buscar_lote(busquedas: List[dict], campos: Optional[List[str]] = None) -> list:
+    estadisticas_lote["lotes"] += 1
+    estadisticas_lote["busquedas"] += len(busquedas)
+    normalizadas = []
+    for busqueda in busquedas:
+        zona, coordenadas = normalizar_ubicacion(busqueda['city'], busqueda.get('zona'), busqueda.get('coordenadas'))
+        normalizadas.append({**busqueda, 'zona': zona, 'coordenadas': coordenadas})
+
+    # 1) Cada zona distinta se geocodifica una sola vez, todas a la vez
+    zonas = {}
+    for busqueda in normalizadas:
+        for zona_item in (busqueda['zona'] or '').split(','):
+            if zona_item.strip():
+                clave = cache_geocodificacion.clave(zona_item.strip(), busqueda['city'])
+                zonas.setdefault(clave, (zona_item.strip(), busqueda['city']))
+    estadisticas_lote["zonas_geocodificadas"] += len(zonas)
+    with metricas.medir("geocodificacion"):
+        ubicaciones = await asyncio.gather(
+            *(obtener_coordenadas_zona(zona_item, ciudad, 1.0) for zona_item, ciudad in zonas.values()),
+            return_exceptions=True
+        )
+    ubicacion_por_zona = {
+        clave: ubicacion for clave, ubicacion in zip(zonas, ubicaciones) if isinstance(ubicacion, dict)
+    }
+
+    # 2) Sin catálogo: las consultas a Airtable que harían las búsquedas que no están en caché, y las regiones que
+    # juntan varias. Una región se descarga en como mucho (consultas - 1) páginas, así que nunca cuesta más que ir
+    # una a una. Airtable no tiene una forma barata de contar registros, así que antes de descargar se mira la forma:
+    # si la envolvente de las cajas encadenadas abarca más de LOTE_REGION_MAX_AREA veces lo que suman, casi todo lo
+    # que se bajaría quedaría fuera de las búsquedas y no llegaría a caber, y esas búsquedas van por su cuenta
+    regiones = []
+    if not catalogo.listo:
+        consultas = set()
+        for busqueda in normalizadas:
+            if not busqueda['zona'] or await cache_resultados.vigente(clave_resultados(**busqueda, campos=campos)):
+                continue
+            consulta = ConsultaRestaurantes.desde_parametros(
+                price_range=busqueda.get('price_range'), cocina=busqueda.get('cocina'),
+                diet=busqueda.get('diet'), dish=busqueda.get('dish')
+            )
+            for zona_item in busqueda['zona'].split(','):
+                ubicacion = ubicacion_por_zona.get(cache_geocodificacion.clave(zona_item.strip(), busqueda['city']))
+                if ubicacion is not None:
+                    consultas.add((tuple(sorted(ubicacion['bounding_box'].items())), consulta))
+        consultas_por_caja = {}
+        for caja, consulta in consultas:
+            consultas_por_caja.setdefault(caja, []).append(consulta)
+        grupos = []
+        for region, n in agrupar_cajas([dict(caja) for caja, _ in consultas]):
+            if n < 2:
+                continue
+            dentro = [caja for caja in consultas_por_caja if _bbox_contenida(dict(caja), region)]
+            if _area(region) > LOTE_REGION_MAX_AREA * sum(_area(dict(caja)) for caja in dentro):
+                estadisticas_lote["regiones_descartadas"] += 1
+                continue
+            grupos.append((region, n, campos_region([c for caja in dentro for c in consultas_por_caja[caja]], campos)))
+        descargas = await asyncio.gather(
+            *(precargar_region(region, n - 1, campos_grupo) for region, n, campos_grupo in grupos),
+            return_exceptions=True
+        )
+        for (region, _, _), descarga in zip(grupos, descargas):
+            if isinstance(descarga, Exception):
+                logging.warning(f"No se pudo precargar una región del lote: {descarga!r}")
+            else:
+                regiones.append((region, *descarga))
+
+    # 3) Las búsquedas en sí, en paralelo, viendo las regiones ya descargadas
+    semaforo = asyncio.Semaphore(LOTE_CONCURRENCIA)
+
+    async def buscar_una(busqueda):
+        async with semaforo:
+            return await obtener_restaurantes_por_ciudad(**busqueda, sort_by_proximity=True, campos=campos)
+
+    token = _regiones_lote.set(regiones)
+    try:
+        return await asyncio.gather(*(buscar_una(b) for b in normalizadas), return_exceptions=True)
+    finally:
+        _regiones_lote.reset(token)
@@ -0,0 +1,423 @@
+# Cachés de BistroHunter (geocodificación de zonas y resultados de búsqueda). Las dos pueden tener detrás un nivel
+# compartido entre procesos (ver cache_compartida.py)
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+import asyncio
+import unicodedata
+from typing import Optional, Callable, Awaitable, Any, Tuple
+from cachetools import TTLCache, LRUCache
+from singleflight import vuelo_busquedas
+from metricas import metricas
+from filtros import plegar_texto
+from cache_compartida import cache_compartida, serializar, deserializar, CACHE_COMPARTIDA_PREFIJO
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+GEOCODE_CACHE_PATH = os.getenv(
+    'GEOCODE_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'geocodes.sqlite3')
+)
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 24 * 3600))  # en memoria
+GEOCODE_CACHE_DISK_TTL = int(os.getenv('GEOCODE_CACHE_DISK_TTL', 90 * 24 * 3600))  # en disco
+GEOCODE_CACHE_MAXSIZE = int(os.getenv('GEOCODE_CACHE_MAXSIZE', 2048))
+
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 300))  # fresco
+RESULT_CACHE_STALE = int(os.getenv('RESULT_CACHE_STALE', 1800))  # después del TTL se sirve viejo mientras se refresca
+RESULT_CACHE_TTL_VACIOS = int(os.getenv('RESULT_CACHE_TTL_VACIOS', 60))  # búsquedas sin resultados
+RESULT_CACHE_MAXSIZE = int(os.getenv('RESULT_CACHE_MAXSIZE', 512))  # nº de búsquedas guardadas (LRU)
+RESULT_CACHE_DECIMALES = int(os.getenv('RESULT_CACHE_DECIMALES', 3))  # 3 decimales ~ celdas de 110 m
+# Cada cuánto se relee la generación de la caché compartida: una invalidación tarda como mucho esto en verse en
+# los demás procesos
+RESULT_CACHE_GENERACION_SEGUNDOS = float(os.getenv('RESULT_CACHE_GENERACION_SEGUNDOS', 1))
+
+# Normaliza un texto para usarlo en claves: minúsculas, sin tildes y con los espacios colapsados
+def normalizar_texto(texto: Optional[str]) -> str:
+    if not texto:
+        return ""
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+# Caché de coordenadas de zona: primero memoria (LRU con TTL), detrás un SQLite en disco que sobrevive a reinicios y,
+# si está configurada, la caché compartida con las demás instancias.
+# Solo guardamos la "location" (lat/lng); la bounding box depende del radio y se calcula cada vez.
+class CacheGeocodificacion:
+    def __init__(self, ruta: str = GEOCODE_CACHE_PATH, ttl: int = GEOCODE_CACHE_TTL,
+                 ttl_disco: int = GEOCODE_CACHE_DISK_TTL, maxsize: int = GEOCODE_CACHE_MAXSIZE,
+                 compartida=cache_compartida):
+        self.ruta = ruta
+        self.ttl_disco = ttl_disco
+        self.compartida = compartida
+        self._memoria = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._conexion = None
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.hits_compartida = 0
+        self.misses = 0
+
+    @staticmethod
+    def clave(zona: str, ciudad: str) -> str:
+        return f"{normalizar_texto(zona)}|{normalizar_texto(ciudad)}"
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self._conexion is None and self.ruta:
+            try:
+                os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+                self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+                self._conexion.execute(
+                    "CREATE TABLE IF NOT EXISTS geocodes ("
+                    "clave TEXT PRIMARY KEY, lat REAL NOT NULL, lng REAL NOT NULL, actualizado REAL NOT NULL)"
+                )
+                self._conexion.commit()
+            except sqlite3.Error as e:
+                # Sin disco seguimos funcionando solo con la memoria
+                logging.error(f"No se pudo abrir la caché de geocodificación en disco: {e}")
+                self.ruta = None
+                self._conexion = None
+        return self._conexion
+
+    # Lectura del SQLite (bloqueante: desde el event loop va por asyncio.to_thread, ver _local)
+    def _leer_disco(self, clave: str) -> Optional[dict]:
+        with self._lock:
+            db = self._db()
+            fila = None
+            if db is not None:
+                try:
+                    fila = db.execute(
+                        "SELECT lat, lng, actualizado FROM geocodes WHERE clave = ?", (clave,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logging.error(f"Error leyendo la caché de geocodificación: {e}")
+        if fila and time.time() - fila[2] < self.ttl_disco:
+            return {"lat": fila[0], "lng": fila[1]}
+        return None
+
+    def _escribir_disco(self, clave: str, location: dict):
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO geocodes (clave, lat, lng, actualizado) VALUES (?, ?, ?, ?)",
+                    (clave, location["lat"], location["lng"], time.time())
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Error guardando en la caché de geocodificación: {e}")
+
+    # (location, de dónde sale: "memoria" o "disco") o (None, None). El disco va en un hilo: con varios workers
+    # escribiendo en el mismo fichero la espera por el lock de SQLite no para el event loop
+    async def _local(self, clave: str) -> Tuple[Optional[dict], Optional[str]]:
+        location = self._memoria.get(clave)
+        if location is not None:
+            return location, "memoria"
+        if not self.ruta:
+            return None, None
+        location = await asyncio.to_thread(self._leer_disco, clave)
+        if location is not None:
+            self._memoria[clave] = location
+            return location, "disco"
+        return None, None
+
+    def _contar(self, origen: Optional[str]):
+        if origen == "memoria":
+            self.hits_memoria += 1
+        elif origen == "disco":
+            self.hits_disco += 1
+        elif origen == "compartida":
+            self.hits_compartida += 1
+        else:
+            self.misses += 1
+
+    # Solo lo que hay en memoria, sin contar en las estadísticas (para código síncrono dentro del event loop)
+    def en_memoria(self, zona: str, ciudad: str) -> Optional[dict]:
+        return self._memoria.get(self.clave(zona, ciudad))
+
+    # Memoria, disco y, si no está, la caché compartida (lo que trae se queda en memoria)
+    async def obtener_compartida(self, zona: str, ciudad: str) -> Optional[dict]:
+        clave = self.clave(zona, ciudad)
+        location, origen = await self._local(clave)
+        if location is None and self.compartida is not None:
+            datos = await self.compartida.obtener(f"{CACHE_COMPARTIDA_PREFIJO}geo:{clave}")
+            if datos is not None:
+                location, origen = deserializar(datos), "compartida"
+                self._memoria[clave] = location
+        self._contar(origen)
+        return location
+
+    async def guardar(self, zona: str, ciudad: str, location: dict):
+        clave = self.clave(zona, ciudad)
+        location = {"lat": location["lat"], "lng": location["lng"]}
+        self._memoria[clave] = location
+        if self.compartida is not None:
+            await self.compartida.guardar(
+                f"{CACHE_COMPARTIDA_PREFIJO}geo:{clave}", serializar(location), self.ttl_disco
+            )
+        if self.ruta:
+            await asyncio.to_thread(self._escribir_disco, clave, location)
+
+    # Todo lo guardado en disco que no ha caducado, como (zona, ciudad, lat, lng) con zona y ciudad normalizadas
+    def entradas(self) -> list:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return []
+            try:
+                filas = db.execute(
+                    "SELECT clave, lat, lng FROM geocodes WHERE actualizado > ?", (time.time() - self.ttl_disco,)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logging.error(f"Error leyendo la caché de geocodificación: {e}")
+                return []
+        return [(*clave.split("|", 1), lat, lng) for clave, lat, lng in filas if "|" in clave]
+
+    def estadisticas(self) -> dict:
+        aciertos = self.hits_memoria + self.hits_disco + self.hits_compartida
+        total = aciertos + self.misses
+        return {
+            "hits_memoria": self.hits_memoria,
+            "hits_disco": self.hits_disco,
+            "hits_compartida": self.hits_compartida,
+            "misses": self.misses,
+            "hit_ratio": round(aciertos / total, 4) if total else None,
+            "entradas_memoria": len(self._memoria),
+        }
+
+# Lista separada por comas sin importar orden ni espacios: " italiana,pizza " == "pizza, italiana". Con plegar, además
+# sin mayúsculas ni tildes, igual que comparan cocina, diet y dish (filtros.plegar_texto); price_range va tal cual
+def normalizar_lista(valor: Optional[str], plegar: bool = False) -> tuple:
+    if not valor:
+        return ()
+    valores = {v.strip() for v in valor.split(',') if v.strip()}
+    return tuple(sorted({plegar_texto(v) for v in valores} if plegar else valores))
+
+# Ajusta "lat,lng" al centro de su celda de la rejilla (RESULT_CACHE_DECIMALES). Si no se puede leer la dejamos igual
+# y ya dará el 400 la búsqueda
+def cuantizar_coordenadas(coordenadas: Optional[str], decimales: int = RESULT_CACHE_DECIMALES) -> Optional[str]:
+    if not coordenadas:
+        return coordenadas
+    try:
+        lat, lng = [float(c) for c in coordenadas.split(",")]
+    except ValueError:
+        return coordenadas
+    return f"{round(lat, decimales):.{decimales}f},{round(lng, decimales):.{decimales}f}"
+
+# Clave normalizada de una búsqueda (las zonas mantienen su orden porque decide el orden de los resultados)
+def clave_busqueda(city: str, zona: Optional[str] = None, coordenadas: Optional[str] = None,
+                   price_range: Optional[str] = None, cocina: Optional[str] = None, diet: Optional[str] = None,
+                   dish: Optional[str] = None, **extra) -> tuple:
+    zonas = tuple(normalizar_texto(z) for z in zona.split(',') if z.strip()) if zona else ()
+    return (
+        normalizar_texto(city),
+        zonas,
+        cuantizar_coordenadas(coordenadas),
+        normalizar_lista(price_range),
+        normalizar_lista(cocina, plegar=True),
+        plegar_texto((diet or "").strip()),
+        normalizar_lista(dish, plegar=True),
+        tuple(sorted(extra.items())),
+    )
+
+# Caché de resultados de búsqueda con stale-while-revalidate: durante el TTL se sirve tal cual; después, y hasta
+# TTL + STALE, se sirve la versión vieja y se lanza un refresco en segundo plano (uno solo por clave).
+# Tamaño acotado con LRU. Con caché compartida, lo que no está en memoria se busca allí y lo calculado se guarda en
+# las dos. Cada entrada lleva la generación con la que se empezó a calcular y solo vale mientras sea la vigente
+class CacheResultados:
+    def __init__(self, ttl: int = RESULT_CACHE_TTL, stale: int = RESULT_CACHE_STALE,
+                 ttl_vacios: int = RESULT_CACHE_TTL_VACIOS, maxsize: int = RESULT_CACHE_MAXSIZE,
+                 compartida=cache_compartida):
+        self.ttl = ttl
+        self.stale = stale
+        self.ttl_vacios = ttl_vacios
+        self.compartida = compartida
+        # clave -> (valor, creado, generación)
+        self._entradas = LRUCache(maxsize=maxsize)
+        self._refrescando = {}
+        self._generacion = 0
+        self._generacion_leida = 0.0
+        self.hits = 0
+        self.hits_stale = 0
+        self.misses = 0
+        self.traidas_compartida = 0
+        self.refrescos = 0
+        self.errores_refresco = 0
+        self.invalidadas = 0
+
+    def _ttl_de(self, valor) -> int:
+        # Los resultados vacíos duran menos (puede que simplemente aún no hubiera datos)
+        vacio = isinstance(valor, tuple) and not valor[0]
+        return self.ttl_vacios if vacio else self.ttl
+
+    # Generación vigente. Sin caché compartida siempre es 0; con ella se relee como mucho cada
+    # RESULT_CACHE_GENERACION_SEGUNDOS (si no se puede leer se sigue con la última conocida)
+    async def _generacion_actual(self) -> int:
+        if self.compartida is not None and time.monotonic() - self._generacion_leida >= RESULT_CACHE_GENERACION_SEGUNDOS:
+            self._generacion_leida = time.monotonic()
+            generacion = await self.compartida.generacion("resultados")
+            if generacion is not None:
+                self._generacion = generacion
+        return self._generacion
+
+    @staticmethod
+    def _clave_compartida(clave, generacion: int) -> str:
+        resumen = hashlib.blake2b(repr(clave).encode(), digest_size=16).hexdigest()
+        return f"{CACHE_COMPARTIDA_PREFIJO}res:{generacion}:{resumen}"
+
+    # (valor, creado, generación) de la memoria o, si no está, de la caché compartida. None si no hay
+    async def _entrada(self, clave):
+        generacion = await self._generacion_actual()
+        entrada = self._entradas.get(clave)
+        if entrada is not None and entrada[2] == generacion:
+            return entrada
+        if self.compartida is None:
+            return None
+        datos = await self.compartida.obtener(self._clave_compartida(clave, generacion))
+        if datos is None:
+            return None
+        try:
+            creado, valor = deserializar(datos)
+        except (ValueError, TypeError) as e:
+            logging.error(f"Entrada no válida en la caché compartida de resultados: {e}")
+            return None
+        entrada = (tuple(valor) if isinstance(valor, list) else valor, creado, generacion)
+        self._entradas[clave] = entrada
+        self.traidas_compartida += 1
+        return entrada
+
+    async def _guardar_entrada(self, clave, valor, generacion: int):
+        creado = time.time()
+        self._entradas[clave] = (valor, creado, generacion)
+        if self.compartida is None:
+            return
+        try:
+            datos = serializar([creado, valor])
+        except (TypeError, ValueError) as e:
+            logging.error(f"No se pudo serializar un resultado para la caché compartida: {e}")
+            return
+        await self.compartida.guardar(self._clave_compartida(clave, generacion), datos, self._ttl_de(valor) + self.stale)
+
+    async def obtener_o_calcular(self, clave, calcular: Callable[[], Awaitable[Any]]):
+        entrada = await self._entrada(clave)
+        if entrada is not None:
+            valor, creado, _ = entrada
+            edad = time.time() - creado
+            ttl = self._ttl_de(valor)
+            if edad < ttl:
+                self.hits += 1
+                metricas.anotar("cache", "hit")
+                return valor
+            if edad < ttl + self.stale:
+                self.hits_stale += 1
+                metricas.anotar("cache", "stale")
+                self._refrescar_en_segundo_plano(clave, calcular)
+                return valor
+
+        # Si ya se está calculando la misma búsqueda, esperamos a esa
+        self.misses += 1
+        metricas.anotar("cache", "miss")
+        return await vuelo_busquedas.ejecutar(clave, lambda: self._calcular_y_guardar(clave, calcular))
+
+    # Se guarda con la generación de antes de calcular: si alguien invalida mientras tanto, el resultado nace viejo
+    async def _calcular_y_guardar(self, clave, calcular: Callable[[], Awaitable[Any]]):
+        generacion = self._generacion
+        valor = await calcular()
+        await self._guardar_entrada(clave, valor, generacion)
+        return valor
+
+    def _refrescar_en_segundo_plano(self, clave, calcular: Callable[[], Awaitable[Any]]):
+        if clave in self._refrescando:
+            return
+
+        async def refrescar():
+            try:
+                generacion = self._generacion
+                valor = await calcular()
+                await self._guardar_entrada(clave, valor, generacion)
+                self.refrescos += 1
+            except Exception as e:
+                # Si falla seguimos sirviendo lo viejo hasta que caduque del todo
+                self.errores_refresco += 1
+                logging.error(f"Error al refrescar la caché de resultados: {e}")
+            finally:
+                self._refrescando.pop(clave, None)
+
+        # Guardamos la tarea para que no la recoja el recolector de basura a medias
+        self._refrescando[clave] = asyncio.create_task(refrescar())
+
+    # ¿Se serviría esta búsqueda de la caché (fresca o vieja)? Sin tocar los contadores de hits
+    async def vigente(self, clave) -> bool:
+        entrada = await self._entrada(clave)
+        if entrada is None:
+            return False
+        valor, creado, _ = entrada
+        return time.time() - creado < self._ttl_de(valor) + self.stale
+
+    # Sin clave, todo: con caché compartida se pasa a una generación nueva y deja de valer lo de todos los procesos
+    async def invalidar(self, clave=None):
+        if clave is None:
+            self._entradas.clear()
+            await self._nueva_generacion()
+        else:
+            self._entradas.pop(clave, None)
+            if self.compartida is not None:
+                await self.compartida.borrar(self._clave_compartida(clave, self._generacion))
+
+    async def _nueva_generacion(self) -> Optional[int]:
+        if self.compartida is None:
+            return None
+        generacion = await self.compartida.nueva_generacion("resultados")
+        if generacion is not None:
+            self._generacion = generacion
+            self._generacion_leida = time.monotonic()
+        return generacion
+
+    # Quita solo las búsquedas para las que predicado(clave, valor) es cierto. Devuelve cuántas.
+    # Las búsquedas de los demás procesos no se pueden revisar, así que con caché compartida se pasa a una generación
+    # nueva (que las invalida todas) y en este proceso se conservan, ya con la generación nueva, las no afectadas
+    async def invalidar_si(self, predicado: Callable[[Any, Any], bool]) -> int:
+        self._generacion_leida = 0.0
+        anterior = await self._generacion_actual()
+        invalidadas = 0
+        conservadas = []
+        for clave, entrada in list(self._entradas.items()):
+            if predicado(clave, entrada[0]):
+                self._entradas.pop(clave, None)
+                invalidadas += 1
+            elif entrada[2] == anterior:
+                conservadas.append((clave, entrada))
+        self.invalidadas += invalidadas
+        nueva = await self._nueva_generacion()
+        if nueva is not None:
+            for clave, (valor, creado, _) in conservadas:
+                if self._entradas.get(clave, (None, None, None))[1] == creado:
+                    self._entradas[clave] = (valor, creado, nueva)
+        return invalidadas
+
+    def estadisticas(self) -> dict:
+        total = self.hits + self.hits_stale + self.misses
+        ahora = time.time()
+        edades = [ahora - creado for _, creado, _ in list(self._entradas.values())]
+        return {
+            "hits": self.hits,
+            "hits_stale": self.hits_stale,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.hits_stale) / total, 4) if total else None,
+            "traidas_compartida": self.traidas_compartida,
+            "generacion": self._generacion,
+            "refrescos": self.refrescos,
+            "errores_refresco": self.errores_refresco,
+            "invalidadas": self.invalidadas,
+            "refrescando": len(self._refrescando),
+            "entradas": len(self._entradas),
+            "max_entradas": self._entradas.maxsize,
+            "edad_media_segundos": round(sum(edades) / len(edades), 1) if edades else None,
+            "edad_max_segundos": round(max(edades), 1) if edades else None,
+        }
+
+cache_geocodificacion = CacheGeocodificacion()
+cache_resultados = CacheResultados()
@@ -0,0 +1,345 @@
+# Nivel compartido de las cachés (geocodificación y resultados) para cuando hay varios workers de uvicorn o varias
+# instancias: sin él cada proceso tiene sus cachés en memoria, frías y repetidas, y multiplica las llamadas a Google
+# y Airtable. Las cachés de cache.py miran primero su memoria y, si no está ahí, este nivel; lo que calculan lo guardan
+# en los dos. Se elige con CACHE_COMPARTIDA_URL:
+#   - "" (por defecto): sin nivel compartido, todo se queda en la memoria de cada proceso
+#   - "sqlite:///ruta/cache.sqlite3": un SQLite (en modo WAL) que comparten los workers de una misma máquina
+#   - "redis://[:password@]host:6379/0": cualquier servidor que hable el protocolo de Redis (RESP), para varias
+#     máquinas. El cliente es mínimo (GET/SET/DEL/INCR) y no necesita dependencias
+# Los valores van como JSON (orjson si está instalado) y comprimidos con zlib a partir de SERIALIZACION_MIN_ZLIB bytes.
+# Para invalidar de forma consistente cada espacio ("resultados") tiene un número de generación que forma parte de
+# la clave: invalidar es incrementarlo, y todo lo anterior deja de verse en todos los procesos a la vez.
+# Si el nivel compartido falla (Redis caído, disco lleno) se trata como un fallo de caché y se sigue sin él
+import os
+import time
+import zlib
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections.abc import Mapping
+from typing import Optional, Any
+from urllib.parse import urlparse, unquote
+from snapshot import FilaSnapshot, CAMPOS_FORMATO
+
+try:
+    import orjson
+
+    def _a_json(objeto) -> bytes:
+        return orjson.dumps(objeto, default=_serializable, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    _de_json = orjson.loads
+except ImportError:
+    import json
+
+    def _a_json(objeto) -> bytes:
+        return json.dumps(objeto, default=_serializable, ensure_ascii=False, separators=(",", ":")).encode()
+
+    _de_json = json.loads
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+CACHE_COMPARTIDA_URL = os.getenv('CACHE_COMPARTIDA_URL', '')
+# Prefijo de las claves, por si el mismo Redis lo usan otras aplicaciones
+CACHE_COMPARTIDA_PREFIJO = os.getenv('CACHE_COMPARTIDA_PREFIJO', 'bistrohunter:')
+# Tiempo máximo por operación contra Redis; si se pasa se sigue sin el nivel compartido
+CACHE_COMPARTIDA_TIMEOUT = float(os.getenv('CACHE_COMPARTIDA_TIMEOUT', 0.25))
+# Después de un error no se vuelve a intentar hasta pasados estos segundos (para no añadir el timeout a cada búsqueda)
+CACHE_COMPARTIDA_PAUSA_ERROR = float(os.getenv('CACHE_COMPARTIDA_PAUSA_ERROR', 5))
+SERIALIZACION_MIN_ZLIB = int(os.getenv('SERIALIZACION_MIN_ZLIB', 1024))
+
+# Las filas del snapshot (catálogo local) se guardan como el registro de Airtable que son, solo con los campos que
+# usa la respuesta (sin google_reviews, que es casi todo el tamaño de la fila)
+def _serializable(objeto):
+    if isinstance(objeto, FilaSnapshot):
+        return objeto.a_registro(CAMPOS_FORMATO)
+    if isinstance(objeto, Mapping):
+        return dict(objeto)
+    if isinstance(objeto, tuple):
+        return list(objeto)
+    raise TypeError(f"No se puede serializar {type(objeto).__name__}")
+
+# Un byte de cabecera con el formato: "j" JSON tal cual, "z" JSON comprimido con zlib
+def serializar(objeto: Any) -> bytes:
+    datos = _a_json(objeto)
+    if len(datos) >= SERIALIZACION_MIN_ZLIB:
+        return b"z" + zlib.compress(datos, 1)
+    return b"j" + datos
+
+def deserializar(datos: bytes) -> Any:
+    formato, cuerpo = datos[:1], datos[1:]
+    if formato == b"z":
+        cuerpo = zlib.decompress(cuerpo)
+    elif formato != b"j":
+        raise ValueError(f"Formato de caché desconocido: {formato!r}")
+    return _de_json(cuerpo)
+
+class _Contadores:
+    def __init__(self):
+        self.lecturas = 0
+        self.aciertos = 0
+        self.escrituras = 0
+        self.errores = 0
+        self.bytes_escritos = 0
+        self._pausa_hasta = 0.0
+
+    def _disponible(self) -> bool:
+        return time.monotonic() >= self._pausa_hasta
+
+    def _fallo(self, operacion: str, e: Exception):
+        self.errores += 1
+        self._pausa_hasta = time.monotonic() + CACHE_COMPARTIDA_PAUSA_ERROR
+        logging.warning(f"Caché compartida ({self.tipo}): error en {operacion}, se sigue sin ella "
+                        f"{CACHE_COMPARTIDA_PAUSA_ERROR:.0f}s: {e!r}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "tipo": self.tipo,
+            "lecturas": self.lecturas,
+            "aciertos": self.aciertos,
+            "hit_ratio": round(self.aciertos / self.lecturas, 4) if self.lecturas else None,
+            "escrituras": self.escrituras,
+            "bytes_escritos": self.bytes_escritos,
+            "errores": self.errores,
+            "disponible": self._disponible(),
+        }
+
+# Para los workers de una misma máquina. Las operaciones van en un hilo (asyncio.to_thread): son rápidas, pero con
+# varios workers escribiendo pueden esperar por el lock de SQLite (hasta CACHE_COMPARTIDA_TIMEOUT) y esa espera no
+# debe parar el event loop
+class CacheCompartidaSQLite(_Contadores):
+    tipo = "sqlite"
+    # Cada cuántas escrituras se borran las entradas caducadas
+    PURGAR_CADA = 500
+
+    def __init__(self, ruta: str):
+        super().__init__()
+        self.ruta = ruta
+        self._conexion = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conexion is None:
+            os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, check_same_thread=False, timeout=CACHE_COMPARTIDA_TIMEOUT)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS entradas (clave TEXT PRIMARY KEY, valor BLOB NOT NULL, caduca REAL NOT NULL)"
+            )
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS generaciones (espacio TEXT PRIMARY KEY, valor INTEGER NOT NULL)"
+            )
+            conexion.commit()
+            self._conexion = conexion
+        return self._conexion
+
+    def _con_conexion(self, funcion):
+        with self._lock:
+            return funcion(self._db())
+
+    async def _ejecutar(self, operacion: str, funcion):
+        if not self._disponible():
+            return None
+        try:
+            return await asyncio.to_thread(self._con_conexion, funcion)
+        except sqlite3.Error as e:
+            self._fallo(operacion, e)
+            return None
+
+    async def obtener(self, clave: str) -> Optional[bytes]:
+        self.lecturas += 1
+        fila = await self._ejecutar("lectura", lambda db: db.execute(
+            "SELECT valor FROM entradas WHERE clave = ? AND caduca > ?", (clave, time.time())
+        ).fetchone())
+        if fila is None:
+            return None
+        self.aciertos += 1
+        return bytes(fila[0])
+
+    async def guardar(self, clave: str, valor: bytes, ttl: float):
+        def escribir(db):
+            db.execute("INSERT OR REPLACE INTO entradas (clave, valor, caduca) VALUES (?, ?, ?)",
+                       (clave, valor, time.time() + ttl))
+            if self.escrituras % self.PURGAR_CADA == 0:
+                db.execute("DELETE FROM entradas WHERE caduca <= ?", (time.time(),))
+            db.commit()
+            return True
+
+        if await self._ejecutar("escritura", escribir):
+            self.escrituras += 1
+            self.bytes_escritos += len(valor)
+
+    async def borrar(self, clave: str):
+        def borrar(db):
+            db.execute("DELETE FROM entradas WHERE clave = ?", (clave,))
+            db.commit()
+
+        await self._ejecutar("borrado", borrar)
+
+    async def generacion(self, espacio: str) -> Optional[int]:
+        fila = await self._ejecutar("lectura de generación", lambda db: db.execute(
+            "SELECT valor FROM generaciones WHERE espacio = ?", (espacio,)
+        ).fetchone() or (0,))
+        return None if fila is None else int(fila[0])
+
+    async def nueva_generacion(self, espacio: str) -> Optional[int]:
+        def incrementar(db):
+            db.execute("INSERT INTO generaciones (espacio, valor) VALUES (?, 1) "
+                       "ON CONFLICT(espacio) DO UPDATE SET valor = valor + 1", (espacio,))
+            db.commit()
+            return db.execute("SELECT valor FROM generaciones WHERE espacio = ?", (espacio,)).fetchone()
+
+        fila = await self._ejecutar("cambio de generación", incrementar)
+        return None if fila is None else int(fila[0])
+
+    def _cerrar(self):
+        with self._lock:
+            if self._conexion is not None:
+                self._conexion.close()
+                self._conexion = None
+
+    async def cerrar(self):
+        await asyncio.to_thread(self._cerrar)
+
+class ErrorRedis(Exception):
+    pass
+
+# Cliente mínimo del protocolo de Redis (RESP2) sobre una sola conexión: los comandos van de uno en uno con un lock,
+# que contra un Redis cercano son décimas de milisegundo. Se reconecta solo (también si cambia el event loop)
+class CacheCompartidaRedis(_Contadores):
+    tipo = "redis"
+
+    def __init__(self, url: str):
+        super().__init__()
+        partes = urlparse(url)
+        self.host = partes.hostname or "localhost"
+        self.puerto = partes.port or 6379
+        self.password = unquote(partes.password) if partes.password else None
+        self.base = int(partes.path.lstrip("/") or 0)
+        self._lector = None
+        self._escritor = None
+        self._loop = None
+        self._lock = None
+
+    @staticmethod
+    def _codificar(*partes) -> bytes:
+        salida = [b"*%d\r\n" % len(partes)]
+        for parte in partes:
+            if not isinstance(parte, bytes):
+                parte = str(parte).encode()
+            salida.append(b"$%d\r\n%s\r\n" % (len(parte), parte))
+        return b"".join(salida)
+
+    async def _leer_respuesta(self):
+        linea = await self._lector.readline()
+        if not linea.endswith(b"\r\n"):
+            raise ConnectionError("conexión cerrada por el servidor")
+        tipo, resto = linea[:1], linea[1:-2]
+        if tipo == b"+":
+            return resto.decode()
+        if tipo == b"-":
+            raise ErrorRedis(resto.decode())
+        if tipo == b":":
+            return int(resto)
+        if tipo == b"$":
+            largo = int(resto)
+            if largo < 0:
+                return None
+            datos = await self._lector.readexactly(largo + 2)
+            return datos[:-2]
+        if tipo == b"*":
+            largo = int(resto)
+            return None if largo < 0 else [await self._leer_respuesta() for _ in range(largo)]
+        raise ErrorRedis(f"respuesta no válida: {linea!r}")
+
+    # Suelta la conexión sin esperar a que se cierre (se puede llamar desde una tarea que se está cancelando)
+    def _soltar(self):
+        escritor, self._escritor, self._lector = self._escritor, None, None
+        if escritor is not None:
+            escritor.close()
+        return escritor
+
+    async def _desconectar(self):
+        escritor = self._soltar()
+        if escritor is not None:
+            try:
+                await escritor.wait_closed()
+            except Exception:
+                pass
+
+    async def _conectar(self):
+        self._lector, self._escritor = await asyncio.open_connection(self.host, self.puerto)
+        if self.password:
+            self._escritor.write(self._codificar("AUTH", self.password))
+            await self._leer_respuesta()
+        if self.base:
+            self._escritor.write(self._codificar("SELECT", self.base))
+            await self._leer_respuesta()
+
+    async def _comando(self, operacion: str, *partes):
+        if not self._disponible():
+            return None
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Conexión y lock de otro event loop (p. ej. la app se ha vuelto a arrancar en el mismo proceso)
+            self._loop, self._lock, self._escritor, self._lector = loop, asyncio.Lock(), None, None
+
+        async def ejecutar():
+            if self._escritor is None:
+                await self._conectar()
+            self._escritor.write(self._codificar(*partes))
+            return await self._leer_respuesta()
+
+        try:
+            async with self._lock:
+                try:
+                    return await asyncio.wait_for(ejecutar(), CACHE_COMPARTIDA_TIMEOUT)
+                except BaseException:
+                    # Si el comando no ha terminado (error, timeout o la búsqueda que lo esperaba se ha cancelado)
+                    # puede quedar su respuesta sin leer, y el siguiente comando la tomaría por la suya
+                    self._soltar()
+                    raise
+        except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError, ErrorRedis) as e:
+            self._fallo(operacion, e)
+            return None
+
+    async def obtener(self, clave: str) -> Optional[bytes]:
+        self.lecturas += 1
+        valor = await self._comando("lectura", "GET", clave)
+        if valor is not None:
+            self.aciertos += 1
+        return valor
+
+    async def guardar(self, clave: str, valor: bytes, ttl: float):
+        if await self._comando("escritura", "SET", clave, valor, "PX", max(1, int(ttl * 1000))) is not None:
+            self.escrituras += 1
+            self.bytes_escritos += len(valor)
+
+    async def borrar(self, clave: str):
+        await self._comando("borrado", "DEL", clave)
+
+    async def generacion(self, espacio: str) -> Optional[int]:
+        errores = self.errores
+        valor = await self._comando("lectura de generación", "GET", f"{CACHE_COMPARTIDA_PREFIJO}gen:{espacio}")
+        if valor is None and (errores != self.errores or not self._disponible()):
+            return None
+        return int(valor or 0)
+
+    async def nueva_generacion(self, espacio: str) -> Optional[int]:
+        return await self._comando("cambio de generación", "INCR", f"{CACHE_COMPARTIDA_PREFIJO}gen:{espacio}")
+
+    async def cerrar(self):
+        if self._loop is asyncio.get_running_loop():
+            await self._desconectar()
+
+def abrir_cache_compartida(url: str = CACHE_COMPARTIDA_URL):
+    if not url:
+        return None
+    if url.startswith("sqlite://"):
+        return CacheCompartidaSQLite(url[len("sqlite://"):])
+    if url.startswith("redis://"):
+        return CacheCompartidaRedis(url)
+    logging.error(f"CACHE_COMPARTIDA_URL no reconocida ({url}): se sigue sin caché compartida")
+    return None
+
+cache_compartida = abrir_cache_compartida()
@@ -0,0 +1,214 @@
+# Arranque en caliente: después de un deploy todas las cachés (geocodificación, resultados, conexiones HTTP) están
+# vacías y las primeras búsquedas pagan Google y Airtable enteros. Para evitarlo:
+#   - Cada búsqueda que llega a la API se apunta en un registro de consultas compacto en disco (HISTORIAL_PATH): una
+#     línea JSON por búsqueda con los parámetros ya normalizados (zona canónica, coordenadas cuantizadas), que es lo
+#     que decide la clave de la caché. Cuando pasa de HISTORIAL_MAX_BYTES se rota a HISTORIAL_PATH.1 (se guarda uno).
+#   - Al arrancar (fase_arranque, desde el lifespan de main.py) se carga el snapshot del catálogo si lo hay y se
+#     repiten las CALENTAMIENTO_TOP_N búsquedas más frecuentes del registro, como mucho durante
+#     CALENTAMIENTO_SEGUNDOS: primero las geocodificaciones de sus zonas y luego las búsquedas en sí.
+#   - GET /ready responde 503 hasta que termina y 200 después; Render (healthCheckPath) no manda tráfico a la
+#     instancia nueva hasta entonces.
+# Las líneas se escriben por tandas con una sola escritura en modo append, así que varios workers pueden compartir
+# el fichero sin mezclar líneas
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional, List, Tuple
+from cache import cuantizar_coordenadas
+from nomenclator import nomenclator
+from bistrohunter import (
+    obtener_restaurantes_por_ciudad, obtener_coordenadas_zona, cargar_snapshot_catalogo, CAMPOS_RESPUESTA
+)
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+HISTORIAL_ACTIVO = os.getenv('HISTORIAL_ACTIVO', '1') == '1'
+HISTORIAL_PATH = os.getenv(
+    'HISTORIAL_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'consultas.log')
+)
+HISTORIAL_MAX_BYTES = int(os.getenv('HISTORIAL_MAX_BYTES', 1024 * 1024))  # ~10.000 búsquedas por fichero
+# Se vuelca a disco cada HISTORIAL_TANDA búsquedas o cada HISTORIAL_VOLCADO_SEGUNDOS, lo que llegue antes
+HISTORIAL_TANDA = int(os.getenv('HISTORIAL_TANDA', 50))
+HISTORIAL_VOLCADO_SEGUNDOS = float(os.getenv('HISTORIAL_VOLCADO_SEGUNDOS', 30))
+CALENTAMIENTO_TOP_N = int(os.getenv('CALENTAMIENTO_TOP_N', 50))  # 0 para no calentar
+CALENTAMIENTO_SEGUNDOS = float(os.getenv('CALENTAMIENTO_SEGUNDOS', 20))
+CALENTAMIENTO_CONCURRENCIA = int(os.getenv('CALENTAMIENTO_CONCURRENCIA', 4))
+
+# Orden de los parámetros en cada línea del registro (después de la marca de tiempo)
+PARAMETROS_CONSULTA = ("city", "zona", "coordenadas", "price_range", "cocina", "diet", "dish")
+
+# Parámetros de una búsqueda tal y como entran en la clave de la caché de resultados (zona canónica como
+# normalizar_ubicacion, coordenadas cuantizadas como clave_busqueda)
+def normalizar_consulta(city: str, zona: Optional[str] = None, coordenadas: Optional[str] = None,
+                        price_range: Optional[str] = None, cocina: Optional[str] = None, diet: Optional[str] = None,
+                        dish: Optional[str] = None) -> tuple:
+    if zona:
+        zona = nomenclator.canonizar(zona, city)
+    else:
+        coordenadas = cuantizar_coordenadas(coordenadas)
+    return (city.strip(), zona, coordenadas, price_range, cocina, diet, dish)
+
+class RegistroConsultas:
+    def __init__(self, ruta: Optional[str] = HISTORIAL_PATH, max_bytes: int = HISTORIAL_MAX_BYTES):
+        self.ruta = ruta if HISTORIAL_ACTIVO else None
+        self.max_bytes = max_bytes
+        self._pendientes: List[str] = []
+        self._ultimo_volcado = time.monotonic()
+        self.registradas = 0
+        self.rotaciones = 0
+        self.errores = 0
+
+    def registrar(self, city: str, **parametros):
+        if not self.ruta:
+            return
+        consulta = normalizar_consulta(city, **parametros)
+        self._pendientes.append(
+            json.dumps([int(time.time()), *consulta], ensure_ascii=False, separators=(",", ":")) + "\n"
+        )
+        self.registradas += 1
+        if (len(self._pendientes) >= HISTORIAL_TANDA
+                or time.monotonic() - self._ultimo_volcado >= HISTORIAL_VOLCADO_SEGUNDOS):
+            self.volcar()
+
+    def volcar(self):
+        self._ultimo_volcado = time.monotonic()
+        if not self._pendientes:
+            return
+        datos = "".join(self._pendientes).encode("utf-8")
+        self._pendientes.clear()
+        try:
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            if os.path.exists(self.ruta) and os.path.getsize(self.ruta) + len(datos) > self.max_bytes:
+                os.replace(self.ruta, self.ruta + ".1")
+                self.rotaciones += 1
+            fd = os.open(self.ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, datos)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            # El registro es solo para calentar: si falla el disco se pierden esas líneas y ya está
+            self.errores += 1
+            logging.warning(f"No se pudo escribir el registro de consultas {self.ruta}: {e}")
+
+    # Las n búsquedas más repetidas (entre el fichero actual y el rotado), de más a menos; a igualdad, la más reciente
+    def mas_frecuentes(self, n: int) -> List[dict]:
+        if not self.ruta or n <= 0:
+            return []
+        veces: Counter = Counter()
+        ultima: dict = {}
+        for ruta in (self.ruta + ".1", self.ruta):
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            marca, *consulta = json.loads(linea)
+                        except ValueError:
+                            continue  # línea cortada (p. ej. el worker murió a mitad de escritura)
+                        if len(consulta) != len(PARAMETROS_CONSULTA) or not consulta[0]:
+                            continue
+                        consulta = tuple(consulta)
+                        veces[consulta] += 1
+                        ultima[consulta] = marca
+            except OSError:
+                continue
+        ordenadas = sorted(veces, key=lambda c: (veces[c], ultima[c]), reverse=True)[:n]
+        return [dict(zip(PARAMETROS_CONSULTA, c)) for c in ordenadas]
+
+    def estadisticas(self) -> dict:
+        return {
+            "activo": self.ruta is not None,
+            "registradas": self.registradas,
+            "pendientes": len(self._pendientes),
+            "rotaciones": self.rotaciones,
+            "errores": self.errores,
+        }
+
+historial_consultas = RegistroConsultas()
+
+# Estado de la fase de arranque, para GET /ready
+class EstadoArranque:
+    def __init__(self):
+        self.listo = False
+        self.inicio = time.monotonic()
+        self.segundos: Optional[float] = None
+        self.snapshot_cargado = False
+        self.consultas = 0
+        self.zonas_calentadas = 0
+        self.busquedas_calentadas = 0
+        self.fallidas = 0
+        self.agotado = False  # se acabó CALENTAMIENTO_SEGUNDOS antes de terminar
+
+    def estadisticas(self) -> dict:
+        return {
+            "listo": self.listo,
+            "segundos": round(self.segundos if self.listo else time.monotonic() - self.inicio, 3),
+            "snapshot_cargado": self.snapshot_cargado,
+            "consultas": self.consultas,
+            "zonas_calentadas": self.zonas_calentadas,
+            "busquedas_calentadas": self.busquedas_calentadas,
+            "fallidas": self.fallidas,
+            "presupuesto_agotado": self.agotado,
+        }
+
+estado_arranque = EstadoArranque()
+
+# Lanza corrutinas de CALENTAMIENTO_CONCURRENCIA en CALENTAMIENTO_CONCURRENCIA hasta el instante limite
+# (time.monotonic()). Devuelve (terminadas bien, fallidas, si se ha quedado alguna sin hacer)
+async def _ejecutar_hasta(corrutinas: list, limite: float) -> Tuple[int, int, bool]:
+    semaforo = asyncio.Semaphore(CALENTAMIENTO_CONCURRENCIA)
+
+    async def una(corrutina):
+        async with semaforo:
+            return await corrutina
+
+    tareas = [asyncio.ensure_future(una(c)) for c in corrutinas]
+    if not tareas:
+        return 0, 0, False
+    hechas, pendientes = await asyncio.wait(tareas, timeout=max(0.0, limite - time.monotonic()))
+    for tarea in pendientes:
+        tarea.cancel()
+    await asyncio.gather(*pendientes, return_exceptions=True)
+    fallidas = [t for t in hechas if t.exception() is not None]
+    for tarea in fallidas[:3]:
+        logging.warning(f"Calentamiento: búsqueda fallida: {tarea.exception()!r}")
+    return len(hechas) - len(fallidas), len(fallidas), bool(pendientes)
+
+async def calentar_caches(consultas: List[dict], segundos: float = CALENTAMIENTO_SEGUNDOS):
+    limite = time.monotonic() + segundos
+    # 1) Las zonas: con el nomenclátor casi todas salen gratis; las que no, van a Google (o a la caché en disco)
+    zonas = dict.fromkeys(
+        (zona.strip(), c["city"]) for c in consultas if c["zona"] for zona in c["zona"].split(",") if zona.strip()
+    )
+    bien, mal, agotado = await _ejecutar_hasta(
+        [obtener_coordenadas_zona(zona, ciudad, 1.0) for zona, ciudad in zonas], limite
+    )
+    estado_arranque.zonas_calentadas, estado_arranque.fallidas = bien, mal
+    # 2) Las búsquedas, con los mismos parámetros que el endpoint para que caigan en la misma clave de la caché
+    if not agotado:
+        bien, mal, agotado = await _ejecutar_hasta(
+            [obtener_restaurantes_por_ciudad(**c, sort_by_proximity=True, campos=CAMPOS_RESPUESTA) for c in consultas],
+            limite
+        )
+        estado_arranque.busquedas_calentadas = bien
+        estado_arranque.fallidas += mal
+    estado_arranque.agotado = agotado
+
+# Fase de arranque (tarea de fondo lanzada por el lifespan): snapshot del catálogo y calentamiento. Pase lo que pase
+# termina con estado_arranque.listo = True, para no dejar la instancia fuera de servicio por un calentamiento fallido
+async def fase_arranque():
+    try:
+        estado_arranque.snapshot_cargado = cargar_snapshot_catalogo()
+        consultas = historial_consultas.mas_frecuentes(CALENTAMIENTO_TOP_N)
+        estado_arranque.consultas = len(consultas)
+        if consultas:
+            await calentar_caches(consultas)
+    except Exception as e:
+        logging.error(f"Error en la fase de arranque: {e!r}")
+    finally:
+        estado_arranque.listo = True
+        estado_arranque.segundos = time.monotonic() - estado_arranque.inicio
+        logging.info(f"Arranque terminado en {estado_arranque.segundos:.1f}s: {estado_arranque.estadisticas()}")
@@ -0,0 +1,457 @@
+# Réplica local de la tabla "Restaurantes DB" (vista de BistroHunter) con un índice espacial en rejilla
+import os
+import time
+import asyncio
+import logging
+import threading
+from math import floor
+from typing import Optional, List, Dict, Tuple, Sequence, Set, Iterable
+import numpy as np
+from indice_texto import IndiceTexto
+from filtros import ConsultaRestaurantes, CAMPO_FILTRO, construir_columnas, evaluar_columnas, texto_filtro
+from snapshot import Snapshot
+from geo import calcular_bounding_box, leer_coordenada, haversine_vectorizado, seleccionar_cercanos
+
+TABLA_RESTAURANTES = 'Restaurantes DB'
+VISTA_RESTAURANTES = "viw6z7g5ZZs3mpy3S"
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+CATALOGO_ACTIVO = os.getenv('CATALOGO_ACTIVO', '1') == '1'
+# Descarga completa de la tabla (recoge bajas y registros que salen de la vista)
+CATALOGO_REFRESCO_SEGUNDOS = int(os.getenv('CATALOGO_REFRESCO_SEGUNDOS', 6 * 3600))
+# Entre descargas completas, cada cuánto se piden solo los registros modificados (0 para no hacerlo)
+CATALOGO_SYNC_SEGUNDOS = int(os.getenv('CATALOGO_SYNC_SEGUNDOS', 60))
+# Margen hacia atrás de la marca de agua en cada sincronización incremental
+CATALOGO_SYNC_SOLAPE_SEGUNDOS = int(os.getenv('CATALOGO_SYNC_SOLAPE_SEGUNDOS', 60))
+# Si el catálogo lleva más de esto sin sincronizarse dejamos de usarlo y volvemos a Airtable
+CATALOGO_MAX_EDAD_SEGUNDOS = int(os.getenv(
+    'CATALOGO_MAX_EDAD_SEGUNDOS', 3 * (CATALOGO_SYNC_SEGUNDOS or CATALOGO_REFRESCO_SEGUNDOS)
+))
+# Tamaño de celda de la rejilla en grados (0.01º ~ 1.1 km de latitud)
+CATALOGO_CELDA_GRADOS = float(os.getenv('CATALOGO_CELDA_GRADOS', 0.01))
+# Preselección de los filtros de cocina/dieta/plato con el índice invertido. El resultado es el mismo con 0 (la
+# comparación de filtros.evaluar_columnas sobre todas las filas), solo más lento
+CATALOGO_INDICE_TEXTO = os.getenv('CATALOGO_INDICE_TEXTO', '1') == '1'
+# Foto del catálogo en disco (snapshot.py) que comparten los workers por mmap. Vacío para tenerlo solo en memoria
+CATALOGO_SNAPSHOT_PATH = os.getenv(
+    'CATALOGO_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'catalogo.snapshot')
+)
+
+# Tras los cambios del webhook el snapshot se reescribe pasado este tiempo (los que llegan entretanto van juntos)
+CATALOGO_SNAPSHOT_RETRASO_SEGUNDOS = float(os.getenv('CATALOGO_SNAPSHOT_RETRASO_SEGUNDOS', 30))
+
+# Decimales (km) con los que se comparan las distancias al paginar: el milímetro
+DECIMALES_DISTANCIA = 6
+
+# Clave de orden equivalente a "sort[0][field]=NBH2, direction=desc" (los vacíos van al final)
+def clave_nbh2(registro: dict) -> float:
+    valor = registro['fields'].get('NBH2')
+    try:
+        return -float(valor)
+    except (TypeError, ValueError):
+        return float('inf')
+
+# Índice espacial en rejilla: cada celda guarda (en un array) las posiciones de los restaurantes que caen dentro
+class IndiceEspacial:
+    def __init__(self, celda_grados: float = CATALOGO_CELDA_GRADOS):
+        self.celda = celda_grados
+        self.celdas: Dict[Tuple[int, int], np.ndarray] = {}
+        self.lats_np = np.empty(0)
+        self.lngs_np = np.empty(0)
+
+    def _celda(self, lat: float, lng: float) -> Tuple[int, int]:
+        return floor(lat / self.celda), floor(lng / self.celda)
+
+    # lats/lngs: listas (None si falta) o arrays (NaN si falta; con el snapshot son las columnas del mmap)
+    def construir(self, lats, lngs):
+        self.lats_np = np.asarray(lats, dtype=float)
+        self.lngs_np = np.asarray(lngs, dtype=float)
+        validas = np.flatnonzero(np.isfinite(self.lats_np) & np.isfinite(self.lngs_np))
+        filas = np.floor(self.lats_np[validas] / self.celda).astype(np.int64)
+        columnas = np.floor(self.lngs_np[validas] / self.celda).astype(np.int64)
+        # Agrupamos por celda ordenando por (fila, columna, posición)
+        orden = np.lexsort((validas, columnas, filas))
+        filas, columnas, validas = filas[orden], columnas[orden], validas[orden]
+        cortes = np.flatnonzero((np.diff(filas) != 0) | (np.diff(columnas) != 0)) + 1
+        self.celdas = {}
+        for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(validas)]):
+            if inicio < fin:
+                self.celdas[(int(filas[inicio]), int(columnas[inicio]))] = validas[inicio:fin]
+
+    # Punto (lat, lng) de una posición, o None si no tiene coordenadas
+    def punto(self, posicion: int) -> Optional[Tuple[float, float]]:
+        if posicion >= len(self.lats_np):
+            return None
+        lat, lng = float(self.lats_np[posicion]), float(self.lngs_np[posicion])
+        return (lat, lng) if np.isfinite(lat) and np.isfinite(lng) else None
+
+    # Los arrays del snapshot son de solo lectura: a partir del primer cambio usamos copias propias.
+    # Las posiciones nuevas van al final
+    def _preparar(self, tamano: int):
+        if tamano > len(self.lats_np) or not self.lats_np.flags.writeable:
+            crecer = max(tamano - len(self.lats_np), 0)
+            self.lats_np = np.concatenate((self.lats_np, np.full(crecer, np.nan)))
+            self.lngs_np = np.concatenate((self.lngs_np, np.full(crecer, np.nan)))
+
+    # Saca una posición de su celda (el resto del índice no se toca)
+    def quitar(self, posicion: int):
+        punto = self.punto(posicion)
+        if punto is None:
+            return
+        self._preparar(posicion + 1)
+        celda = self._celda(*punto)
+        restantes = self.celdas[celda][self.celdas[celda] != posicion]
+        if len(restantes):
+            self.celdas[celda] = restantes
+        else:
+            del self.celdas[celda]
+        self.lats_np[posicion] = self.lngs_np[posicion] = np.nan
+
+    # Pone (o mueve) una posición en las coordenadas dadas
+    def poner(self, posicion: int, lat: Optional[float], lng: Optional[float]):
+        self._preparar(posicion + 1)
+        self.quitar(posicion)
+        if lat is None or lng is None or not (np.isfinite(lat) and np.isfinite(lng)):
+            return
+        self.lats_np[posicion], self.lngs_np[posicion] = lat, lng
+        celda = self._celda(lat, lng)
+        self.celdas[celda] = np.append(self.celdas.get(celda, np.empty(0, dtype=np.int64)), posicion)
+
+    # Posiciones dentro de la bounding box (bordes incluidos, como los >= / <= de la fórmula), en orden de carga
+    def consultar_bbox(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        i_min, j_min = self._celda(lat_min, lon_min)
+        i_max, j_max = self._celda(lat_max, lon_max)
+        partes = []
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                celda = self.celdas.get((i, j))
+                if celda is not None:
+                    partes.append(celda)
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        posiciones = np.concatenate(partes)
+        lats = self.lats_np[posiciones]
+        lngs = self.lngs_np[posiciones]
+        posiciones = posiciones[(lats >= lat_min) & (lats <= lat_max) & (lngs >= lon_min) & (lngs <= lon_max)]
+        posiciones.sort()
+        return posiciones
+
+    # Posiciones a menos de radio_km del punto (círculo, no cuadrado)
+    def consultar_radio(self, lat: float, lng: float, radio_km: float) -> np.ndarray:
+        bbox = calcular_bounding_box(lat, lng, radio_km)
+        posiciones = self.consultar_bbox(bbox['lat_min'], bbox['lat_max'], bbox['lon_min'], bbox['lon_max'])
+        distancias = haversine_vectorizado(lng, lat, self.lngs_np[posiciones], self.lats_np[posiciones])
+        return posiciones[distancias <= radio_km]
+
+# Columna de texto de evaluar_columnas con filas cambiadas encima (los cambios incrementales no tocan la columna
+# original, que puede ser la del snapshot). Las filas añadidas al final solo están en 'cambios'
+class ColumnaConCambios:
+    __slots__ = ("base", "cambios")
+
+    def __init__(self, base):
+        self.base = base
+        self.cambios: Dict[int, str] = {}
+
+    def __len__(self):
+        return max(len(self.base), max(self.cambios) + 1 if self.cambios else 0)
+
+    def __getitem__(self, posiciones) -> np.ndarray:
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        textos = np.empty(len(posiciones), dtype=object)
+        en_base = posiciones < len(self.base)
+        textos[en_base] = self.base[posiciones[en_base]]
+        if self.cambios:
+            cambiadas = np.flatnonzero(np.isin(posiciones, np.fromiter(self.cambios, dtype=np.int64)))
+            for i in cambiadas:
+                textos[i] = self.cambios[int(posiciones[i])]
+        return textos
+
+# Pone el índice de texto al día con los registros vivos: solo se tokeniza lo que ha cambiado (se ejecuta en un
+# hilo, ver Catalogo.indexar_texto; el cerrojo evita dos a la vez si se cancela una espera)
+def sincronizar_indice_texto(indice: IndiceTexto, registros: Sequence, bloqueo: threading.Lock):
+    with bloqueo:
+        indice.sincronizar(r for r in registros if r is not None)
+
+# Foto en memoria de la tabla. Los registros pueden ser una lista de dicts de Airtable o un Snapshot abierto con mmap
+# (compartido entre workers). La lista y el índice espacial se sustituyen enteros en cada refresco. El índice de texto
+# se pone al día aparte, fuera del event loop (indexar_texto), tokenizando solo los registros que cambian
+class Catalogo:
+    def __init__(self, registros: Optional[Sequence] = None):
+        self.registros: Sequence = []
+        self.indice = IndiceEspacial()
+        self.indice_texto = IndiceTexto()
+        # texto_indexado: el índice de texto corresponde a los registros actuales. Mientras se pone al día,
+        # texto_pendiente guarda los ids que cambian para aplicarlos antes de volver a usarlo
+        self.texto_indexado = False
+        self.texto_pendiente: Optional[Set[str]] = None
+        self._bloqueo_texto = threading.Lock()
+        self.generacion = 0
+        self.claves_nbh2 = np.empty(0)
+        self.rango_nbh2 = np.empty(0, dtype=np.int64)
+        self.columnas = construir_columnas([])
+        self.posicion_por_id: Dict[str, int] = {}
+        # cargado_en: cuándo se generó la foto cargada. descargado_en: cuándo se bajó entera de Airtable por última
+        # vez. marca_agua: hasta cuándo están incluidos los cambios (la siguiente sincronización pide lo posterior)
+        self.cargado_en: Optional[float] = None
+        self.descargado_en: Optional[float] = None
+        self.marca_agua: Optional[float] = None
+        self.cambios_aplicados = 0
+        if registros is not None:
+            self.reemplazar(registros)
+
+    def reemplazar(self, registros: Sequence, descargado_en: Optional[float] = None):
+        if isinstance(registros, Snapshot):
+            # Del snapshot sacamos las columnas directamente, sin recorrer los registros
+            lats, lngs = registros.numeros('location/lat'), registros.numeros('location/lng')
+            nbh2 = registros.numeros('NBH2')
+            claves_nbh2 = np.where(np.isnan(nbh2), np.inf, -nbh2)
+            columnas = registros.columnas()
+            ids = registros.ids()
+            # La edad del catálogo es la de los datos, no la de la carga
+            cargado_en = registros.creado_en
+            descargado_en = registros.metadatos.get('descargado_en', cargado_en)
+            marca_agua = registros.metadatos.get('marca_agua', descargado_en)
+        else:
+            lats = [leer_coordenada(r.get('fields', {}), 'location/lat') for r in registros]
+            lngs = [leer_coordenada(r.get('fields', {}), 'location/lng') for r in registros]
+            claves_nbh2 = np.array([clave_nbh2(r) for r in registros], dtype=float)
+            columnas = construir_columnas(registros)
+            ids = [r.get('id') for r in registros]
+            cargado_en = time.time()
+            descargado_en = marca_agua = descargado_en or cargado_en
+        indice = IndiceEspacial()
+        indice.construir(lats, lngs)
+        posicion_por_id = {id_registro: p for p, id_registro in enumerate(ids)}
+        self.generacion += 1
+        self.texto_indexado = False
+        self.registros, self.indice, self.claves_nbh2 = registros, indice, claves_nbh2
+        self.rango_nbh2 = self._rango(claves_nbh2)
+        self.columnas, self.posicion_por_id = columnas, posicion_por_id
+        self.cargado_en, self.descargado_en, self.marca_agua = cargado_en, descargado_en, marca_agua
+
+    # Posición de cada registro en el orden NBH2 desc (a igual NBH2, orden de la vista) para desempatar
+    @staticmethod
+    def _rango(claves_nbh2: np.ndarray) -> np.ndarray:
+        rango_nbh2 = np.empty(len(claves_nbh2), dtype=np.int64)
+        rango_nbh2[np.argsort(claves_nbh2, kind='stable')] = np.arange(len(claves_nbh2))
+        return rango_nbh2
+
+    # Antes del primer cambio incremental: el snapshot es de solo lectura, así que pasamos a una lista de filas (que
+    # siguen leyendo del mmap) y las columnas de texto pasan a llevar los cambios encima
+    def _preparar_cambios(self):
+        if not isinstance(self.registros, list):
+            self.registros = list(self.registros)
+        for campo in set(CAMPO_FILTRO.values()):
+            if not isinstance(self.columnas[campo], ColumnaConCambios):
+                self.columnas[campo] = ColumnaConCambios(self.columnas[campo])
+
+    # Aplica altas, modificaciones y bajas sueltas (por id de registro) sin reconstruir nada: solo se tocan las celdas
+    # de la rejilla, las entradas del índice de texto y las filas de las columnas de esos registros. Los registros que
+    # llegan iguales a como ya estaban se ignoran. Devuelve los ids que han cambiado de verdad y los puntos afectados
+    # (coordenadas de antes y de después) para invalidar la caché de resultados
+    def aplicar_cambios(self, actualizados: List[dict],
+                        eliminados: Iterable[str] = ()) -> Tuple[Set[str], List[Tuple[float, float]]]:
+        ids: Set[str] = set()
+        puntos: List[Tuple[float, float]] = []
+        for id_registro in eliminados:
+            posicion = self.posicion_por_id.pop(id_registro, None)
+            if posicion is None:
+                continue
+            self._preparar_cambios()
+            ids.add(id_registro)
+            punto = self.indice.punto(posicion)
+            if punto is not None:
+                puntos.append(punto)
+            self.indice.quitar(posicion)
+            self._cambio_texto(id_registro)
+            self.registros[posicion] = None
+
+        for registro in actualizados:
+            id_registro = registro.get('id')
+            if not id_registro:
+                continue
+            posicion = self.posicion_por_id.get(id_registro)
+            if posicion is not None and dict(self.registros[posicion].get('fields', {})) == registro.get('fields', {}):
+                continue
+            self._preparar_cambios()
+            if posicion is not None:
+                punto = self.indice.punto(posicion)
+                if punto is not None:
+                    puntos.append(punto)
+            else:
+                posicion = self.posicion_por_id[id_registro] = len(self.registros)
+                self.registros.append(registro)
+            ids.add(id_registro)
+            fields = registro.get('fields', {})
+            self.registros[posicion] = registro
+            lat = leer_coordenada(fields, 'location/lat')
+            lng = leer_coordenada(fields, 'location/lng')
+            self.indice.poner(posicion, lat, lng)
+            if lat is not None and lng is not None:
+                puntos.append((lat, lng))
+            self._cambio_texto(id_registro)
+            for campo in set(CAMPO_FILTRO.values()):
+                self.columnas[campo].cambios[posicion] = texto_filtro(fields, campo)
+            if posicion >= len(self.claves_nbh2):
+                self.claves_nbh2 = np.concatenate(
+                    (self.claves_nbh2, np.full(posicion + 1 - len(self.claves_nbh2), np.inf))
+                )
+            elif not self.claves_nbh2.flags.writeable:
+                self.claves_nbh2 = self.claves_nbh2.copy()
+            self.claves_nbh2[posicion] = clave_nbh2(registro)
+
+        if ids:
+            self.columnas["location/lat"] = self.indice.lats_np
+            self.columnas["location/lng"] = self.indice.lngs_np
+            # El rango de NBH2 es un argsort sobre un array de floats: se recalcula entero, cuesta poco
+            self.rango_nbh2 = self._rango(self.claves_nbh2)
+            self.cambios_aplicados += len(ids)
+        return ids, puntos
+
+    # Lleva un cambio de registro al índice de texto: directamente si ya está construido, o lo apunta para
+    # aplicarlo al terminar si se está construyendo (si no se ha empezado, la construcción ya lo leerá)
+    def _cambio_texto(self, id_registro: str):
+        if self.texto_indexado:
+            self._indexar_registro(self.indice_texto, id_registro)
+        elif self.texto_pendiente is not None:
+            self.texto_pendiente.add(id_registro)
+
+    def _indexar_registro(self, indice: IndiceTexto, id_registro: str):
+        posicion = self.posicion_por_id.get(id_registro)
+        registro = self.registros[posicion] if posicion is not None else None
+        if registro is None:
+            indice.eliminar(id_registro)
+        else:
+            indice.actualizar(id_registro, registro.get('fields', {}))
+
+    # Pone el índice de texto al día con los registros actuales en un hilo: la primera vez, con google_reviews, son
+    # segundos de CPU y en el event loop dejarían parado al worker; al recargar un snapshot solo se tokeniza lo que ha
+    # cambiado. Mientras no está listo, filtrar resuelve los filtros de texto sobre las columnas (mismo resultado,
+    # solo más lento). Si entretanto se reemplaza el catálogo se vuelve a sincronizar con los registros nuevos
+    async def indexar_texto(self):
+        if not CATALOGO_INDICE_TEXTO or self.texto_indexado or self.texto_pendiente is not None:
+            return
+        inicio = time.monotonic()
+        try:
+            while not self.texto_indexado:
+                generacion = self.generacion
+                self.texto_pendiente = set()
+                await asyncio.to_thread(sincronizar_indice_texto, self.indice_texto, self.registros, self._bloqueo_texto)
+                if self.generacion == generacion:
+                    for id_registro in self.texto_pendiente:
+                        self._indexar_registro(self.indice_texto, id_registro)
+                    self.texto_indexado = True
+        finally:
+            self.texto_pendiente = None
+        logging.info(f"Índice de texto del catálogo al día: {len(self.indice_texto)} restaurantes "
+                     f"en {time.monotonic() - inicio:.1f}s")
+
+    # Registros vivos (sin los huecos que dejan las bajas), p. ej. para volver a escribir el snapshot
+    def registros_vigentes(self) -> List[dict]:
+        return [r for r in self.registros if r is not None]
+
+    def marcar_sincronizado(self, marca_agua: float):
+        self.marca_agua = marca_agua
+
+    @property
+    def edad(self) -> Optional[float]:
+        return time.time() - self.marca_agua if self.marca_agua else None
+
+    @property
+    def listo(self) -> bool:
+        return CATALOGO_ACTIVO and self.cargado_en is not None and self.edad < CATALOGO_MAX_EDAD_SEGUNDOS
+
+    # Posiciones (de las dadas) que cumplen la consulta. Si el índice de texto ya está construido, primero se quedan
+    # los candidatos de los filtros de texto (intersección de posting lists); después se evalúa la consulta entera de
+    # forma vectorizada sobre las columnas, con la misma semántica que la fórmula de Airtable
+    def filtrar(self, posiciones, consulta: ConsultaRestaurantes) -> np.ndarray:
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        if CATALOGO_INDICE_TEXTO and self.texto_indexado:
+            ids_texto = self.indice_texto.candidatos(consulta)
+            if ids_texto is not None:
+                posiciones_texto = np.fromiter(
+                    (self.posicion_por_id[i] for i in ids_texto if i in self.posicion_por_id), dtype=np.int64
+                )
+                posiciones = posiciones[np.isin(posiciones, posiciones_texto)]
+        return posiciones[evaluar_columnas(consulta, self.columnas, posiciones)]
+
+    # Mismo resultado que la petición a Airtable con el filtro de bbox: ordenado por NBH2 desc y cortado a max_records
+    def buscar_bbox(self, bounding_box: dict, consulta: ConsultaRestaurantes, max_records: int = 80) -> List[dict]:
+        posiciones = self.indice.consultar_bbox(
+            bounding_box['lat_min'], bounding_box['lat_max'],
+            bounding_box['lon_min'], bounding_box['lon_max']
+        )
+        posiciones = self.filtrar(posiciones, consulta)
+        # rango_nbh2 ya tiene el orden NBH2 desc con los empates en el orden de la vista, como hace Airtable
+        posiciones = posiciones[np.argsort(self.rango_nbh2[posiciones], kind='stable')]
+        return [self.registros[p] for p in posiciones[:max_records]]
+
+    # Los k restaurantes más cercanos que cumplen los filtros, sin salir de la bounding box de radio_max_km.
+    # Vamos doblando el radio (1, 2, 4, ... km) hasta que haya k dentro del círculo del radio actual: esos ya son
+    # seguro los más cercanos. A igual distancia gana el de mayor NBH2. Devuelve también el radio con el que se cerró
+    def buscar_cercanos(self, lat: float, lng: float, consulta: ConsultaRestaurantes, k: int = 80,
+                        radio_inicial_km: float = 1.0, radio_max_km: float = 20.0) -> Tuple[List[dict], float]:
+        radio = min(radio_inicial_km, radio_max_km)
+        while True:
+            bbox = calcular_bounding_box(lat, lng, radio)
+            posiciones = self.filtrar(
+                self.indice.consultar_bbox(bbox['lat_min'], bbox['lat_max'], bbox['lon_min'], bbox['lon_max']),
+                consulta
+            )
+            distancias = haversine_vectorizado(lng, lat, self.indice.lngs_np[posiciones], self.indice.lats_np[posiciones])
+            # (margen del 1% porque la bbox usa 111.32 km/grado y haversine un radio terrestre de 6367 km)
+            dentro_del_circulo = int(np.count_nonzero(distancias <= radio * 0.99))
+            if dentro_del_circulo >= k or radio >= radio_max_km:
+                break
+            radio = min(radio * 2, radio_max_km)
+
+        orden = seleccionar_cercanos(distancias, k, self.rango_nbh2[posiciones])
+        return [self.registros[p] for p in posiciones[orden]], radio
+
+    # Para la paginación (paginacion.py): los restaurantes de la bbox en orden NBH2 desc (como buscar_bbox) con la
+    # clave NBH2 >= desde, como ((clave_nbh2,), registro). Quien los lee para en cuanto completa la página
+    def recorrer_bbox(self, bounding_box: dict, consulta: ConsultaRestaurantes,
+                      desde: float = -np.inf) -> Iterable[Tuple[tuple, dict]]:
+        posiciones = self.filtrar(self.indice.consultar_bbox(
+            bounding_box['lat_min'], bounding_box['lat_max'], bounding_box['lon_min'], bounding_box['lon_max']
+        ), consulta)
+        posiciones = posiciones[self.claves_nbh2[posiciones] >= desde]
+        posiciones = posiciones[np.argsort(self.rango_nbh2[posiciones], kind='stable')]
+        return (((float(self.claves_nbh2[p]),), self.registros[p]) for p in posiciones)
+
+    # Para la paginación: los restaurantes de la bbox de radio_km en orden de (distancia, clave NBH2), como
+    # ((distancia, clave_nbh2), registro), a partir de 'desde' (incluido). La distancia va redondeada al milímetro
+    # (DECIMALES_DISTANCIA) para que salga igual aquí que calculada sobre los registros de Airtable
+    def recorrer_radio(self, lat: float, lng: float, radio_km: float, consulta: ConsultaRestaurantes,
+                       desde: Tuple[float, float] = (0.0, -np.inf)) -> Iterable[Tuple[tuple, dict]]:
+        bbox = calcular_bounding_box(lat, lng, radio_km)
+        posiciones = self.filtrar(
+            self.indice.consultar_bbox(bbox['lat_min'], bbox['lat_max'], bbox['lon_min'], bbox['lon_max']),
+            consulta
+        )
+        distancias = np.round(haversine_vectorizado(
+            lng, lat, self.indice.lngs_np[posiciones], self.indice.lats_np[posiciones]
+        ), DECIMALES_DISTANCIA)
+        claves = self.claves_nbh2[posiciones]
+        distancia_desde, nbh2_desde = desde
+        siguientes = (distancias > distancia_desde) | ((distancias == distancia_desde) & (claves >= nbh2_desde))
+        posiciones, distancias, claves = posiciones[siguientes], distancias[siguientes], claves[siguientes]
+        orden = np.lexsort((claves, distancias))
+        return (((float(distancias[i]), float(claves[i])), self.registros[posiciones[i]]) for i in orden)
+
+    def estadisticas(self) -> dict:
+        return {
+            "activo": CATALOGO_ACTIVO,
+            "listo": self.listo,
+            "registros": len(self.posicion_por_id),
+            "snapshot": {"ruta": self.registros.ruta, "bytes": self.registros.tamano}
+            if isinstance(self.registros, Snapshot) else None,
+            "celdas": len(self.indice.celdas),
+            "indice_texto": dict(self.indice_texto.estadisticas(), listo=self.texto_indexado),
+            "edad_segundos": round(self.edad, 1) if self.edad is not None else None,
+            "segundos_desde_descarga": round(time.time() - self.descargado_en, 1) if self.descargado_en else None,
+            "cambios_aplicados": self.cambios_aplicados,
+        }
+
+catalogo = Catalogo()
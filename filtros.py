@@ -0,0 +1,221 @@
+# Filtros de búsqueda como objeto estructurado. La misma consulta se puede compilar a:
+#   - una fórmula filterByFormula de Airtable (con los valores escapados), o
+#   - un predicado en Python / una evaluación vectorizada sobre columnas, para el catálogo local.
+# Las formas de consulta que se repiten (qué filtros y cuántas opciones) reutilizan lo ya compilado
+import math
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Optional, Tuple, Callable, Dict
+import numpy as np
+from geo import leer_coordenada
+
+# Filtros de texto en el orden en que van en la fórmula, y la condición de Airtable de cada uno:
+#   price_range -> FIND('x', ARRAYJOIN({price_range}, ', ')) > 0
+#   cocina/diet -> SEARCH('x', PLEGAR({categories_string})) > 0
+#   dish        -> SEARCH('x', PLEGAR({google_reviews})) > 0
+# donde PLEGAR es LOWER() con un SUBSTITUTE() por cada letra con tilde de PLEGADO y 'x' va ya plegado: cocina, dieta
+# y plato no distinguen mayúsculas ni tildes ("cafe" encuentra "Café"). price_range se compara tal cual
+# Dentro de cada filtro las opciones van con OR y entre filtros con AND
+FILTROS = ("price_range", "cocina", "diet", "dish")
+CAMPO_FILTRO = {
+    "price_range": "price_range",
+    "cocina": "categories_string",
+    "diet": "categories_string",
+    "dish": "google_reviews",
+}
+FILTROS_PLEGADOS = ("cocina", "diet", "dish")
+CAMPOS_PLEGADOS = frozenset(CAMPO_FILTRO[filtro] for filtro in FILTROS_PLEGADOS)
+
+# Letras que se pliegan (después de pasar a minúsculas). La fórmula y plegar_texto usan esta misma tabla, así que
+# Airtable y el catálogo local dan lo mismo; las letras que no están aquí se comparan tal cual en los dos
+PLEGADO = {
+    "á": "a", "à": "a", "â": "a", "é": "e", "è": "e", "ê": "e", "í": "i", "ì": "i", "î": "i", "ï": "i",
+    "ó": "o", "ò": "o", "ô": "o", "ú": "u", "ù": "u", "û": "u", "ü": "u", "ñ": "n", "ç": "c",
+}
+_TABLA_PLEGADO = str.maketrans(PLEGADO)
+
+def plegar_texto(texto: str) -> str:
+    texto = texto.lower()
+    return texto if texto.isascii() else texto.translate(_TABLA_PLEGADO)
+
+def _formula_plegada(campo: str) -> str:
+    formula = f"LOWER({campo})"
+    for letra, base in PLEGADO.items():
+        formula = f"SUBSTITUTE({formula}, '{letra}', '{base}')"
+    return formula
+
+CONDICION_FORMULA = {
+    "price_range": "FIND('{}', ARRAYJOIN({{price_range}}, ', ')) > 0",
+    "cocina": f"SEARCH('{{}}', {_formula_plegada('{{categories_string}}')}) > 0",
+    "diet": f"SEARCH('{{}}', {_formula_plegada('{{categories_string}}')}) > 0",
+    "dish": f"SEARCH('{{}}', {_formula_plegada('{{google_reviews}}')}) > 0",
+}
+
+# Las opciones vacías ("italiana, ") se descartan: SEARCH('') casaría con cualquier cosa
+def _lista(valor: Optional[str]) -> Tuple[str, ...]:
+    return tuple(v.strip() for v in valor.split(',') if v.strip()) if valor else ()
+
+# Escapa un valor para meterlo entre comillas simples en una fórmula de Airtable
+def escapar_cadena(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("'", "\\'")
+
+# Texto sobre el que busca cada filtro (price_range es una lista en Airtable y la fórmula la une con ARRAYJOIN)
+def texto_campo(fields: dict, campo: str) -> str:
+    valor = fields.get(campo)
+    if valor is None:
+        return ""
+    if isinstance(valor, list):
+        return ", ".join(str(v) for v in valor)
+    return str(valor)
+
+# Texto de un campo tal y como lo compara su filtro (plegado en categories_string y google_reviews)
+def texto_filtro(fields: dict, campo: str) -> str:
+    texto = texto_campo(fields, campo)
+    return plegar_texto(texto) if campo in CAMPOS_PLEGADOS else texto
+
+# Opciones de un filtro tal y como se buscan (plegadas en cocina, diet y dish)
+def opciones_filtro(consulta: "ConsultaRestaurantes", filtro: str) -> Tuple[str, ...]:
+    opciones = getattr(consulta, filtro)
+    return tuple(plegar_texto(o) for o in opciones) if filtro in FILTROS_PLEGADOS else opciones
+
+@dataclass(frozen=True)
+class ConsultaRestaurantes:
+    price_range: Tuple[str, ...] = ()
+    cocina: Tuple[str, ...] = ()
+    diet: Tuple[str, ...] = ()
+    dish: Tuple[str, ...] = ()
+    # (lat_min, lat_max, lon_min, lon_max)
+    bbox: Optional[Tuple[float, float, float, float]] = None
+
+    # A partir de los parámetros tal cual llegan al endpoint (listas separadas por comas; diet es un solo valor)
+    @classmethod
+    def desde_parametros(cls, price_range: Optional[str] = None, cocina: Optional[str] = None,
+                         diet: Optional[str] = None, dish: Optional[str] = None) -> "ConsultaRestaurantes":
+        return cls(
+            price_range=_lista(price_range),
+            cocina=_lista(cocina),
+            diet=(diet.strip(),) if diet and diet.strip() else (),
+            dish=_lista(dish),
+        )
+
+    def con_bbox(self, bounding_box: dict) -> "ConsultaRestaurantes":
+        bbox = (
+            float(bounding_box['lat_min']), float(bounding_box['lat_max']),
+            float(bounding_box['lon_min']), float(bounding_box['lon_max'])
+        )
+        if not all(math.isfinite(v) for v in bbox):
+            raise ValueError(f"Bounding box no válida: {bounding_box}")
+        return replace(self, bbox=bbox)
+
+    @property
+    def forma(self) -> tuple:
+        return tuple(len(getattr(self, filtro)) for filtro in FILTROS) + (self.bbox is not None,)
+
+    def a_formula(self) -> str:
+        valores = [escapar_cadena(v) for filtro in FILTROS for v in opciones_filtro(self, filtro)]
+        if self.bbox is not None:
+            valores.extend(self.bbox)
+        return plantilla_formula(self.forma).format(*valores)
+
+    def predicado(self) -> Callable[[dict], bool]:
+        return compilar_predicado(self)
+
+# Condiciones sueltas que añade la paginación a la fórmula de una consulta (ver paginacion.py):
+#   - fuera de una caja (lo que ya se ha leído no se vuelve a pedir)
+#   - NBH2 menor o igual que un valor, con los vacíos (que van al final del orden); con None solo los vacíos
+def formula_fuera_de_bbox(bounding_box: dict) -> str:
+    return (
+        "OR({{location/lat}} < {lat_min}, {{location/lat}} > {lat_max}, "
+        "{{location/lng}} < {lon_min}, {{location/lng}} > {lon_max})"
+    ).format(**{k: float(v) for k, v in bounding_box.items()})
+
+def formula_nbh2_hasta(nbh2: Optional[float]) -> str:
+    if nbh2 is None:
+        return "{NBH2} = BLANK()"
+    return f"OR({{NBH2}} <= {float(nbh2)}, {{NBH2}} = BLANK())"
+
+# AND de varias fórmulas (las vacías no cuentan)
+def formula_y(*formulas: str) -> str:
+    formulas = [f for f in formulas if f]
+    if len(formulas) <= 1:
+        return formulas[0] if formulas else ""
+    return f"AND({', '.join(formulas)})"
+
+# Plantilla de la fórmula para una forma de consulta. Los valores se rellenan después con format()
+@lru_cache(maxsize=256)
+def plantilla_formula(forma: tuple) -> str:
+    partes = []
+    for filtro, opciones in zip(FILTROS, forma):
+        condicion = CONDICION_FORMULA[filtro]
+        if opciones == 1:
+            partes.append(condicion)
+        elif opciones > 1:
+            partes.append(f"OR({', '.join([condicion] * opciones)})")
+    if forma[-1]:
+        partes.extend([
+            "{{location/lat}} >= {}",
+            "{{location/lat}} <= {}",
+            "{{location/lng}} >= {}",
+            "{{location/lng}} <= {}",
+        ])
+    return f"AND({', '.join(partes)})" if partes else ""
+
+# Predicado sobre los fields de un registro, equivalente a la fórmula (pliega lo mismo que ella).
+# Los registros sin coordenadas nunca pasan el filtro de bounding box
+@lru_cache(maxsize=256)
+def compilar_predicado(consulta: ConsultaRestaurantes) -> Callable[[dict], bool]:
+    comprobaciones = []
+    for filtro in FILTROS:
+        opciones = opciones_filtro(consulta, filtro)
+        if opciones:
+            campo = CAMPO_FILTRO[filtro]
+            comprobaciones.append(
+                lambda fields, campo=campo, opciones=opciones: any(o in texto_filtro(fields, campo) for o in opciones)
+            )
+    if consulta.bbox is not None:
+        lat_min, lat_max, lon_min, lon_max = consulta.bbox
+
+        def en_bbox(fields):
+            lat = leer_coordenada(fields, 'location/lat')
+            lng = leer_coordenada(fields, 'location/lng')
+            return lat is not None and lng is not None and lat_min <= lat <= lat_max and lon_min <= lng <= lon_max
+        comprobaciones.append(en_bbox)
+
+    def predicado(fields: dict) -> bool:
+        return all(comprobacion(fields) for comprobacion in comprobaciones)
+    return predicado
+
+# Columnas del catálogo para la evaluación vectorizada (los textos ya plegados, ver texto_filtro)
+def construir_columnas(registros: list) -> Dict[str, np.ndarray]:
+    columnas = {
+        "location/lat": np.array([leer_coordenada(r.get('fields', {}), 'location/lat') for r in registros], dtype=float),
+        "location/lng": np.array([leer_coordenada(r.get('fields', {}), 'location/lng') for r in registros], dtype=float),
+    }
+    for campo in set(CAMPO_FILTRO.values()):
+        columna = np.empty(len(registros), dtype=object)
+        columna[:] = [texto_filtro(r.get('fields', {}), campo) for r in registros]
+        columnas[campo] = columna
+    return columnas
+
+# Máscara booleana de las filas (todas o solo 'posiciones') que cumplen la consulta. La bbox se evalúa con numpy
+# sobre los arrays de lat/lng; los filtros de texto solo sobre las filas que siguen vivas
+def evaluar_columnas(consulta: ConsultaRestaurantes, columnas: Dict[str, np.ndarray],
+                     posiciones: Optional[np.ndarray] = None) -> np.ndarray:
+    if posiciones is None:
+        posiciones = np.arange(len(columnas["location/lat"]))
+    mascara = np.ones(len(posiciones), dtype=bool)
+    if consulta.bbox is not None:
+        lat_min, lat_max, lon_min, lon_max = consulta.bbox
+        lats = columnas["location/lat"][posiciones]
+        lngs = columnas["location/lng"][posiciones]
+        mascara &= (lats >= lat_min) & (lats <= lat_max) & (lngs >= lon_min) & (lngs <= lon_max)
+    for filtro in FILTROS:
+        opciones = opciones_filtro(consulta, filtro)
+        if not opciones:
+            continue
+        vivas = np.flatnonzero(mascara)
+        if len(vivas) == 0:
+            break
+        textos = columnas[CAMPO_FILTRO[filtro]][posiciones[vivas]]
+        mascara[vivas] = np.fromiter((any(o in t for o in opciones) for t in textos), dtype=bool, count=len(vivas))
+    return mascara
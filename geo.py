@@ -0,0 +1,133 @@
+# Utilidades geográficas (distancias y bounding boxes)
+from math import radians, cos, sin, asin, sqrt, pi
+from typing import Optional, List, Sequence, Tuple
+import numpy as np
+
+# Calcula la distancia haversiana entre dos puntos (lo uso para el filtro de zona)
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    c = 2 * asin(sqrt(a))
+    km = 6367 * c
+    return km
+
+# Calculamos la bounding_box dependiendo del punto central de búsqueda (coordenadas del centro de la ciudad o del "centro" de la zona que pide el cliente)
+def calcular_bounding_box(lat, lon, radio_km=1):
+    # Aproximación: 1 grado de latitud ~ 111.32 km
+    km_por_grado_lat = 111.32
+    delta_lat = radio_km / km_por_grado_lat
+
+    # Para la longitud, depende de la latitud
+    cos_lat = cos(radians(lat))
+    km_por_grado_lon = 111.32 * cos_lat
+    delta_lon = radio_km / km_por_grado_lon
+
+    lat_min = lat - delta_lat
+    lat_max = lat + delta_lat
+    lon_min = lon - delta_lon
+    lon_max = lon + delta_lon
+
+    return {
+        "lat_min": lat_min,
+        "lat_max": lat_max,
+        "lon_min": lon_min,
+        "lon_max": lon_max
+    }
+
+# Lee una coordenada de los fields de Airtable. Devuelve None si no hay o no es un número
+def leer_coordenada(fields: dict, campo: str) -> Optional[float]:
+    valor = fields.get(campo)
+    if valor is None or valor == "":
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+# Versión vectorizada de haversine: distancia (km) desde un punto a arrays de lats/lngs.
+# Las coordenadas que falten (NaN) salen con distancia infinita
+def haversine_vectorizado(lon1: float, lat1: float, lngs: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    lon1, lat1 = radians(lon1), radians(lat1)
+    lngs = np.radians(lngs)
+    lats = np.radians(lats)
+    a = np.sin((lats - lat1) / 2) ** 2 + cos(lat1) * np.cos(lats) * np.sin((lngs - lon1) / 2) ** 2
+    km = 6367 * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    km[np.isnan(km)] = np.inf
+    return km
+
+# Índices de los k valores más pequeños de 'distancias', ya ordenados. Usa selección parcial (argpartition)
+# en vez de ordenar todo. A igual distancia decide 'desempate' (menor primero) y después la posición original
+def seleccionar_cercanos(distancias: np.ndarray, k: Optional[int] = None,
+                         desempate: Optional[np.ndarray] = None) -> np.ndarray:
+    n = len(distancias)
+    if desempate is None:
+        desempate = np.arange(n)
+    if k is None or k >= n:
+        seleccion = np.arange(n)
+    elif k <= 0:
+        return np.arange(0)
+    else:
+        # El k-ésimo valor hace de corte; con empates justo en el corte nos quedamos con los de mejor desempate
+        corte = distancias[np.argpartition(distancias, k - 1)[k - 1]]
+        menores = np.flatnonzero(distancias < corte)
+        empatados = np.flatnonzero(distancias == corte)
+        empatados = empatados[np.lexsort((empatados, desempate[empatados]))][:k - len(menores)]
+        seleccion = np.concatenate((menores, empatados))
+    return seleccion[np.lexsort((seleccion, desempate[seleccion], distancias[seleccion]))]
+
+# Ordena registros de Airtable por distancia al punto y devuelve los k primeros.
+# Los registros sin coordenadas van al final (antes se tomaban como (0, 0)), manteniendo su orden
+def ordenar_por_proximidad(registros: List[dict], lat: float, lng: float, k: Optional[int] = None) -> List[dict]:
+    if not registros:
+        return []
+    lats = np.array([leer_coordenada(r.get('fields', {}), 'location/lat') for r in registros], dtype=float)
+    lngs = np.array([leer_coordenada(r.get('fields', {}), 'location/lng') for r in registros], dtype=float)
+    distancias = haversine_vectorizado(lng, lat, lngs, lats)
+    return [registros[i] for i in seleccionar_cercanos(distancias, k)]
+
+# Los registros que están a como mucho radio_km del punto, ordenados por distancia (a igual distancia, en su orden),
+# igual que los ordena ordenar_por_proximidad
+def dentro_del_radio(registros: List[dict], lat: float, lng: float, radio_km: float) -> List[dict]:
+    if not registros:
+        return []
+    lats = np.array([leer_coordenada(r.get('fields', {}), 'location/lat') for r in registros], dtype=float)
+    lngs = np.array([leer_coordenada(r.get('fields', {}), 'location/lng') for r in registros], dtype=float)
+    distancias = haversine_vectorizado(lng, lat, lngs, lats)
+    dentro = np.flatnonzero(distancias <= radio_km)
+    return [registros[i] for i in dentro[np.lexsort((dentro, distancias[dentro]))]]
+
+# ¿Está el punto dentro del polígono [(lat, lng), ...]? Ray casting: cuenta cuántos lados cruza una semirrecta
+def punto_en_poligono(lat: float, lng: float, poligono: Sequence[Tuple[float, float]]) -> bool:
+    dentro = False
+    lat_j, lng_j = poligono[-1]
+    for lat_i, lng_i in poligono:
+        if (lat_i > lat) != (lat_j > lat):
+            lng_cruce = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < lng_cruce:
+                dentro = not dentro
+        lat_j, lng_j = lat_i, lng_i
+    return dentro
+
+# Bounding box (mismo formato que calcular_bounding_box) que envuelve un polígono
+def bounding_box_poligono(poligono: Sequence[Tuple[float, float]]) -> dict:
+    lats = [p[0] for p in poligono]
+    lngs = [p[1] for p in poligono]
+    return {"lat_min": min(lats), "lat_max": max(lats), "lon_min": min(lngs), "lon_max": max(lngs)}
+
+# Rectángulos centrados en el punto (bounding boxes, mismo formato que calcular_bounding_box) con las esquinas sobre
+# el círculo de radio_km, de más ancho y bajo a más estrecho y alto. Entre todos cubren más del círculo que el
+# cuadrado inscrito: con 1 el 64%, con 4 el 88%
+def cajas_inscritas(lat, lon, radio_km, cajas=4) -> List[dict]:
+    resultado = []
+    for k in range(1, cajas + 1):
+        angulo = k * pi / (2 * (cajas + 1))
+        alto, ancho = radio_km * sin(angulo), radio_km * cos(angulo)
+        resultado.append({
+            "lat_min": lat - alto / 111.32,
+            "lat_max": lat + alto / 111.32,
+            "lon_min": lon - ancho / (111.32 * cos(radians(lat))),
+            "lon_max": lon + ancho / (111.32 * cos(radians(lat)))
+        })
+    return resultado
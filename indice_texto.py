@@ -0,0 +1,189 @@
+# Índice invertido sobre los textos del catálogo (categories_string y google_reviews) para los filtros de
+# cocina, dieta y plato. Tokeniza el texto plegado igual que lo compara el filtro (filtros.plegar_texto), así que
+# nunca se deja fuera un registro que lo cumpla; solo preselecciona candidatos y la comprobación exacta la hace
+# luego el catálogo
+import re
+import sys
+import hashlib
+from typing import Optional, List, Dict, Set, Iterable
+from filtros import CAMPO_FILTRO, ConsultaRestaurantes, plegar_texto
+
+# Filtros que se resuelven con el índice y el campo de Airtable en el que buscan
+CAMPOS_FILTRO = {filtro: campo for filtro, campo in CAMPO_FILTRO.items() if filtro != "price_range"}
+
+_PATRON_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenizar(texto: Optional[str]) -> List[str]:
+    return _PATRON_TOKEN.findall(plegar_texto(texto)) if texto else []
+
+class IndiceTexto:
+    def __init__(self, campos: Iterable[str] = ("categories_string", "google_reviews")):
+        self.campos = tuple(campos)
+        # campo -> token -> ids de registro
+        self._postings: Dict[str, Dict[str, Set[str]]] = {campo: {} for campo in self.campos}
+        # id -> campo -> (huella del texto, tokens), para saber qué cambia y poder quitar lo viejo. Los tokens van
+        # internados y en tupla: con google_reviews esto es la mayor parte de la memoria del índice
+        self._documentos: Dict[str, Dict[str, tuple]] = {}
+        # Trigramas del vocabulario por campo: trigrama -> tokens que lo tienen. Cada token se marca con "^" al
+        # principio y "$" al final ("^sushi$"), así que los trozos de palabra del principio o del final de una
+        # consulta también se resuelven con trigramas. Se mantiene al añadir y quitar tokens del vocabulario
+        self._trigramas: Dict[str, Dict[str, Set[str]]] = {campo: {} for campo in self.campos}
+        self.actualizaciones = 0
+
+    def __len__(self):
+        return len(self._documentos)
+
+    @staticmethod
+    def _huella(texto: str) -> bytes:
+        return hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest()
+
+    def actualizar(self, id_registro: str, fields: dict):
+        documento = self._documentos.setdefault(id_registro, {})
+        for campo in self.campos:
+            texto = fields.get(campo) or ""
+            if isinstance(texto, list):
+                texto = ", ".join(str(t) for t in texto)
+            huella = self._huella(texto)
+            anterior = documento.get(campo)
+            if anterior is not None and anterior[0] == huella:
+                continue
+            tokens = set(map(sys.intern, tokenizar(texto)))
+            viejos = set(anterior[1]) if anterior is not None else set()
+            postings = self._postings[campo]
+            for token in viejos - tokens:
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(id_registro)
+                    if not ids:
+                        del postings[token]
+                        self._quitar_trigramas(campo, token)
+            for token in tokens - viejos:
+                if token not in postings:
+                    postings[token] = set()
+                    self._poner_trigramas(campo, token)
+                postings[token].add(id_registro)
+            documento[campo] = (huella, tuple(tokens))
+            self.actualizaciones += 1
+
+    def eliminar(self, id_registro: str):
+        documento = self._documentos.pop(id_registro, None)
+        if documento is None:
+            return
+        for campo, (_, tokens) in documento.items():
+            postings = self._postings[campo]
+            for token in tokens:
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(id_registro)
+                    if not ids:
+                        del postings[token]
+                        self._quitar_trigramas(campo, token)
+
+    # Pone el índice al día con la lista completa de registros: solo reindexa los que han cambiado
+    # y quita los que ya no están
+    def sincronizar(self, registros: Iterable[dict]):
+        vistos = set()
+        for registro in registros:
+            id_registro = registro.get('id')
+            if not id_registro:
+                continue
+            vistos.add(id_registro)
+            self.actualizar(id_registro, registro.get('fields', {}))
+        for id_registro in list(self._documentos.keys() - vistos):
+            self.eliminar(id_registro)
+
+    @staticmethod
+    def _trigramas_de(patron: str) -> Set[str]:
+        return {patron[i:i + 3] for i in range(len(patron) - 2)}
+
+    def _poner_trigramas(self, campo: str, token: str):
+        trigramas = self._trigramas[campo]
+        for trigrama in self._trigramas_de(f"^{token}$"):
+            trigramas.setdefault(trigrama, set()).add(token)
+
+    def _quitar_trigramas(self, campo: str, token: str):
+        trigramas = self._trigramas[campo]
+        for trigrama in self._trigramas_de(f"^{token}$"):
+            tokens = trigramas.get(trigrama)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del trigramas[trigrama]
+
+    # Tokens del vocabulario que contienen el patrón (un término, con "^" y/o "$" si tiene que ir al principio o al
+    # final de la palabra). Con tres letras o más se cruzan los tokens de sus trigramas; los patrones más cortos
+    # ("a", "de" suelto como única palabra) recorren las claves de trigramas, no el vocabulario entero
+    def _tokens_con(self, campo: str, patron: str) -> Set[str]:
+        if patron.startswith("^") and patron.endswith("$"):
+            token = patron[1:-1]
+            return {token} if token in self._postings[campo] else set()
+        trigramas = self._trigramas[campo]
+        if len(patron) < 3:
+            tokens: Set[str] = set()
+            for trigrama, con_trigrama in trigramas.items():
+                if patron in trigrama:
+                    tokens |= con_trigrama
+        else:
+            conjuntos = []
+            for trigrama in self._trigramas_de(patron):
+                con_trigrama = trigramas.get(trigrama)
+                if con_trigrama is None:
+                    return set()
+                conjuntos.append(con_trigrama)
+            conjuntos.sort(key=len)
+            tokens = set(conjuntos[0]).intersection(*conjuntos[1:])
+        # Los trigramas no dicen en qué orden van: se comprueba el patrón entero
+        return {token for token in tokens if patron in f"^{token}$"}
+
+    # Ids cuyo campo puede contener el texto buscado: los que tienen, para cada término de la consulta, una palabra
+    # que encaja con él. Con un solo término vale cualquier palabra que lo contenga ("aell" casa con "paella"); con
+    # varios, el primero tiene que ser el final de una palabra, el último su principio y los de en medio palabras
+    # enteras ("ana, piz" casa con "italiana, pizza"). Es un superconjunto de lo que casa de verdad. Devuelve None si
+    # la consulta no tiene términos
+    def buscar(self, campo: str, consulta: str) -> Optional[Set[str]]:
+        terminos = tokenizar(consulta)
+        if not terminos:
+            return None
+        patrones = {
+            ("^" if i > 0 else "") + termino + ("$" if i < len(terminos) - 1 else "")
+            for i, termino in enumerate(terminos)
+        }
+        resultado: Optional[Set[str]] = None
+        # Empezamos por los patrones más largos (más selectivos)
+        for patron in sorted(patrones, key=len, reverse=True):
+            ids: Set[str] = set()
+            for token in self._tokens_con(campo, patron):
+                ids |= self._postings[campo][token]
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return resultado
+
+    # Ids que pueden pasar los filtros de texto (cocina, diet, dish): OR entre las opciones de un filtro y AND entre
+    # filtros. Devuelve None si no hay filtros de texto
+    def candidatos(self, consulta: ConsultaRestaurantes) -> Optional[Set[str]]:
+        resultado: Optional[Set[str]] = None
+        for filtro, campo in CAMPOS_FILTRO.items():
+            valores = getattr(consulta, filtro)
+            if not valores:
+                continue
+            ids_filtro: Set[str] = set()
+            for valor in valores:
+                ids = self.buscar(campo, valor)
+                if ids is None:
+                    # Opción vacía: como SEARCH('', ...), vale cualquier registro
+                    ids_filtro = set(self._documentos)
+                    break
+                ids_filtro |= ids
+            resultado = ids_filtro if resultado is None else resultado & ids_filtro
+            if not resultado:
+                return set()
+        return resultado
+
+    def estadisticas(self) -> dict:
+        return {
+            "documentos": len(self._documentos),
+            "tokens": {campo: len(postings) for campo, postings in self._postings.items()},
+            "trigramas": {campo: len(trigramas) for campo, trigramas in self._trigramas.items()},
+            "actualizaciones": self.actualizaciones,
+        }
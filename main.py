@@ -1,22 +1,200 @@
 # IMPORTS (NO TOCAR)
 from fastapi import FastAPI, Query, HTTPException, Request
-from typing import Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse, JSONResponse
+from typing import Optional, List
+from pydantic import BaseModel, Field
+import asyncio
+from contextlib import asynccontextmanager
+import hmac
 import logging
 from datetime import datetime
 from bistrohunter import (
     obtener_restaurantes_por_ciudad,
+    obtener_restaurantes_por_partes,
     calcular_bounding_box,  
     obtener_coordenadas_zona,
     haversine,
+    cerrar_cliente_http,
+    tarea_refresco_catalogo,
+    procesar_webhook_catalogo,
+    buscar_lote,
+    estadisticas_lote,
+    LOTE_MAX_BUSQUEDAS,
+    CAMPOS_RESPUESTA,
+    CATALOGO_WEBHOOK_TOKEN,
 )
+from cache import cache_geocodificacion, cache_resultados
+from cache_compartida import cache_compartida
+from singleflight import vuelo_geocodificacion, vuelo_airtable, vuelo_busquedas
+from planificador import planificador_airtable, AirtableError
+from catalogo import catalogo
+from nomenclator import nomenclator
+from snapshot import formatear_restaurante
+from metricas import metricas, MiddlewareMetricas, METRICAS_TOKEN
+from calentamiento import historial_consultas, estado_arranque, fase_arranque
+from paginacion import buscar_pagina
+
+# Serialización de las respuestas en streaming: orjson si está instalado (bastante más rápido), si no json
+try:
+    import orjson
+
+    def linea_ndjson(objeto) -> bytes:
+        return orjson.dumps(objeto, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    import json
+
+    def linea_ndjson(objeto) -> bytes:
+        return (json.dumps(objeto, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+# Arranque y apagado de la app: lanzamos la fase de arranque (snapshot del catálogo y calentamiento de las cachés,
+# ver calentamiento.py; /ready da 503 hasta que termina) y la carga/refresco del catálogo local, y al parar volcamos
+# el registro de consultas y cerramos el pool HTTP. El nomenclátor recupera las zonas que ya resolvió Google en
+# ejecuciones anteriores. La conexión con la caché compartida (si la hay) se cierra al final
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    nomenclator.cargar_aprendidas(await asyncio.to_thread(cache_geocodificacion.entradas))
+    tarea_arranque = asyncio.create_task(fase_arranque())
+    tarea_catalogo = asyncio.create_task(tarea_refresco_catalogo())
+    yield
+    tarea_arranque.cancel()
+    tarea_catalogo.cancel()
+    historial_consultas.volcar()
+    await cerrar_cliente_http()
+    if cache_compartida is not None:
+        await cache_compartida.cerrar()
 
 # DEFINIMOS NUESTRA API
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Cabecera Server-Timing y duración de cada petición (ver metricas.py)
+app.add_middleware(MiddlewareMetricas)
+
+# Comprueba "Authorization: Bearer <token>" para los endpoints internos. Sin token configurado el endpoint no existe
+def comprobar_token(request: Request, token: Optional[str], nombre: str):
+    if not token:
+        raise HTTPException(status_code=404, detail=f"{nombre} no configurado")
+    autorizacion = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(autorizacion.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Token no válido")
 
 @app.get("/")
 async def root():
     return {"message": "Bienvenido a la API de búsqueda de restaurantes"}
 
+# Readiness (healthCheckPath de Render): 503 mientras dura la fase de arranque, 200 cuando las cachés están calientes
+@app.get("/ready")
+async def ready():
+    return JSONResponse(estado_arranque.estadisticas(), status_code=200 if estado_arranque.listo else 503)
+
+# Variables de la búsqueda tal y como las devuelve el endpoint
+def variables_busqueda(city, price_range, cocina, diet, dish, zona, coordenadas) -> dict:
+    return {
+        "city": city,
+        "price_range": price_range,
+        "cuisine_type": cocina,
+        "diet": diet,
+        "dish": dish,
+        "zone": zona,
+        "coordenadas": coordenadas
+    }
+
+# Respuesta de una búsqueda (la usan /api/getRestaurantsPrueba y cada búsqueda del lote)
+def construir_respuesta(restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda,
+                        variables: dict, api_call: str) -> dict:
+    # ¿Hay restaurantes?
+    if not restaurantes:
+        return {
+            "mensaje": "No se encontraron restaurantes con los filtros aplicados.",
+            "variables": variables,
+            "api_call": api_call,
+            "final_filter_formula": final_filter_formula  # opcional, para debug
+        }
+
+    # Hay restaurantes
+    with metricas.medir("respuesta"):
+        resultados = [formatear_restaurante(r) for r in restaurantes]
+
+    return {
+        "restaurants": resultados,
+        "variables": variables,
+        "search_center_lat": lat_centro_busqueda,
+        "search_center_lng": lon_centro_busqueda,
+        "api_call": api_call,
+        "final_filter_formula": final_filter_formula
+    }
+
+# Respuesta en streaming (NDJSON): una línea {"tipo": "restaurante", "restaurante": {...}} por restaurante en cuanto
+# se sabe que está en el resultado final (en su orden definitivo) y una última {"tipo": "resumen", ...} con lo mismo
+# que la respuesta normal menos la lista. Los errores antes del primer restaurante salen con su código HTTP; los de
+# después, como una línea {"tipo": "error", ...}
+async def respuesta_ndjson(parametros: dict, variables: dict, api_call: str) -> StreamingResponse:
+    partes = obtener_restaurantes_por_partes(**parametros)
+    try:
+        primera = await anext(partes)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error al buscar restaurantes en /api/getRestaurantsPrueba: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+    async def lineas():
+        total = 0
+        try:
+            parte = primera
+            while True:
+                tipo, valor = parte
+                if tipo == "parcial":
+                    with metricas.medir("respuesta"):
+                        bloque = b"".join(
+                            linea_ndjson({"tipo": "restaurante", "restaurante": formatear_restaurante(r)})
+                            for r in valor
+                        )
+                    total += len(valor)
+                    yield bloque
+                else:
+                    _, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda = valor
+                    resumen = {
+                        "tipo": "resumen",
+                        "total": total,
+                        "variables": variables,
+                        "search_center_lat": lat_centro_busqueda,
+                        "search_center_lng": lon_centro_busqueda,
+                        "api_call": api_call,
+                        "final_filter_formula": final_filter_formula
+                    }
+                    if not total:
+                        resumen["mensaje"] = "No se encontraron restaurantes con los filtros aplicados."
+                    yield linea_ndjson(resumen)
+                    return
+                parte = await anext(partes)
+        except HTTPException as e:
+            yield linea_ndjson({"tipo": "error", "status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logging.error(f"Error en la respuesta en streaming de /api/getRestaurantsPrueba: {e}")
+            yield linea_ndjson({"tipo": "error", "status_code": 500, "detail": "Error interno del servidor"})
+        finally:
+            await partes.aclose()
+
+    return StreamingResponse(lineas(), media_type="application/x-ndjson")
+
+# Respuesta paginada (con 'limite' o 'cursor'): la respuesta normal con los restaurantes de la página, el tamaño de
+# página y "next_cursor" (null en la última). Con cursor la búsqueda es la del cursor (ver paginacion.py)
+async def respuesta_paginada(parametros: dict, variables: dict, api_call: str) -> dict:
+    try:
+        restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda, siguiente, limite = (
+            await buscar_pagina(**parametros)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error al paginar restaurantes en /api/getRestaurantsPrueba: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+    respuesta = construir_respuesta(
+        restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda, variables, api_call
+    )
+    respuesta["limite"] = limite
+    respuesta["next_cursor"] = siguiente
+    return respuesta
+
 #NUESTRO ENDPOINT (este es el de pruebas)
 @app.get("/api/getRestaurantsPrueba")
 async def get_restaurantes(
@@ -27,10 +205,32 @@ async def get_restaurantes(
     cocina: Optional[str] = Query(None, description="Tipo de cocina preferida"),
     diet: Optional[str] = Query(None, description="Restricciones dietéticas"),
     dish: Optional[str] = Query(None, description="Plato específico"),
-    zona: Optional[str] = Query(None, description="Zona específica dentro de la ciudad")
+    zona: Optional[str] = Query(None, description="Zona específica dentro de la ciudad"),
+    formato: Optional[str] = Query(None, description="'ndjson' para recibir los restaurantes según se confirman"),
+    limite: Optional[int] = Query(None, description="Restaurantes por página (activa la paginación)"),
+    cursor: Optional[str] = Query(None, description="'next_cursor' de la página anterior")
 ):
+    if not cursor:
+        historial_consultas.registrar(
+            city, zona=zona, coordenadas=coordenadas, price_range=price_range, cocina=cocina, diet=diet, dish=dish
+        )
+    if limite is not None or cursor:
+        return await respuesta_paginada(
+            dict(city=city, price_range=price_range, cocina=cocina, diet=diet, dish=dish, zona=zona,
+                 coordenadas=coordenadas, limite=limite, cursor=cursor, campos=CAMPOS_RESPUESTA),
+            variables_busqueda(city, price_range, cocina, diet, dish, zona, coordenadas),
+            f"{request.method} {request.url}"
+        )
+    if formato == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        return await respuesta_ndjson(
+            dict(city=city, price_range=price_range, cocina=cocina, diet=diet, dish=dish, zona=zona,
+                 coordenadas=coordenadas, sort_by_proximity=True, campos=CAMPOS_RESPUESTA),
+            variables_busqueda(city, price_range, cocina, diet, dish, zona, coordenadas),
+            f"{request.method} {request.url}"
+        )
+
     try:
-        restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda = obtener_restaurantes_por_ciudad(
+        restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda = await obtener_restaurantes_por_ciudad(
     city=city,
     price_range=price_range,
     cocina=cocina,
@@ -38,7 +238,8 @@ async def get_restaurantes(
     dish=dish,
     zona=zona,
     coordenadas=coordenadas,
-    sort_by_proximity=True
+    sort_by_proximity=True,
+    campos=CAMPOS_RESPUESTA
 )
         
         # SOLICITUD
@@ -46,60 +247,116 @@ async def get_restaurantes(
         request_method = request.method
         api_call = f"{request_method} {full_url}"
 
-        # ¿Hay restaurantes?
-        if not restaurantes:
-            return {
-                "mensaje": "No se encontraron restaurantes con los filtros aplicados.",
-                "variables": {
-                    "city": city,
-                    "price_range": price_range,
-                    "cuisine_type": cocina,
-                    "diet": diet,
-                    "dish": dish,
-                    "zone": zona,
-                    "coordenadas": coordenadas
-                },
-                "api_call": api_call,
-                "final_filter_formula": final_filter_formula  # opcional, para debug
-            }
-
-        # Hay restaurantes
-        resultados = [
-            {
-                "cid": r["fields"].get("cid"),
-                "title": r["fields"].get("title", "Sin título"),
-                "description": r["fields"].get("bh_message", "Sin descripción"),
-                "price_range": r["fields"].get("price_range", "No especificado"),
-                "score": r["fields"].get("NBH2", "N/A"),
-                "url": r["fields"].get("url", "No especificado"),
-                "lat_restaurante": r["fields"].get("location/lat"),
-                "lon_restaurante": r["fields"].get("location/lng"),
-                "categories_string": r["fields"].get("categories_string")
-            }
-            for r in restaurantes
-        ]
-
-        return {
-            "restaurants": resultados,
-            "variables": {
-                "city": city,
-                "price_range": price_range,
-                "cuisine_type": cocina,
-                "diet": diet,
-                "dish": dish,
-                "zone": zona,
-                "coordenadas": coordenadas
-            },
-            "search_center_lat": lat_centro_busqueda,  
-            "search_center_lng": lon_centro_busqueda, 
-            "api_call": api_call,
-            "final_filter_formula": final_filter_formula
-        }
+        return construir_respuesta(
+            restaurantes, final_filter_formula, lat_centro_busqueda, lon_centro_busqueda,
+            variables_busqueda(city, price_range, cocina, diet, dish, zona, coordenadas), api_call
+        )
 
+    except HTTPException:
+        # 503 si Airtable está saturado: el cliente puede reintentar
+        raise
     except Exception as e:
         logging.error(f"Error al buscar restaurantes en /api/getRestaurantsPrueba: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# Varias búsquedas en una sola petición (p. ej. la misma zona con distintas cocinas). Cuerpo:
+# {"busquedas": [{"city": ..., "zona": ..., "cocina": ...}, ...]} con los mismos parámetros que /api/getRestaurantsPrueba.
+# Devuelve {"resultados": [...]} en el mismo orden, cada uno con la misma forma que la respuesta de ese endpoint
+# o con {"error": {"status_code", "detail"}} si esa búsqueda ha fallado (las demás se devuelven igual)
+class BusquedaLote(BaseModel):
+    city: str = Field(..., description="Ciudad donde buscar restaurantes")
+    coordenadas: Optional[str] = Field(None, description="Coordenadas en formato 'lat,lng'")
+    price_range: Optional[str] = Field(None, description="Rango de precios")
+    cocina: Optional[str] = Field(None, description="Tipo de cocina preferida")
+    diet: Optional[str] = Field(None, description="Restricciones dietéticas")
+    dish: Optional[str] = Field(None, description="Plato específico")
+    zona: Optional[str] = Field(None, description="Zona específica dentro de la ciudad")
+
+class PeticionLote(BaseModel):
+    busquedas: List[BusquedaLote]
+
+@app.post("/api/getRestaurantsPrueba/lote")
+async def get_restaurantes_lote(request: Request, peticion: PeticionLote):
+    if not peticion.busquedas:
+        raise HTTPException(status_code=400, detail="El lote no tiene búsquedas")
+    if len(peticion.busquedas) > LOTE_MAX_BUSQUEDAS:
+        raise HTTPException(status_code=400, detail=f"Como mucho {LOTE_MAX_BUSQUEDAS} búsquedas por lote")
+
+    busquedas = [b.model_dump() for b in peticion.busquedas]
+    for busqueda in busquedas:
+        historial_consultas.registrar(**busqueda)
+    resultados = await buscar_lote(busquedas, campos=CAMPOS_RESPUESTA)
+
+    respuestas = []
+    for i, (busqueda, resultado) in enumerate(zip(busquedas, resultados)):
+        variables = variables_busqueda(
+            busqueda["city"], busqueda["price_range"], busqueda["cocina"], busqueda["diet"], busqueda["dish"],
+            busqueda["zona"], busqueda["coordenadas"]
+        )
+        if isinstance(resultado, HTTPException):
+            respuestas.append({"error": {"status_code": resultado.status_code, "detail": resultado.detail},
+                               "variables": variables})
+        elif isinstance(resultado, Exception):
+            logging.error(f"Error en la búsqueda {i} del lote: {resultado!r}")
+            respuestas.append({"error": {"status_code": 500, "detail": "Error interno del servidor"},
+                               "variables": variables})
+        else:
+            respuestas.append(construir_respuesta(*resultado, variables, f"{request.method} {request.url} [{i}]"))
+    return {"resultados": respuestas}
+
+# Contadores de las cachés (para ajustar TTLs y tamaños)
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {
+        "geocodificacion": cache_geocodificacion.estadisticas(),
+        "nomenclator": nomenclator.estadisticas(),
+        "resultados": cache_resultados.estadisticas(),
+        "compartida": cache_compartida.estadisticas() if cache_compartida is not None else None,
+        "coalescencia": {
+            "busquedas": vuelo_busquedas.estadisticas(),
+            "geocodificacion": vuelo_geocodificacion.estadisticas(),
+            "airtable": vuelo_airtable.estadisticas(),
+        },
+        "planificador_airtable": planificador_airtable.estadisticas(),
+        "lote": estadisticas_lote,
+        "historial": historial_consultas.estadisticas(),
+    }
+
+# Histogramas de latencia por etapa en formato de texto de Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4")
+
+# Enciende o apaga las métricas sin reiniciar (PUT /api/metricas?activas=false). Autenticado con METRICAS_TOKEN
+@app.put("/api/metricas")
+async def activar_metricas(request: Request, activas: bool = Query(..., description="Tomar métricas o no")):
+    comprobar_token(request, METRICAS_TOKEN, "Cambio de métricas")
+    metricas.activas = activas
+    return {"activas": metricas.activas}
+
+# Estado del catálogo local (réplica de Restaurantes DB)
+@app.get("/api/catalogo/stats")
+async def catalogo_stats():
+    return catalogo.estadisticas()
+
+# Webhook para la automatización (n8n): aplica al momento altas, cambios y bajas de restaurantes en el catálogo
+# local y limpia solo las búsquedas cacheadas afectadas. Cuerpo: {"registros": [...], "ids": [...], "eliminados": [...]}
+# (ver procesar_webhook_catalogo). Autenticado con "Authorization: Bearer <CATALOGO_WEBHOOK_TOKEN>"
+@app.post("/api/catalogo/webhook")
+async def catalogo_webhook(request: Request):
+    comprobar_token(request, CATALOGO_WEBHOOK_TOKEN, "Webhook del catálogo")
+    try:
+        datos = await request.json()
+    except ValueError:
+        datos = None
+    if not isinstance(datos, dict):
+        raise HTTPException(status_code=400, detail="El cuerpo tiene que ser un objeto JSON")
+    try:
+        return await procesar_webhook_catalogo(datos)
+    except AirtableError as e:
+        logging.error(f"Airtable no disponible en el webhook del catálogo: {e}")
+        raise HTTPException(status_code=503, detail="Airtable no está disponible ahora mismo")
+
 # PROCESAMOS VARIABLES DEL CLIENTE (Creo que esta actualmente no se usa, no estoy segura)
 @app.post("/procesar-variables")
 async def procesar_variables(request: Request):
@@ -118,7 +375,7 @@ async def procesar_variables(request: Request):
 
         # Llamar a la función para obtener los restaurantes y la fórmula de filtro
         logging.info(f"Coordenadas recibidas: {coordenadas}")
-        restaurantes, final_filter_formula = obtener_restaurantes_por_ciudad(
+        restaurantes, final_filter_formula = await obtener_restaurantes_por_ciudad(
             city=city,
             price_range=price_range,
             cocina=cocina,
@@ -0,0 +1,187 @@
+# Métricas de latencia por etapa (geocodificación, Airtable, catálogo, fusión, orden por proximidad, respuesta):
+# histogramas en /metrics con el formato de texto de Prometheus y una cabecera Server-Timing en cada respuesta.
+# Se pueden apagar en caliente (METRICAS_ACTIVAS / PUT /api/metricas) y entonces medir() no hace nada.
+# Todo pasa en el hilo del event loop, así que los contadores no llevan lock
+import os
+import time
+import contextvars
+from bisect import bisect_left
+from typing import Optional, Dict, Tuple, List
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+METRICAS_ACTIVAS = os.getenv('METRICAS_ACTIVAS', '1') == '1'
+# Token para encender/apagar las métricas con PUT /api/metricas (sin token no se pueden cambiar en caliente)
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN')
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # valores de las etiquetas -> [observaciones por bucket (el último es +Inf)..., suma]
+        self._series: Dict[tuple, list] = {}
+
+    def observar(self, valor: float, *etiquetas: str):
+        serie = self._series.get(etiquetas)
+        if serie is None:
+            serie = self._series[etiquetas] = [0] * (len(self.buckets) + 1) + [0.0]
+        serie[bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, serie in sorted(self._series.items()):
+            etiquetas = ",".join(f'{e}="{v}"' for e, v in zip(self.etiquetas, valores))
+            separador = "," if etiquetas else ""
+            acumulado = 0
+            for limite, observaciones in zip(self.buckets + (float("inf"),), serie[:-1]):
+                acumulado += observaciones
+                le = "+Inf" if limite == float("inf") else repr(float(limite))
+                lineas.append(f'{self.nombre}_bucket{{{etiquetas}{separador}le="{le}"}} {acumulado}')
+            sufijo = f"{{{etiquetas}}}" if etiquetas else ""
+            lineas.append(f"{self.nombre}_sum{sufijo} {serie[-1]}")
+            lineas.append(f"{self.nombre}_count{sufijo} {acumulado}")
+        return lineas
+
+# Lo medido durante una petición HTTP, para su cabecera Server-Timing: etapa -> [segundos, veces] y notas sueltas
+class MedicionPeticion:
+    __slots__ = ("inicio", "etapas", "notas")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas: Dict[str, list] = {}
+        self.notas: Dict[str, str] = {}
+
+    # Las etapas que corren en paralelo (varias zonas a la vez) suman su duración
+    def server_timing(self) -> str:
+        partes = []
+        for etapa, (segundos, veces) in self.etapas.items():
+            desc = f';desc="{veces}x"' if veces > 1 else ""
+            partes.append(f"{etapa};dur={segundos * 1000:.1f}{desc}")
+        for clave, texto in self.notas.items():
+            partes.append(f'{clave};desc="{texto}"')
+        partes.append(f"total;dur={(time.perf_counter() - self.inicio) * 1000:.1f}")
+        return ", ".join(partes)
+
+_medicion_actual: contextvars.ContextVar[Optional[MedicionPeticion]] = contextvars.ContextVar(
+    "medicion_peticion", default=None
+)
+
+class _Medida:
+    __slots__ = ("_metricas", "_etapa", "_inicio")
+
+    def __init__(self, metricas: "Metricas", etapa: str):
+        self._metricas = metricas
+        self._etapa = etapa
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metricas.registrar(self._etapa, time.perf_counter() - self._inicio)
+        return False
+
+class _SinMedir:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_SIN_MEDIR = _SinMedir()
+
+class Metricas:
+    def __init__(self, activas: bool = METRICAS_ACTIVAS):
+        self.activas = activas
+        self.etapas = Histograma(
+            "bistrohunter_etapa_segundos", "Duración de cada etapa de una búsqueda", ("etapa",), BUCKETS_SEGUNDOS
+        )
+        self.peticiones = Histograma(
+            "bistrohunter_peticion_segundos", "Duración de las peticiones HTTP", ("ruta", "estado"), BUCKETS_SEGUNDOS
+        )
+        self.airtable_registros = Histograma(
+            "bistrohunter_airtable_registros", "Registros devueltos por cada llamada a Airtable", ("prioridad",),
+            (0, 1, 10, 20, 40, 80, 100)
+        )
+        self.llamadas_radio = Histograma(
+            "bistrohunter_busqueda_llamadas_radio",
+            "Llamadas a Airtable (páginas incluidas) de las búsquedas por coordenadas, y si han cerrado los 80 más "
+            "cercanos (exacto) o se han quedado sin llamadas (aproximado)",
+            ("resultado",), (1, 2, 3, 4, 5, 6, 8, 10)
+        )
+
+    # with metricas.medir("etapa"): ... (si están apagadas no mide nada)
+    def medir(self, etapa: str):
+        return _Medida(self, etapa) if self.activas else _SIN_MEDIR
+
+    def registrar(self, etapa: str, segundos: float):
+        if not self.activas:
+            return
+        self.etapas.observar(segundos, etapa)
+        medicion = _medicion_actual.get()
+        if medicion is not None:
+            acumulado = medicion.etapas.get(etapa)
+            if acumulado is None:
+                medicion.etapas[etapa] = [segundos, 1]
+            else:
+                acumulado[0] += segundos
+                acumulado[1] += 1
+
+    def observar(self, histograma: Histograma, valor: float, *etiquetas: str):
+        if self.activas:
+            histograma.observar(valor, *etiquetas)
+
+    # Nota para la cabecera Server-Timing de la petición en curso (p. ej. cache;desc="hit")
+    def anotar(self, clave: str, texto: str):
+        if self.activas:
+            medicion = _medicion_actual.get()
+            if medicion is not None:
+                medicion.notas[clave] = texto
+
+    def exponer(self) -> str:
+        lineas = [
+            "# HELP bistrohunter_metricas_activas 1 si se están tomando métricas",
+            "# TYPE bistrohunter_metricas_activas gauge",
+            f"bistrohunter_metricas_activas {int(self.activas)}",
+        ]
+        for histograma in (self.etapas, self.peticiones, self.airtable_registros, self.llamadas_radio):
+            lineas.extend(histograma.exponer())
+        return "\n".join(lineas) + "\n"
+
+metricas = Metricas()
+
+# Middleware ASGI: abre la medición de cada petición, añade la cabecera Server-Timing y observa la duración total
+# por ruta (la plantilla de la ruta, no la URL, para no disparar el número de series)
+class MiddlewareMetricas:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metricas.activas:
+            await self.app(scope, receive, send)
+            return
+
+        medicion = MedicionPeticion()
+        token = _medicion_actual.set(medicion)
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+                cabecera = medicion.server_timing().encode("latin-1", "replace")
+                mensaje = {**mensaje, "headers": list(mensaje.get("headers", [])) + [(b"server-timing", cabecera)]}
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _medicion_actual.reset(token)
+            ruta = getattr(scope.get("route"), "path", "otra")
+            metricas.observar(metricas.peticiones, time.perf_counter() - medicion.inicio, ruta, str(estado))
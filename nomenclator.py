@@ -0,0 +1,178 @@
+# Nomenclátor de zonas: centroide (y, si lo hay, polígono) de cada barrio por ciudad, para resolver las zonas sin
+# llamar a Google. La búsqueda es normalizada y aproximada: "Malasaña", "malasana" y "Barrio de Malasaña" son la
+# misma zona, y una errata ("Malasañaa") se resuelve por parecido (difflib) si supera NOMENCLATOR_CORTE_DIFUSO.
+# Google queda para las zonas que no están aquí; lo que devuelve se aprende (aprender()) y la próxima vez ya no
+# hace falta. Las zonas aprendidas solo se reconocen por su nombre exacto (normalizado): una respuesta de Google no
+# es tan fiable como para que "se le parezcan" otras zonas.
+# El fichero (NOMENCLATOR_PATH) es un JSON:
+#   {"Madrid": {"alias": [...], "zonas": {"Malasaña": {"lat": .., "lng": .., "alias": [...], "poligono": [[lat, lng], ...]}}}}
+import os
+import re
+import json
+import difflib
+import logging
+from dataclasses import dataclass
+from typing import Optional, Dict, Tuple, Iterable
+from geo import calcular_bounding_box, punto_en_poligono, bounding_box_poligono
+from cache import normalizar_texto
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+NOMENCLATOR_ACTIVO = os.getenv('NOMENCLATOR_ACTIVO', '1') == '1'
+NOMENCLATOR_PATH = os.getenv(
+    'NOMENCLATOR_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', 'zonas.json')
+)
+# Parecido mínimo (0-1, SequenceMatcher) para aceptar una zona aproximada
+NOMENCLATOR_CORTE_DIFUSO = float(os.getenv('NOMENCLATOR_CORTE_DIFUSO', 0.85))
+
+# Palabras genéricas que se quitan del principio: "barrio de Salamanca", "el barrio del Carmen", "zona Sol"
+_PREFIJO = re.compile(r"^(?:el |la )?(?:barrio|barri|distrito|zona)(?: de| del| de la| de los| de las)? ")
+_PUNTUACION = re.compile(r"[^\w ]+")
+# Máximo de búsquedas recordadas (texto tal cual -> zona) antes de vaciar la memoria
+_MAX_MEMORIA = 4096
+
+def normalizar_zona(texto: Optional[str]) -> str:
+    return " ".join(_PUNTUACION.sub(" ", normalizar_texto(texto)).split())
+
+def _sin_prefijo(clave: str) -> str:
+    return _PREFIJO.sub("", clave, count=1)
+
+@dataclass(frozen=True)
+class Zona:
+    nombre: str
+    ciudad: str
+    lat: float
+    lng: float
+    poligono: Optional[Tuple[Tuple[float, float], ...]] = None
+    aprendida: bool = False
+
+    @property
+    def location(self) -> dict:
+        return {"lat": self.lat, "lng": self.lng}
+
+    # Con polígono, la caja que lo envuelve (el radio no aplica: el barrio es lo que es); sin él, la del radio
+    def bounding_box(self, radio_km: float) -> dict:
+        if self.poligono:
+            return bounding_box_poligono(self.poligono)
+        return calcular_bounding_box(self.lat, self.lng, radio_km)
+
+    def contiene(self, lat: float, lng: float) -> bool:
+        return self.poligono is None or punto_en_poligono(lat, lng, self.poligono)
+
+class Nomenclator:
+    def __init__(self, ruta: Optional[str] = NOMENCLATOR_PATH):
+        # ciudad normalizada -> nombre de zona normalizado (y sus alias) -> Zona
+        self._zonas: Dict[str, Dict[str, Zona]] = {}
+        self._aprendidas: Dict[str, Dict[str, Zona]] = {}
+        self._alias_ciudad: Dict[str, str] = {}
+        self._memoria: Dict[Tuple[str, str], Tuple[Optional[Zona], str]] = {}
+        self.exactas = 0
+        self.aproximadas = 0
+        self.por_aprendidas = 0
+        self.fallos = 0
+        if ruta and NOMENCLATOR_ACTIVO:
+            self.cargar(ruta)
+
+    def cargar(self, ruta: str):
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"No se pudo cargar el nomenclátor de zonas {ruta}: {e}")
+            return
+        for ciudad, datos_ciudad in datos.items():
+            clave_ciudad = normalizar_zona(ciudad)
+            for alias in [ciudad] + datos_ciudad.get("alias", []):
+                self._alias_ciudad[normalizar_zona(alias)] = clave_ciudad
+            zonas = self._zonas.setdefault(clave_ciudad, {})
+            for nombre, d in datos_ciudad.get("zonas", {}).items():
+                poligono = tuple((float(lat), float(lng)) for lat, lng in d["poligono"]) if d.get("poligono") else None
+                zona = Zona(nombre, ciudad, float(d["lat"]), float(d["lng"]), poligono)
+                for texto in [nombre] + d.get("alias", []):
+                    zonas.setdefault(normalizar_zona(texto), zona)
+        self._memoria.clear()
+        logging.info(f"Nomenclátor: {sum(len(z) for z in self._zonas.values())} nombres de zona en {len(self._zonas)} ciudades")
+
+    def _ciudad(self, ciudad: str) -> str:
+        clave = normalizar_zona(ciudad)
+        return self._alias_ciudad.get(clave, clave)
+
+    def _resolver(self, clave_zona: str, clave_ciudad: str) -> Tuple[Optional[Zona], str]:
+        zonas = self._zonas.get(clave_ciudad, {})
+        aprendidas = self._aprendidas.get(clave_ciudad, {})
+        for clave in dict.fromkeys((clave_zona, _sin_prefijo(clave_zona))):
+            if clave in zonas:
+                return zonas[clave], "exacta"
+            if clave in aprendidas:
+                return aprendidas[clave], "aprendida"
+        if zonas:
+            parecidas = difflib.get_close_matches(_sin_prefijo(clave_zona), zonas, n=1, cutoff=NOMENCLATOR_CORTE_DIFUSO)
+            if parecidas:
+                return zonas[parecidas[0]], "aproximada"
+        return None, "fallo"
+
+    # La zona conocida que corresponde al texto, o None si hay que preguntar a Google.
+    # contar=False para consultas internas que no deben entrar en las estadísticas
+    def buscar(self, zona: str, ciudad: str, contar: bool = True) -> Optional[Zona]:
+        if not NOMENCLATOR_ACTIVO:
+            return None
+        clave = (normalizar_zona(zona), self._ciudad(ciudad))
+        memorizado = self._memoria.get(clave)
+        if memorizado is None:
+            memorizado = self._resolver(*clave)
+            if len(self._memoria) >= _MAX_MEMORIA:
+                self._memoria.clear()
+            self._memoria[clave] = memorizado
+        resultado, tipo = memorizado
+        if not contar:
+            return resultado
+        if tipo == "exacta":
+            self.exactas += 1
+        elif tipo == "aproximada":
+            self.aproximadas += 1
+        elif tipo == "aprendida":
+            self.por_aprendidas += 1
+        else:
+            self.fallos += 1
+        return resultado
+
+    # Nombre canónico de cada zona de una lista "zona1, zona2" (las desconocidas se dejan como vienen), para que
+    # "malasana" y "Barrio de Malasaña" compartan la misma entrada de la caché de resultados
+    def canonizar(self, zonas: str, ciudad: str) -> str:
+        nombres = []
+        for zona in zonas.split(','):
+            conocida = self.buscar(zona.strip(), ciudad, contar=False) if zona.strip() else None
+            nombres.append(conocida.nombre if conocida is not None else zona.strip())
+        return ", ".join(nombres)
+
+    # Una zona que ha resuelto Google. Si ya la conocemos no se toca
+    def aprender(self, zona: str, ciudad: str, location: dict):
+        clave_zona, clave_ciudad = normalizar_zona(zona), self._ciudad(ciudad)
+        if not NOMENCLATOR_ACTIVO or not clave_zona or clave_zona in self._zonas.get(clave_ciudad, {}):
+            return
+        self._aprendidas.setdefault(clave_ciudad, {})[clave_zona] = Zona(
+            zona.strip(), ciudad.strip(), float(location["lat"]), float(location["lng"]), aprendida=True
+        )
+        # Lo que antes era un fallo (o una aproximación) puede resolverse ahora de otra forma
+        self._memoria.clear()
+
+    # Al arrancar: las zonas que ya resolvió Google en otras ejecuciones (caché de geocodificación en disco)
+    def cargar_aprendidas(self, entradas: Iterable[Tuple[str, str, float, float]]):
+        for zona, ciudad, lat, lng in entradas:
+            self.aprender(zona, ciudad, {"lat": lat, "lng": lng})
+
+    def estadisticas(self) -> dict:
+        total = self.exactas + self.aproximadas + self.por_aprendidas + self.fallos
+        return {
+            "activo": NOMENCLATOR_ACTIVO,
+            "ciudades": len(self._zonas),
+            "zonas": len({z for zonas in self._zonas.values() for z in zonas.values()}),
+            "aprendidas": sum(len(z) for z in self._aprendidas.values()),
+            "exactas": self.exactas,
+            "aproximadas": self.aproximadas,
+            "por_aprendidas": self.por_aprendidas,
+            "fallos": self.fallos,
+            "hit_ratio": round((total - self.fallos) / total, 4) if total else None,
+        }
+
+nomenclator = Nomenclator()
@@ -0,0 +1,293 @@
+# Paginación de /api/getRestaurantsPrueba más allá de los 80 restaurantes de la búsqueda normal. Cada página devuelve
+# un cursor opaco y sin estado en el servidor (next_cursor) con todo lo necesario para seguir: la búsqueda (ciudad,
+# zona o centro, filtros), el tamaño de página y la clave del último restaurante devuelto. La página siguiente
+# retoma el recorrido ordenado justo después de esa clave, sin volver a calcular las anteriores:
+#   - Por coordenadas el orden es (distancia, NBH2 desc, id). Se sigue desde la distancia del último restaurante
+#     hasta el radio en el que, con la densidad de lo ya visto, deberían caber los de la página (doblando lo que se
+#     avanza si no llegan) y contra Airtable solo se piden los anillos nuevos: lo que cae en los rectángulos
+#     inscritos en el círculo ya recorrido (geo.cajas_inscritas) no se vuelve a descargar.
+#   - Por zonas el orden es zona a zona (en el orden pedido) y dentro de cada una (NBH2 desc, id). Contra Airtable
+#     se pide la zona desde el NBH2 del último restaurante (formula_nbh2_hasta) y se sigue el 'offset' solo hasta
+#     completar la página. Un restaurante que ya salió en una zona anterior no se repite.
+# Con el catálogo local listo todo se resuelve en memoria (Catalogo.recorrer_radio / recorrer_bbox).
+# El cursor va firmado (HMAC) para que no se pueda manipular y caduca a las PAGINACION_CURSOR_TTL segundos.
+# Los offsets de Airtable no se guardan en el cursor: caducan a los pocos minutos y dependen de la fórmula exacta
+import os
+import json
+import math
+import time
+import hmac
+import asyncio
+import base64
+import hashlib
+import logging
+from typing import Optional, List, Tuple
+import numpy as np
+from fastapi import HTTPException
+from geo import calcular_bounding_box, cajas_inscritas, haversine_vectorizado
+from filtros import ConsultaRestaurantes, formula_fuera_de_bbox, formula_nbh2_hasta, formula_y
+from catalogo import catalogo, clave_nbh2, VISTA_RESTAURANTES, TABLA_RESTAURANTES, DECIMALES_DISTANCIA
+from planificador import AirtableError
+from metricas import metricas
+from bistrohunter import (
+    obtener_coordenadas_zona, paginar_airtable, punto_registro, clave_registro,
+    AIRTABLE_API_URL, BASE_ID, AIRTABLE_PAT, RADIO_MAXIMO_KM
+)
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+# Clave con la que se firman los cursores. Tiene que ser la misma en todos los workers e instancias: si no se
+# configura se deriva del token de Airtable, y sin él es aleatoria (los cursores solo valen en este proceso)
+PAGINACION_SECRETO = (
+    os.getenv('PAGINACION_SECRETO')
+    or (hashlib.sha256(b"paginacion:" + AIRTABLE_PAT.encode()).hexdigest() if AIRTABLE_PAT else os.urandom(32).hex())
+).encode()
+PAGINACION_CURSOR_TTL = int(os.getenv('PAGINACION_CURSOR_TTL', 3600))
+PAGINACION_TAMANO = int(os.getenv('PAGINACION_TAMANO', 80))  # tamaño de página si no se pide otro
+PAGINACION_MAX_TAMANO = int(os.getenv('PAGINACION_MAX_TAMANO', 100))
+# Tope de registros que se descargan de Airtable para una página (por anillo o por zona)
+PAGINACION_MAX_REGISTROS_AIRTABLE = int(os.getenv('PAGINACION_MAX_REGISTROS_AIRTABLE', 1000))
+
+# Radio (km) con el que empieza la búsqueda normal, que es también el de la caja de las zonas sin polígono
+RADIO_INICIAL_KM = 1.0
+VERSION_CURSOR = 1
+
+def _b64(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+def _firma(cuerpo: str) -> str:
+    return _b64(hmac.new(PAGINACION_SECRETO, cuerpo.encode(), hashlib.sha256).digest()[:16])
+
+# Cursor: base64url(JSON compacto) + "." + firma. Lleva la búsqueda, el tamaño de página, los restaurantes ya
+# devueltos, la zona y la clave del último. Las claves NBH2 vacías (inf) van como null
+def codificar_cursor(busqueda: dict, limite: int, vistos: int, zona: int, clave: tuple) -> str:
+    datos = {
+        "v": VERSION_CURSOR,
+        "t": int(time.time()),
+        "b": busqueda,
+        "k": limite,
+        "n": vistos,
+        "z": zona,
+        "c": [None if isinstance(v, float) and math.isinf(v) else v for v in clave],
+    }
+    cuerpo = _b64(json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode())
+    return f"{cuerpo}.{_firma(cuerpo)}"
+
+def decodificar_cursor(cursor: str) -> dict:
+    try:
+        cuerpo, firma = cursor.split(".")
+        if not hmac.compare_digest(firma, _firma(cuerpo)):
+            raise ValueError("firma")
+        datos = json.loads(_desde_b64(cuerpo))
+        if datos["v"] != VERSION_CURSOR:
+            raise ValueError("versión")
+        caducado = time.time() - datos["t"] > PAGINACION_CURSOR_TTL
+        datos["c"] = tuple(float("inf") if v is None else v for v in datos["c"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+    if caducado:
+        raise HTTPException(status_code=400, detail="Cursor caducado, vuelve a empezar la búsqueda")
+    return datos
+
+# Recoge los restaurantes de una página a partir de (clave parcial, registro) que llegan en orden de clave parcial.
+# La clave completa añade el id del registro para desempatar. Se salta todo lo que va hasta 'despues' (la clave del
+# último restaurante de la página anterior) y, cuando ya tiene 'cuantos', sigue leyendo solo mientras haya empates
+# en el primer término de la clave (entre ellos decide el resto al ordenar)
+class RecogidaPagina:
+    def __init__(self, cuantos: int, despues: Optional[tuple] = None):
+        self.cuantos = cuantos
+        self.despues = despues
+        self.elementos: List[Tuple[tuple, dict]] = []
+        self._corte = None
+
+    # False cuando ya no hace falta leer más
+    def anadir(self, clave: tuple, registro: dict) -> bool:
+        if self._corte is not None and clave[0] > self._corte:
+            return False
+        completa = (*clave, str(clave_registro(registro)))
+        if self.despues is not None and completa <= self.despues:
+            return True
+        self.elementos.append((completa, registro))
+        if self._corte is None and len(self.elementos) >= self.cuantos:
+            self._corte = clave[0]
+        return True
+
+    @property
+    def llena(self) -> bool:
+        return len(self.elementos) >= self.cuantos
+
+    def resultado(self) -> List[Tuple[tuple, dict]]:
+        return sorted(self.elementos, key=lambda e: e[0])[:self.cuantos]
+
+# Registros de la vista que cumplen la fórmula, en orden NBH2 desc, página a página de Airtable
+def _paginas_airtable(formula: str, campos: Optional[List[str]]):
+    params = {"filterByFormula": formula, "sort[0][field]": "NBH2", "sort[0][direction]": "desc"}
+    if campos:
+        params["fields[]"] = list(campos)
+    return paginar_airtable(
+        f"{AIRTABLE_API_URL}/{BASE_ID}/{TABLA_RESTAURANTES}", {"Authorization": f"Bearer {AIRTABLE_PAT}"}, params,
+        view_id=VISTA_RESTAURANTES, max_registros=PAGINACION_MAX_REGISTROS_AIRTABLE
+    )
+
+# Por coordenadas: los 'cuantos' siguientes a 'despues' (distancia, clave NBH2, id). 'vistos' son los restaurantes
+# devueltos en las páginas anteriores, todos a menos de esa distancia: con ellos se estima hasta dónde hay que llegar.
+# Devuelve ([(clave, registro)], fórmula de la última caja consultada)
+async def _pagina_por_coordenadas(lat: float, lng: float, consulta: ConsultaRestaurantes, cuantos: int,
+                                  despues: Optional[tuple], vistos: int,
+                                  campos: Optional[List[str]]) -> Tuple[list, str]:
+    distancia_desde, nbh2_desde = despues[:2] if despues else (0.0, -np.inf)
+    if distancia_desde > 0 and vistos:
+        # Con la misma densidad que hasta ahora, los que faltan caben en este radio (con un 50% de margen)
+        radio = max(distancia_desde * math.sqrt(1 + 1.5 * cuantos / vistos), distancia_desde * 1.05)
+    else:
+        radio = RADIO_INICIAL_KM
+    radio = min(radio, RADIO_MAXIMO_KM)
+    # Contra Airtable no se vuelve a pedir lo ya recorrido: primero lo que cae en los rectángulos inscritos en el
+    # círculo de las páginas anteriores y después la caja de la vuelta anterior, que ya está descargada entera
+    leido = distancia_desde
+    huecos = cajas_inscritas(lat, lng, distancia_desde * 0.99) if distancia_desde > 0 else []
+    candidatos = []
+    while True:
+        bbox = calcular_bounding_box(lat, lng, radio)
+        formula = consulta.con_bbox(bbox).a_formula()
+        if catalogo.listo:
+            with metricas.medir("catalogo"):
+                candidatos = list(
+                    catalogo.recorrer_radio(lat, lng, radio, consulta, desde=(distancia_desde, nbh2_desde))
+                )
+        else:
+            registros = []
+            paginas = _paginas_airtable(formula_y(formula, *(formula_fuera_de_bbox(h) for h in huecos)), campos)
+            async for pagina in paginas:
+                registros.extend(r for r in pagina if punto_registro(r) is not None)
+            if len(registros) >= PAGINACION_MAX_REGISTROS_AIRTABLE:
+                if radio - leido > 0.01:
+                    # Demasiados para una vuelta (quedarían fuera algunos): se estrecha el anillo a la mitad
+                    radio = leido + (radio - leido) / 2
+                    continue
+                logging.warning(f"Paginación: más de {PAGINACION_MAX_REGISTROS_AIRTABLE} restaurantes a {radio:g} km")
+            puntos = np.array([punto_registro(r) for r in registros], dtype=float).reshape(-1, 2)
+            distancias = np.round(haversine_vectorizado(lng, lat, puntos[:, 1], puntos[:, 0]), DECIMALES_DISTANCIA)
+            for distancia, registro in zip(distancias.tolist(), registros):
+                clave = (distancia, clave_nbh2(registro))
+                if clave >= (distancia_desde, nbh2_desde):
+                    candidatos.append((clave, registro))
+            candidatos.sort(key=lambda c: (c[0], str(clave_registro(c[1]))))
+            leido, huecos = radio, [bbox]
+
+        # Solo es definitivo lo que cae dentro del círculo del radio consultado (con el margen de la búsqueda normal)
+        seguro = radio * 0.99 if radio < RADIO_MAXIMO_KM else math.inf
+        recogida = RecogidaPagina(cuantos, despues)
+        for clave, registro in candidatos:
+            if clave[0] > seguro or not recogida.anadir(clave, registro):
+                break
+        if recogida.llena or radio >= RADIO_MAXIMO_KM:
+            return recogida.resultado(), formula
+        # Como la búsqueda normal, se dobla (lo que se avanza desde donde se quedó la página anterior)
+        radio = min(distancia_desde + (radio - distancia_desde) * 2, RADIO_MAXIMO_KM)
+
+def _en_zona(ubicacion: dict, punto: Tuple[float, float]) -> bool:
+    bbox, zona = ubicacion['bounding_box'], ubicacion.get('zona')
+    lat, lng = punto
+    return (bbox['lat_min'] <= lat <= bbox['lat_max'] and bbox['lon_min'] <= lng <= bbox['lon_max']
+            and (zona is None or zona.contiene(lat, lng)))
+
+# Por zonas, dentro de la zona 'indice': los 'cuantos' siguientes a 'despues' (clave NBH2, id) que no estén en las
+# zonas anteriores. Devuelve ([(clave, registro)], fórmula de la zona)
+async def _pagina_de_zona(ubicaciones: list, indice: int, consulta: ConsultaRestaurantes, cuantos: int,
+                          despues: Optional[tuple], campos: Optional[List[str]]) -> Tuple[list, str]:
+    ubicacion = ubicaciones[indice]
+    anteriores = [u for u in ubicaciones[:indice] if u is not None]
+    formula = consulta.con_bbox(ubicacion['bounding_box']).a_formula()
+    recogida = RecogidaPagina(cuantos, despues)
+
+    def admitir(registro) -> bool:
+        punto = punto_registro(registro)
+        if punto is None or not _en_zona(ubicacion, punto) or any(_en_zona(u, punto) for u in anteriores):
+            return True
+        return recogida.anadir((clave_nbh2(registro),), registro)
+
+    if catalogo.listo:
+        with metricas.medir("catalogo"):
+            desde = despues[0] if despues else -np.inf
+            for _, registro in catalogo.recorrer_bbox(ubicacion['bounding_box'], consulta, desde=desde):
+                if not admitir(registro):
+                    break
+    else:
+        hasta = None if despues is None else formula_nbh2_hasta(None if math.isinf(despues[0]) else -despues[0])
+        paginas = _paginas_airtable(formula_y(formula, hasta), campos)
+        try:
+            async for pagina in paginas:
+                if not all(admitir(registro) for registro in pagina):
+                    break
+        finally:
+            await paginas.aclose()
+    return recogida.resultado(), formula
+
+# Una página de la búsqueda. Sin cursor es la primera (con los parámetros que llegan); con cursor, la búsqueda y
+# el tamaño de página salen de él ('limite' puede cambiar el tamaño a mitad).
+# Devuelve (restaurantes, fórmula, lat y lng del centro, cursor de la siguiente o None, tamaño de página)
+async def buscar_pagina(city: Optional[str] = None, price_range: Optional[str] = None, cocina: Optional[str] = None,
+                        diet: Optional[str] = None, dish: Optional[str] = None, zona: Optional[str] = None,
+                        coordenadas: Optional[str] = None, limite: Optional[int] = None,
+                        cursor: Optional[str] = None, campos: Optional[List[str]] = None) -> tuple:
+    if cursor:
+        datos = decodificar_cursor(cursor)
+        busqueda, vistos, indice_zona, despues = datos["b"], datos["n"], datos["z"], datos["c"]
+        limite = datos["k"] if limite is None else limite
+    else:
+        busqueda = dict(city=city, zona=zona, coordenadas=coordenadas, price_range=price_range, cocina=cocina,
+                        diet=diet, dish=dish)
+        vistos, indice_zona, despues = 0, 0, None
+        limite = PAGINACION_TAMANO if limite is None else limite
+    if not 1 <= limite <= PAGINACION_MAX_TAMANO:
+        raise HTTPException(status_code=400, detail=f"El tamaño de página tiene que estar entre 1 y {PAGINACION_MAX_TAMANO}")
+
+    consulta = ConsultaRestaurantes.desde_parametros(
+        price_range=busqueda["price_range"], cocina=busqueda["cocina"], diet=busqueda["diet"], dish=busqueda["dish"]
+    )
+    try:
+        # Se pide uno más de la cuenta para saber si hay página siguiente
+        if busqueda["zona"]:
+            zonas = [z.strip() for z in busqueda["zona"].split(',') if z.strip()]
+            ubicaciones = await asyncio.gather(
+                *(obtener_coordenadas_zona(z, busqueda["city"], RADIO_INICIAL_KM) for z in zonas)
+            )
+            pagina, formula, centro = [], None, (None, None)
+            for indice in range(indice_zona, len(zonas)):
+                if ubicaciones[indice] is None:
+                    logging.error(f"Zona '{zonas[indice]}' no encontrada.")
+                    continue
+                elementos, formula = await _pagina_de_zona(
+                    ubicaciones, indice, consulta, limite + 1 - len(pagina),
+                    despues if indice == indice_zona else None, campos
+                )
+                centro = (ubicaciones[indice]['location']['lat'], ubicaciones[indice]['location']['lng'])
+                pagina.extend((indice, clave, registro) for clave, registro in elementos)
+                if len(pagina) > limite:
+                    break
+        else:
+            if not busqueda["coordenadas"]:
+                raise HTTPException(status_code=400, detail="Debes especificar 'zona' o 'coordenadas'.")
+            try:
+                lat, lng = [float(c) for c in busqueda["coordenadas"].split(",")]
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Coordenadas inválidas. Deben ser [lat, lng] en texto.")
+            elementos, formula = await _pagina_por_coordenadas(
+                lat, lng, consulta, limite + 1, despues, vistos, campos
+            )
+            pagina, centro = [(0, clave, registro) for clave, registro in elementos], (lat, lng)
+    except AirtableError as e:
+        logging.error(f"Airtable no disponible al paginar restaurantes: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Airtable no está disponible ahora mismo, inténtalo de nuevo en unos segundos"
+        )
+
+    siguiente = None
+    if len(pagina) > limite:
+        indice, clave, _ = pagina[limite - 1]
+        siguiente = codificar_cursor(busqueda, limite, vistos + limite, indice, clave)
+    return [registro for _, _, registro in pagina[:limite]], formula, centro[0], centro[1], siguiente, limite
@@ -0,0 +1,162 @@
+# Planificador de peticiones a Airtable: respeta el límite de 5 req/s por base (token bucket), da prioridad a las
+# búsquedas de usuarios frente al trabajo de fondo (refresco del catálogo) y reintenta 429/5xx con backoff
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from typing import Optional, Callable, Awaitable
+import httpx
+
+# Configuración (se puede ajustar desde las variables de entorno de Render)
+AIRTABLE_REQ_POR_SEGUNDO = float(os.getenv('AIRTABLE_REQ_POR_SEGUNDO', 5))
+AIRTABLE_RAFAGA = int(os.getenv('AIRTABLE_RAFAGA', 5))
+AIRTABLE_REINTENTOS = int(os.getenv('AIRTABLE_REINTENTOS', 4))
+AIRTABLE_BACKOFF_BASE = float(os.getenv('AIRTABLE_BACKOFF_BASE', 0.25))
+AIRTABLE_BACKOFF_MAX = float(os.getenv('AIRTABLE_BACKOFF_MAX', 4))
+# Airtable pide esperar 30 s tras un 429 si no manda Retry-After
+AIRTABLE_PAUSA_429 = float(os.getenv('AIRTABLE_PAUSA_429', 30))
+# Tiempo total máximo (esperas + reintentos) de una petición según su prioridad
+AIRTABLE_DEADLINE_INTERACTIVA = float(os.getenv('AIRTABLE_DEADLINE_INTERACTIVA', 8))
+AIRTABLE_DEADLINE_FONDO = float(os.getenv('AIRTABLE_DEADLINE_FONDO', 120))
+
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_FONDO = 1
+
+# Airtable no ha podido responder (429, 5xx o error de red) después de los reintentos. No es lo mismo que "0 resultados"
+class AirtableError(Exception):
+    def __init__(self, mensaje: str, status_code: Optional[int] = None):
+        super().__init__(mensaje)
+        self.status_code = status_code
+
+# Token bucket con cola de prioridad: cuando no hay tokens, el siguiente que sale es el de menor prioridad
+# (interactiva antes que fondo) y, a igual prioridad, el que llegó antes
+class TokenBucket:
+    def __init__(self, tasa: float = AIRTABLE_REQ_POR_SEGUNDO, capacidad: int = AIRTABLE_RAFAGA):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = float(capacidad)
+        self.actualizado = time.monotonic()
+        self.pausado_hasta = 0.0
+        self._cola = []
+        self._secuencia = itertools.count()
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self.esperas_agotadas = 0
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+
+    # Tras un 429 dejamos de mandar peticiones a Airtable durante un rato
+    def pausar(self, segundos: float):
+        self.pausado_hasta = max(self.pausado_hasta, time.monotonic() + segundos)
+        self.tokens = 0.0
+
+    def _despachar(self):
+        self._temporizador = None
+        self._rellenar()
+        ahora = time.monotonic()
+        while self._cola and ahora >= self.pausado_hasta and self.tokens >= 1:
+            _, _, futuro = heapq.heappop(self._cola)
+            if futuro.done():
+                continue
+            self.tokens -= 1
+            futuro.set_result(None)
+        # Quitamos de la cabeza los que ya se cansaron de esperar
+        while self._cola and self._cola[0][2].done():
+            heapq.heappop(self._cola)
+        if self._cola:
+            espera = max(self.pausado_hasta - ahora, (1 - self.tokens) / self.tasa, 0.001)
+            self._temporizador = asyncio.get_running_loop().call_later(espera, self._despachar)
+
+    async def adquirir(self, prioridad: int, limite: float):
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._cola, (prioridad, next(self._secuencia), futuro))
+        if self._temporizador is None:
+            self._despachar()
+        try:
+            await asyncio.wait_for(futuro, timeout=max(limite - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.esperas_agotadas += 1
+            raise AirtableError("Airtable saturado: no hay hueco antes del límite de tiempo", 429)
+
+    def estadisticas(self) -> dict:
+        self._rellenar()
+        return {
+            "req_por_segundo": self.tasa,
+            "tokens": round(self.tokens, 2),
+            "en_cola": sum(1 for _, _, f in self._cola if not f.done()),
+            "pausado_segundos": round(max(self.pausado_hasta - time.monotonic(), 0), 1),
+            "esperas_agotadas": self.esperas_agotadas,
+        }
+
+class PlanificadorAirtable:
+    def __init__(self):
+        self.bucket = TokenBucket()
+        self.peticiones = 0
+        self.reintentos = 0
+        self.errores_429 = 0
+        self.errores_5xx = 0
+        self.errores_red = 0
+
+    # Hace la petición respetando el bucket y reintentando 429/5xx/errores de red con backoff exponencial con jitter,
+    # sin pasarse del deadline. Devuelve la respuesta 200 o lanza AirtableError
+    async def ejecutar(self, enviar: Callable[[], Awaitable[httpx.Response]], prioridad: int = PRIORIDAD_INTERACTIVA,
+                       deadline: Optional[float] = None) -> httpx.Response:
+        if deadline is None:
+            deadline = AIRTABLE_DEADLINE_INTERACTIVA if prioridad == PRIORIDAD_INTERACTIVA else AIRTABLE_DEADLINE_FONDO
+        limite = time.monotonic() + deadline
+        intento = 0
+        while True:
+            await self.bucket.adquirir(prioridad, limite)
+            self.peticiones += 1
+            status_code = None
+            try:
+                response = await enviar()
+                status_code = response.status_code
+            except httpx.TransportError as e:
+                self.errores_red += 1
+                motivo = f"error de red: {e!r}"
+            else:
+                if status_code == 200:
+                    return response
+                if status_code == 429:
+                    self.errores_429 += 1
+                    self.bucket.pausar(self._retry_after(response))
+                    motivo = "429 Too Many Requests"
+                elif status_code >= 500:
+                    self.errores_5xx += 1
+                    motivo = f"{status_code} del servidor"
+                else:
+                    # 4xx (fórmula mal formada, permisos...): reintentar no va a arreglarlo
+                    raise AirtableError(f"Airtable respondió {status_code}: {response.text[:200]}", status_code)
+
+            intento += 1
+            espera = min(AIRTABLE_BACKOFF_MAX, AIRTABLE_BACKOFF_BASE * 2 ** intento) * random.uniform(0.5, 1.0)
+            if intento > AIRTABLE_REINTENTOS or time.monotonic() + espera >= limite:
+                raise AirtableError(f"Airtable no disponible tras {intento} intentos ({motivo})", status_code)
+            logging.warning(f"Airtable: {motivo}, reintento {intento} en {espera:.2f}s")
+            self.reintentos += 1
+            await asyncio.sleep(espera)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> float:
+        try:
+            return float(response.headers.get('Retry-After', AIRTABLE_PAUSA_429))
+        except ValueError:
+            return AIRTABLE_PAUSA_429
+
+    def estadisticas(self) -> dict:
+        return {
+            "peticiones": self.peticiones,
+            "reintentos": self.reintentos,
+            "errores_429": self.errores_429,
+            "errores_5xx": self.errores_5xx,
+            "errores_red": self.errores_red,
+            "bucket": self.bucket.estadisticas(),
+        }
+
+planificador_airtable = PlanificadorAirtable()
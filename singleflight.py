@@ -0,0 +1,44 @@
+# Coalescencia de peticiones (single-flight): si llegan varias llamadas idénticas a la vez, solo una va
+# hacia fuera (Google / Airtable) y el resto espera y comparte su resultado
+import asyncio
+from typing import Callable, Awaitable, Any, Dict, Hashable
+
+class SingleFlight:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._en_curso: Dict[Hashable, asyncio.Task] = {}
+        self.llamadas = 0  # llamadas que han salido de verdad
+        self.colapsadas = 0  # llamadas que se han ahorrado esperando a otra idéntica
+
+    async def ejecutar(self, clave: Hashable, funcion: Callable[[], Awaitable[Any]]) -> Any:
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            self.llamadas += 1
+            # La llamada va en su propia tarea: si el primero que la pidió se cancela (el cliente corta),
+            # los demás siguen esperando el resultado
+            tarea = asyncio.create_task(funcion())
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(clave, t))
+        else:
+            self.colapsadas += 1
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, clave: Hashable, tarea: asyncio.Task):
+        if self._en_curso.get(clave) is tarea:
+            del self._en_curso[clave]
+        # Marcamos la excepción como leída por si ya no queda nadie esperando
+        if not tarea.cancelled():
+            tarea.exception()
+
+    def estadisticas(self) -> dict:
+        total = self.llamadas + self.colapsadas
+        return {
+            "llamadas": self.llamadas,
+            "colapsadas": self.colapsadas,
+            "ratio_colapsadas": round(self.colapsadas / total, 4) if total else None,
+            "en_curso": len(self._en_curso),
+        }
+
+vuelo_geocodificacion = SingleFlight("geocodificacion")
+vuelo_airtable = SingleFlight("airtable")
+vuelo_busquedas = SingleFlight("busquedas")
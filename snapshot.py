@@ -0,0 +1,444 @@
+# Foto en disco del catálogo en formato columnar compacto, pensada para abrirse con mmap: todos los workers de
+# uvicorn comparten las mismas páginas y arrancar es casi instantáneo (no hay JSON que parsear por registro).
+#
+# Formato (little endian):
+#   MAGIA (8 bytes) | longitud de la cabecera (uint64) | cabecera JSON | relleno hasta múltiplo de 8 | datos
+# La cabecera describe cada columna y dónde empiezan sus secciones dentro de la zona de datos (alineadas a 8):
+#   - NUMERO: valores float64 + estado uint8 (lat, lng, NBH2)
+#   - DICCIONARIO: códigos int32 sobre un diccionario de valores que va en la cabecera (price_range, categorías)
+#   - TEXTO: offsets uint64 (n + 1) + blob UTF-8 + estado uint8 (id, título, mensaje, url, reseñas...)
+# Los valores raros (un texto donde se esperaba un número, null...) van tal cual en "excepciones" de la cabecera,
+# y los fields que no están en el esquema en una columna JSON por fila, así que la foto devuelve exactamente lo
+# que vino de Airtable
+import os
+import json
+import mmap
+import time
+import operator
+import threading
+from collections.abc import Mapping
+from typing import Optional, List, Dict, Iterator, Sequence
+import numpy as np
+from geo import leer_coordenada
+from filtros import CAMPO_FILTRO, CAMPOS_PLEGADOS, texto_campo, plegar_texto
+
+MAGIA = b"BHSNAP01"
+VERSION = 1
+
+NUMERO = "numero"
+DICCIONARIO = "diccionario"
+TEXTO = "texto"
+
+# Estado de cada celda en las columnas NUMERO y TEXTO
+AUSENTE_ESTADO = 0
+VALOR_FLOAT = 1
+VALOR_ENTERO = 2
+VALOR_TEXTO = 1
+VALOR_EXCEPCION = 3
+
+# Columnas del snapshot: (nombre, codificación). Las que empiezan por '@' son del registro, no de sus fields
+ESQUEMA = (
+    ("@id", TEXTO),
+    ("@createdTime", TEXTO),
+    ("cid", TEXTO),
+    ("title", TEXTO),
+    ("bh_message", TEXTO),
+    ("url", TEXTO),
+    ("google_reviews", TEXTO),
+    ("location/lat", NUMERO),
+    ("location/lng", NUMERO),
+    ("NBH2", NUMERO),
+    ("price_range", DICCIONARIO),
+    ("categories_string", DICCIONARIO),
+)
+CAMPOS_ESQUEMA = tuple(nombre for nombre, _ in ESQUEMA if not nombre.startswith("@"))
+# Fields fuera del esquema (JSON por fila; vacío si no hay)
+COLUMNA_OTROS = "@otros"
+
+# Campos de cada restaurante en la respuesta de /api/getRestaurantsPrueba: (clave, campo de Airtable, valor si falta)
+FORMATO_RESPUESTA = (
+    ("cid", "cid", None),
+    ("title", "title", "Sin título"),
+    ("description", "bh_message", "Sin descripción"),
+    ("price_range", "price_range", "No especificado"),
+    ("score", "NBH2", "N/A"),
+    ("url", "url", "No especificado"),
+    ("lat_restaurante", "location/lat", None),
+    ("lon_restaurante", "location/lng", None),
+    ("categories_string", "categories_string", None),
+)
+# Campos de Airtable que lee formatear_restaurante
+CAMPOS_FORMATO = tuple(campo for _, campo, _ in FORMATO_RESPUESTA)
+
+# Marca de "el registro no tiene este campo" (distinto de un campo que vale None)
+class _Ausente:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "AUSENTE"
+
+AUSENTE = _Ausente()
+
+def _alinear(n: int) -> int:
+    return (n + 7) & ~7
+
+def _leer(registro: dict, nombre: str):
+    if nombre.startswith("@"):
+        return registro.get(nombre[1:], AUSENTE)
+    return registro.get('fields', {}).get(nombre, AUSENTE)
+
+def _codificar_numero(valores: list) -> tuple:
+    numeros = np.full(len(valores), np.nan, dtype='<f8')
+    estado = np.zeros(len(valores), dtype=np.uint8)
+    excepciones = {}
+    for posicion, valor in enumerate(valores):
+        if valor is AUSENTE:
+            continue
+        if isinstance(valor, float):
+            numeros[posicion] = valor
+            estado[posicion] = VALOR_FLOAT
+        elif isinstance(valor, int) and not isinstance(valor, bool) and abs(valor) < 2 ** 53:
+            numeros[posicion] = valor
+            estado[posicion] = VALOR_ENTERO
+        else:
+            estado[posicion] = VALOR_EXCEPCION
+            excepciones[str(posicion)] = valor
+    return {"valores": numeros, "estado": estado}, {"excepciones": excepciones}
+
+def _codificar_texto(valores: list) -> tuple:
+    offsets = np.zeros(len(valores) + 1, dtype='<u8')
+    estado = np.zeros(len(valores), dtype=np.uint8)
+    excepciones = {}
+    partes = []
+    total = 0
+    for posicion, valor in enumerate(valores):
+        if isinstance(valor, str):
+            datos = valor.encode('utf-8', 'surrogatepass')
+            partes.append(datos)
+            total += len(datos)
+            estado[posicion] = VALOR_TEXTO
+        elif valor is not AUSENTE:
+            estado[posicion] = VALOR_EXCEPCION
+            excepciones[str(posicion)] = valor
+        offsets[posicion + 1] = total
+    blob = np.frombuffer(b"".join(partes), dtype=np.uint8)
+    return {"offsets": offsets, "blob": blob, "estado": estado}, {"excepciones": excepciones}
+
+def _codificar_diccionario(valores: list) -> tuple:
+    codigos = np.full(len(valores), -1, dtype='<i4')
+    diccionario = []
+    codigo_por_valor: Dict[str, int] = {}
+    for posicion, valor in enumerate(valores):
+        if valor is AUSENTE:
+            continue
+        clave = json.dumps(valor, sort_keys=True, ensure_ascii=False)
+        codigo = codigo_por_valor.get(clave)
+        if codigo is None:
+            codigo = codigo_por_valor[clave] = len(diccionario)
+            diccionario.append(valor)
+        codigos[posicion] = codigo
+    return {"codigos": codigos}, {"diccionario": diccionario}
+
+_CODIFICADORES = {NUMERO: _codificar_numero, TEXTO: _codificar_texto, DICCIONARIO: _codificar_diccionario}
+
+# Escribe la foto de los registros en 'ruta' (primero a un temporal y luego os.replace, así quien tenga abierta la
+# anterior con mmap la sigue leyendo entera). 'metadatos' va tal cual en la cabecera. Devuelve el tamaño en bytes
+def escribir_snapshot(registros: List[dict], ruta: str, creado_en: Optional[float] = None,
+                      metadatos: Optional[dict] = None) -> int:
+    otros = []
+    for registro in registros:
+        extra = {k: v for k, v in registro.get('fields', {}).items() if k not in CAMPOS_ESQUEMA}
+        otros.append(json.dumps(extra, ensure_ascii=False) if extra else AUSENTE)
+
+    cabecera = {
+        "version": VERSION,
+        "filas": len(registros),
+        "creado_en": time.time() if creado_en is None else creado_en,
+        "metadatos": metadatos or {},
+        "columnas": {},
+    }
+    secciones = []
+    desplazamiento = 0
+    for nombre, codificacion in ESQUEMA + ((COLUMNA_OTROS, TEXTO),):
+        if nombre == COLUMNA_OTROS:
+            valores = otros
+        else:
+            valores = [_leer(registro, nombre) for registro in registros]
+        arrays, extra = _CODIFICADORES[codificacion](valores)
+        descripcion = {"codificacion": codificacion, "secciones": {}, **extra}
+        for seccion, array in arrays.items():
+            descripcion["secciones"][seccion] = [desplazamiento, array.dtype.str, len(array)]
+            secciones.append((desplazamiento, array))
+            desplazamiento = _alinear(desplazamiento + array.nbytes)
+        cabecera["columnas"][nombre] = descripcion
+
+    cabecera_json = json.dumps(cabecera, ensure_ascii=False).encode('utf-8')
+    inicio_datos = _alinear(len(MAGIA) + 8 + len(cabecera_json))
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporal, "wb") as f:
+            f.write(MAGIA)
+            f.write(len(cabecera_json).to_bytes(8, "little"))
+            f.write(cabecera_json)
+            for desplazamiento_seccion, array in secciones:
+                f.write(b"\0" * (inicio_datos + desplazamiento_seccion - f.tell()))
+                f.write(array.tobytes())
+            f.write(b"\0" * (inicio_datos + desplazamiento - f.tell()))
+            tamano = f.tell()
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return tamano
+
+class _ColumnaNumero:
+    __slots__ = ("valores", "estado", "excepciones")
+
+    def __init__(self, secciones: dict, descripcion: dict):
+        self.valores = secciones["valores"]
+        self.estado = secciones["estado"]
+        self.excepciones = {int(p): v for p, v in descripcion["excepciones"].items()}
+
+    def valor(self, posicion: int):
+        estado = self.estado[posicion]
+        if estado == VALOR_FLOAT:
+            return float(self.valores[posicion])
+        if estado == VALOR_ENTERO:
+            return int(self.valores[posicion])
+        if estado == VALOR_EXCEPCION:
+            return self.excepciones[posicion]
+        return AUSENTE
+
+    # float64 con NaN donde falta o no es un número (mismo criterio que leer_coordenada)
+    def numeros(self) -> np.ndarray:
+        if not self.excepciones:
+            return self.valores
+        numeros = np.array(self.valores)
+        for posicion, valor in self.excepciones.items():
+            convertido = leer_coordenada({"v": valor}, "v")
+            numeros[posicion] = np.nan if convertido is None else convertido
+        return numeros
+
+class _ColumnaTexto:
+    __slots__ = ("offsets", "blob", "estado", "excepciones")
+
+    def __init__(self, secciones: dict, descripcion: dict):
+        self.offsets = secciones["offsets"]
+        self.blob = secciones["blob"]
+        self.estado = secciones["estado"]
+        self.excepciones = {int(p): v for p, v in descripcion["excepciones"].items()}
+
+    def valor(self, posicion: int):
+        estado = self.estado[posicion]
+        if estado == VALOR_TEXTO:
+            return self.blob[int(self.offsets[posicion]):int(self.offsets[posicion + 1])].tobytes().decode(
+                'utf-8', 'surrogatepass')
+        if estado == VALOR_EXCEPCION:
+            return self.excepciones[posicion]
+        return AUSENTE
+
+    def texto(self, posicion: int) -> str:
+        valor = self.valor(posicion)
+        return texto_campo({"v": valor}, "v") if valor is not AUSENTE else ""
+
+class _ColumnaDiccionario:
+    __slots__ = ("codigos", "diccionario", "textos")
+
+    def __init__(self, secciones: dict, descripcion: dict):
+        self.codigos = secciones["codigos"]
+        self.diccionario = descripcion["diccionario"]
+        # Texto de cada entrada tal y como lo ve el filtro; el último ("") es el de las filas sin valor (código -1)
+        self.textos = np.empty(len(self.diccionario) + 1, dtype=object)
+        self.textos[:] = [texto_campo({"v": v}, "v") for v in self.diccionario] + [""]
+
+    def valor(self, posicion: int):
+        codigo = self.codigos[posicion]
+        if codigo < 0:
+            return AUSENTE
+        valor = self.diccionario[codigo]
+        # Copia de las listas para que nadie modifique el diccionario compartido
+        return list(valor) if isinstance(valor, list) else valor
+
+_COLUMNAS = {NUMERO: _ColumnaNumero, TEXTO: _ColumnaTexto, DICCIONARIO: _ColumnaDiccionario}
+
+# Columna de texto para evaluar_columnas: se indexa con un array de posiciones, como las de construir_columnas,
+# pero solo decodifica las filas que se piden. Con plegar, los textos salen plegados como en filtros.texto_filtro
+# (los del diccionario se pliegan una vez al abrir)
+class ColumnaFiltro:
+    __slots__ = ("_columna", "_plegar", "_textos")
+
+    def __init__(self, columna, plegar: bool = False):
+        self._columna = columna
+        self._plegar = plegar
+        self._textos = None
+        if isinstance(columna, _ColumnaDiccionario):
+            self._textos = columna.textos
+            if plegar:
+                self._textos = np.empty(len(columna.textos), dtype=object)
+                self._textos[:] = [plegar_texto(t) for t in columna.textos]
+
+    def __len__(self):
+        return len(self._columna.estado if isinstance(self._columna, _ColumnaTexto) else self._columna.codigos)
+
+    def __getitem__(self, posiciones) -> np.ndarray:
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        if self._textos is not None:
+            return self._textos[self._columna.codigos[posiciones]]
+        textos = np.empty(len(posiciones), dtype=object)
+        if self._plegar:
+            textos[:] = [plegar_texto(self._columna.texto(int(p))) for p in posiciones]
+        else:
+            textos[:] = [self._columna.texto(int(p)) for p in posiciones]
+        return textos
+
+# Foto abierta con mmap. Se comporta como una lista de registros de Airtable de solo lectura: cada elemento es una
+# FilaSnapshot que se lee bajo demanda
+class Snapshot:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        with open(ruta, "rb") as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapa[:len(MAGIA)] != MAGIA:
+            raise ValueError(f"{ruta} no es un snapshot del catálogo")
+        longitud = int.from_bytes(self._mapa[len(MAGIA):len(MAGIA) + 8], "little")
+        cabecera = json.loads(self._mapa[len(MAGIA) + 8:len(MAGIA) + 8 + longitud].decode('utf-8'))
+        if cabecera.get("version") != VERSION:
+            raise ValueError(f"Versión de snapshot no soportada: {cabecera.get('version')}")
+        inicio_datos = _alinear(len(MAGIA) + 8 + longitud)
+        self.filas = cabecera["filas"]
+        self.creado_en = cabecera["creado_en"]
+        self.metadatos = cabecera.get("metadatos", {})
+        self.tamano = len(self._mapa)
+        self._columnas = {}
+        for nombre, descripcion in cabecera["columnas"].items():
+            secciones = {
+                seccion: np.frombuffer(self._mapa, dtype=np.dtype(dtype), count=n, offset=inicio_datos + desplazamiento)
+                for seccion, (desplazamiento, dtype, n) in descripcion["secciones"].items()
+            }
+            self._columnas[nombre] = _COLUMNAS[descripcion["codificacion"]](secciones, descripcion)
+
+    def __len__(self):
+        return self.filas
+
+    def __getitem__(self, posicion) -> "FilaSnapshot":
+        posicion = operator.index(posicion)
+        if posicion < 0:
+            posicion += self.filas
+        if not 0 <= posicion < self.filas:
+            raise IndexError(posicion)
+        return FilaSnapshot(self, posicion)
+
+    def __iter__(self) -> Iterator["FilaSnapshot"]:
+        for posicion in range(self.filas):
+            yield FilaSnapshot(self, posicion)
+
+    # Valor de una columna en una fila (AUSENTE si el registro no lo tiene)
+    def valor(self, nombre: str, posicion: int):
+        columna = self._columnas.get(nombre)
+        if columna is not None:
+            return columna.valor(posicion)
+        otros = self._columnas[COLUMNA_OTROS].valor(posicion)
+        return AUSENTE if otros is AUSENTE else json.loads(otros).get(nombre, AUSENTE)
+
+    def campos_presentes(self, posicion: int) -> List[str]:
+        presentes = [c for c in CAMPOS_ESQUEMA if self._columnas[c].valor(posicion) is not AUSENTE]
+        otros = self._columnas[COLUMNA_OTROS].valor(posicion)
+        if otros is not AUSENTE:
+            presentes.extend(json.loads(otros))
+        return presentes
+
+    def ids(self) -> List[Optional[str]]:
+        columna = self._columnas["@id"]
+        return [None if v is AUSENTE else v for v in map(columna.valor, range(self.filas))]
+
+    # Columna numérica como float64 (NaN si falta). Sin excepciones es la vista directa sobre el mmap
+    def numeros(self, campo: str) -> np.ndarray:
+        return self._columnas[campo].numeros()
+
+    # Las columnas que usa evaluar_columnas (filtros.construir_columnas), sin copiar los textos a memoria
+    def columnas(self) -> dict:
+        columnas = {"location/lat": self.numeros("location/lat"), "location/lng": self.numeros("location/lng")}
+        for campo in set(CAMPO_FILTRO.values()):
+            columnas[campo] = ColumnaFiltro(self._columnas[campo], campo in CAMPOS_PLEGADOS)
+        return columnas
+
+# Vista de solo lectura de los fields de una fila (se usa como el dict 'fields' de Airtable)
+class CamposFila(Mapping):
+    __slots__ = ("_snapshot", "_posicion")
+
+    def __init__(self, snapshot: Snapshot, posicion: int):
+        self._snapshot = snapshot
+        self._posicion = posicion
+
+    def __getitem__(self, campo: str):
+        valor = self._snapshot.valor(campo, self._posicion) if not campo.startswith("@") else AUSENTE
+        if valor is AUSENTE:
+            raise KeyError(campo)
+        return valor
+
+    def get(self, campo: str, defecto=None):
+        valor = self._snapshot.valor(campo, self._posicion) if not campo.startswith("@") else AUSENTE
+        return defecto if valor is AUSENTE else valor
+
+    def __iter__(self):
+        return iter(self._snapshot.campos_presentes(self._posicion))
+
+    def __len__(self):
+        return len(self._snapshot.campos_presentes(self._posicion))
+
+# Vista de un registro ({"id", "createdTime", "fields"}) sin materializarlo
+class FilaSnapshot(Mapping):
+    __slots__ = ("_snapshot", "_posicion")
+
+    def __init__(self, snapshot: Snapshot, posicion: int):
+        self._snapshot = snapshot
+        self._posicion = posicion
+
+    def __getitem__(self, clave: str):
+        if clave == "fields":
+            return CamposFila(self._snapshot, self._posicion)
+        if clave in ("id", "createdTime"):
+            valor = self._snapshot.valor("@" + clave, self._posicion)
+            if valor is not AUSENTE:
+                return valor
+        raise KeyError(clave)
+
+    def __iter__(self):
+        return iter([c for c in ("id", "createdTime", "fields") if c in self])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, clave) -> bool:
+        if clave == "fields":
+            return True
+        return clave in ("id", "createdTime") and self._snapshot.valor("@" + clave, self._posicion) is not AUSENTE
+
+    def __repr__(self):
+        return f"FilaSnapshot({self._posicion}, id={self.get('id')!r})"
+
+    # El registro como dict normal, igual al que se guardó
+    # Con 'campos', solo esos fields (los que falten no se ponen)
+    def a_registro(self, campos: Optional[Sequence[str]] = None) -> dict:
+        registro = {clave: self[clave] for clave in self if clave != "fields"}
+        fields = self["fields"]
+        registro["fields"] = dict(fields) if campos is None else {c: fields[c] for c in campos if c in fields}
+        return registro
+
+    def a_respuesta(self) -> dict:
+        valor = self._snapshot.valor
+        respuesta = {}
+        for clave, campo, defecto in FORMATO_RESPUESTA:
+            v = valor(campo, self._posicion)
+            respuesta[clave] = defecto if v is AUSENTE else v
+        return respuesta
+
+# Un restaurante tal y como sale en la respuesta de /api/getRestaurantsPrueba (sea un dict de Airtable o una fila
+# del snapshot)
+def formatear_restaurante(registro) -> dict:
+    if isinstance(registro, FilaSnapshot):
+        return registro.a_respuesta()
+    fields = registro["fields"]
+    return {clave: fields.get(campo, defecto) for clave, campo, defecto in FORMATO_RESPUESTA}
@@ -0,0 +1,131 @@
+# CacheResultados: fresco, stale-while-revalidate y caducado, y la invalidación por generaciones (en un proceso y
+# entre dos procesos que comparten el nivel SQLite)
+import os
+import sys
+import asyncio
+import itertools
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cache
+from cache import CacheResultados
+from cache_compartida import CacheCompartidaSQLite
+
+# Claves distintas en cada prueba: vuelo_busquedas es global y no debe juntar búsquedas de pruebas distintas
+_claves = itertools.count()
+
+def nueva_clave() -> tuple:
+    return ("madrid", ("prueba",), next(_claves))
+
+class Calculo:
+    def __init__(self):
+        self.llamadas = 0
+
+    async def __call__(self):
+        self.llamadas += 1
+        return ([f"rec{self.llamadas}"], "formula", None, None)
+
+def test_fresco_no_recalcula():
+    async def prueba():
+        resultados = CacheResultados(ttl=60, stale=60, compartida=None)
+        clave, calcular = nueva_clave(), Calculo()
+        primero = await resultados.obtener_o_calcular(clave, calcular)
+        segundo = await resultados.obtener_o_calcular(clave, calcular)
+        assert primero == segundo == (["rec1"], "formula", None, None)
+        assert calcular.llamadas == 1
+        assert (resultados.hits, resultados.misses) == (1, 1)
+    asyncio.run(prueba())
+
+def test_stale_sirve_lo_viejo_y_refresca_una_vez():
+    async def prueba():
+        resultados = CacheResultados(ttl=0, stale=60, compartida=None)
+        clave, calcular = nueva_clave(), Calculo()
+        await resultados.obtener_o_calcular(clave, calcular)
+        # Ya pasado el TTL: las dos llamadas reciben lo viejo y solo se lanza un refresco
+        viejos = await asyncio.gather(*(resultados.obtener_o_calcular(clave, calcular) for _ in range(2)))
+        assert [v[0] for v in viejos] == [["rec1"], ["rec1"]]
+        await asyncio.gather(*resultados._refrescando.values())
+        assert calcular.llamadas == 2 and resultados.refrescos == 1
+        assert (await resultados.obtener_o_calcular(clave, calcular))[0] == ["rec2"]
+    asyncio.run(prueba())
+
+def test_error_al_refrescar_mantiene_lo_viejo():
+    async def prueba():
+        resultados = CacheResultados(ttl=0, stale=60, compartida=None)
+        clave = nueva_clave()
+        await resultados.obtener_o_calcular(clave, Calculo())
+
+        async def falla():
+            raise RuntimeError("Airtable caído")
+        assert (await resultados.obtener_o_calcular(clave, falla))[0] == ["rec1"]
+        await asyncio.gather(*resultados._refrescando.values())
+        assert resultados.errores_refresco == 1
+        assert await resultados.vigente(clave)
+    asyncio.run(prueba())
+
+def test_caducado_recalcula():
+    async def prueba():
+        resultados = CacheResultados(ttl=0, stale=0, ttl_vacios=0, compartida=None)
+        clave, calcular = nueva_clave(), Calculo()
+        await resultados.obtener_o_calcular(clave, calcular)
+        assert not await resultados.vigente(clave)
+        assert (await resultados.obtener_o_calcular(clave, calcular))[0] == ["rec2"]
+        assert resultados.misses == 2
+    asyncio.run(prueba())
+
+@pytest.fixture
+def compartida(tmp_path, monkeypatch):
+    # La generación de la caché compartida se relee en cada consulta
+    monkeypatch.setattr(cache, "RESULT_CACHE_GENERACION_SEGUNDOS", 0)
+    return str(tmp_path / "compartida.sqlite3")
+
+def test_invalidar_si_conserva_las_no_afectadas(compartida):
+    async def prueba():
+        resultados = CacheResultados(ttl=60, stale=60, compartida=CacheCompartidaSQLite(compartida))
+        afectada, otra = nueva_clave(), nueva_clave()
+        calcular_afectada, calcular_otra = Calculo(), Calculo()
+        await resultados.obtener_o_calcular(afectada, calcular_afectada)
+        await resultados.obtener_o_calcular(otra, calcular_otra)
+        generacion = resultados.estadisticas()["generacion"]
+
+        assert await resultados.invalidar_si(lambda clave, valor: clave == afectada) == 1
+        assert resultados.estadisticas()["generacion"] == generacion + 1
+        await resultados.obtener_o_calcular(afectada, calcular_afectada)
+        await resultados.obtener_o_calcular(otra, calcular_otra)
+        assert (calcular_afectada.llamadas, calcular_otra.llamadas) == (2, 1)
+    asyncio.run(prueba())
+
+# Lo que se empezó a calcular antes de invalidar se guarda con la generación vieja: no se vuelve a servir
+def test_calculo_en_curso_durante_invalidacion_nace_viejo(compartida):
+    async def prueba():
+        resultados = CacheResultados(ttl=60, stale=60, compartida=CacheCompartidaSQLite(compartida))
+        clave, calcular = nueva_clave(), Calculo()
+        seguir = asyncio.Event()
+
+        async def lento():
+            await seguir.wait()
+            return await calcular()
+        tarea = asyncio.create_task(resultados.obtener_o_calcular(clave, lento))
+        await asyncio.sleep(0.01)
+        await resultados.invalidar_si(lambda clave, valor: True)
+        seguir.set()
+        assert (await tarea)[0] == ["rec1"]
+        assert not await resultados.vigente(clave)
+        assert (await resultados.obtener_o_calcular(clave, calcular))[0] == ["rec2"]
+    asyncio.run(prueba())
+
+# Dos procesos con la misma caché compartida: lo que calcula uno lo sirve el otro, y cuando uno invalida el otro
+# deja de servirlo
+def test_generacion_compartida_entre_procesos(compartida):
+    async def prueba():
+        uno = CacheResultados(ttl=60, stale=60, compartida=CacheCompartidaSQLite(compartida))
+        otro = CacheResultados(ttl=60, stale=60, compartida=CacheCompartidaSQLite(compartida))
+        clave, calcular = nueva_clave(), Calculo()
+        await uno.obtener_o_calcular(clave, calcular)
+        assert (await otro.obtener_o_calcular(clave, calcular))[0] == ["rec1"]
+        assert otro.traidas_compartida == 1 and calcular.llamadas == 1
+
+        await uno.invalidar()
+        assert not await otro.vigente(clave)
+        assert (await otro.obtener_o_calcular(clave, calcular))[0] == ["rec2"]
+    asyncio.run(prueba())
@@ -0,0 +1,120 @@
+# Nivel compartido de las cachés: los resultados (también con filas del snapshot) se serializan y vuelven igual que
+# los daría formatear_restaurante, y los dos backends (SQLite y Redis, este contra el RedisStub de los benchmarks)
+# guardan, caducan, borran, llevan la generación y, si fallan, se tratan como un fallo de caché
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+import cache_compartida
+from cache_compartida import (
+    CacheCompartidaSQLite, CacheCompartidaRedis, serializar, deserializar, _serializable, abrir_cache_compartida
+)
+from snapshot import Snapshot, escribir_snapshot, formatear_restaurante, CAMPOS_FORMATO
+from servidores_stub import RedisStub
+
+REGISTROS = [
+    {
+        "id": f"rec{i:06d}", "createdTime": "2024-01-01T00:00:00.000Z",
+        "fields": {
+            "cid": str(i), "title": f"Restaurante {i}", "NBH2": 90 - i, "price_range": ["€€"],
+            "location/lat": 40.42 + i / 1000, "location/lng": -3.70, "categories_string": "Española",
+            "google_reviews": "reseña muy larga " * 50,
+        },
+    }
+    for i in range(5)
+]
+
+@pytest.fixture
+def snapshot(tmp_path):
+    ruta = str(tmp_path / "catalogo.snap")
+    escribir_snapshot(REGISTROS, ruta)
+    return Snapshot(ruta)
+
+def test_resultado_con_filas_del_snapshot(snapshot):
+    valor = ([snapshot[0], snapshot[1], REGISTROS[2]], "AND(...)", 40.42, -3.70)
+    leido = deserializar(serializar(valor))
+    assert leido[1:] == ["AND(...)", 40.42, -3.70]
+    # Las filas van como registros con solo los campos de la respuesta (sin google_reviews); los dicts tal cual
+    assert set(leido[0][0]["fields"]) == set(CAMPOS_FORMATO) & set(REGISTROS[0]["fields"])
+    assert leido[0][2] == REGISTROS[2]
+    assert [formatear_restaurante(r) for r in leido[0]] == [formatear_restaurante(r) for r in valor[0]]
+
+def test_serializable(snapshot):
+    assert _serializable(snapshot[0]) == snapshot[0].a_registro(CAMPOS_FORMATO)
+    assert _serializable(snapshot[0]["fields"]) == REGISTROS[0]["fields"]
+    assert _serializable((1, 2)) == [1, 2]
+    with pytest.raises(TypeError):
+        _serializable(object())
+    with pytest.raises(TypeError):
+        serializar({"x": object()})
+
+def test_compresion(monkeypatch):
+    monkeypatch.setattr(cache_compartida, "SERIALIZACION_MIN_ZLIB", 100)
+    corto, largo = {"a": 1}, {"a": "x" * 1000}
+    assert serializar(corto)[:1] == b"j" and serializar(largo)[:1] == b"z"
+    assert len(serializar(largo)) < 100
+    assert deserializar(serializar(corto)) == corto and deserializar(serializar(largo)) == largo
+    with pytest.raises(ValueError):
+        deserializar(b"?{}")
+
+async def comprobar_backend(compartida):
+    assert await compartida.obtener("clave") is None
+    await compartida.guardar("clave", b"valor", 60)
+    await compartida.guardar("corta", b"valor", 0.05)
+    assert await compartida.obtener("clave") == b"valor"
+    await asyncio.sleep(0.1)
+    assert await compartida.obtener("corta") is None
+    await compartida.borrar("clave")
+    assert await compartida.obtener("clave") is None
+    assert await compartida.generacion("resultados") == 0
+    assert await compartida.nueva_generacion("resultados") == 1
+    assert await compartida.nueva_generacion("resultados") == 2
+    assert await compartida.generacion("resultados") == 2
+    assert compartida.estadisticas()["errores"] == 0
+
+def test_sqlite(tmp_path):
+    async def prueba():
+        compartida = abrir_cache_compartida(f"sqlite://{tmp_path / 'compartida.sqlite3'}")
+        assert isinstance(compartida, CacheCompartidaSQLite)
+        await comprobar_backend(compartida)
+        await compartida.cerrar()
+    asyncio.run(prueba())
+
+def test_redis():
+    async def prueba():
+        servidor = await asyncio.start_server(RedisStub().atender, "127.0.0.1", 0)
+        puerto = servidor.sockets[0].getsockname()[1]
+        compartida = abrir_cache_compartida(f"redis://:clave@127.0.0.1:{puerto}/1")
+        assert isinstance(compartida, CacheCompartidaRedis)
+        try:
+            await comprobar_backend(compartida)
+        finally:
+            await compartida.cerrar()
+            servidor.close()
+            await servidor.wait_closed()
+    asyncio.run(prueba())
+
+# Redis caído: las operaciones dan None (fallo de caché), la generación no se conoce y se deja de intentar durante
+# la pausa en lugar de esperar el timeout en cada búsqueda
+def test_redis_caido(monkeypatch):
+    monkeypatch.setattr(cache_compartida, "CACHE_COMPARTIDA_PAUSA_ERROR", 60)
+
+    async def prueba():
+        servidor = await asyncio.start_server(RedisStub().atender, "127.0.0.1", 0)
+        puerto = servidor.sockets[0].getsockname()[1]
+        servidor.close()
+        await servidor.wait_closed()
+        compartida = CacheCompartidaRedis(f"redis://127.0.0.1:{puerto}")
+        assert await compartida.obtener("clave") is None
+        assert await compartida.generacion("resultados") is None
+        inicio = time.monotonic()
+        await compartida.guardar("clave", b"valor", 60)
+        assert time.monotonic() - inicio < 0.05
+        estadisticas = compartida.estadisticas()
+        assert estadisticas["errores"] == 1 and not estadisticas["disponible"]
+    asyncio.run(prueba())
@@ -0,0 +1,84 @@
+# Catalogo.filtrar (con y sin índice de texto) tiene que devolver lo mismo que el predicado de la consulta, que es
+# el equivalente local de la fórmula de Airtable. Datos y consultas aleatorios de benchmarks/diferencial_filtros.py
+import os
+import sys
+import random
+import asyncio
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+from catalogo import Catalogo
+from snapshot import Snapshot, escribir_snapshot
+from filtros import ConsultaRestaurantes
+from diferencial_filtros import registro_aleatorio, consulta_aleatoria, filtrar_catalogo
+from formula_airtable import evaluar_formula
+
+def por_predicado(registros: list, consulta: ConsultaRestaurantes) -> list:
+    predicado = consulta.predicado()
+    return [r["id"] for r in registros if r is not None and predicado(r["fields"])]
+
+def catalogo_indexado(registros: list) -> Catalogo:
+    catalogo = Catalogo(registros)
+    asyncio.run(catalogo.indexar_texto())
+    assert catalogo.texto_indexado
+    return catalogo
+
+@pytest.fixture(scope="module")
+def registros():
+    rnd = random.Random(7)
+    return [registro_aleatorio(i, rnd) for i in range(1500)]
+
+@pytest.mark.parametrize("indexado", [False, True])
+def test_filtrar_igual_que_predicado(registros, indexado):
+    catalogo = catalogo_indexado(registros) if indexado else Catalogo(registros)
+    rnd = random.Random(11)
+    for _ in range(300):
+        consulta = consulta_aleatoria(rnd)
+        assert filtrar_catalogo(catalogo, consulta) == por_predicado(registros, consulta), consulta
+
+# Igual con las columnas leídas del snapshot en disco (los textos plegados se sacan de ahí)
+def test_filtrar_desde_snapshot(registros, tmp_path):
+    ruta = str(tmp_path / "catalogo.snap")
+    escribir_snapshot(registros, ruta)
+    catalogo = Catalogo(Snapshot(ruta))
+    rnd = random.Random(17)
+    for _ in range(200):
+        consulta = consulta_aleatoria(rnd)
+        assert filtrar_catalogo(catalogo, consulta) == por_predicado(registros, consulta), consulta
+
+# Después de altas, modificaciones y bajas sueltas el índice sigue dando lo mismo que el predicado
+def test_filtrar_tras_cambios(registros):
+    catalogo = catalogo_indexado(list(registros))
+    rnd = random.Random(13)
+    actualizados = [registro_aleatorio(i, rnd) for i in rnd.sample(range(len(registros)), 100)]
+    actualizados += [registro_aleatorio(i, rnd) for i in range(len(registros), len(registros) + 50)]
+    eliminados = [f"rec{i:06d}" for i in rnd.sample(range(len(registros)), 50)]
+    catalogo.aplicar_cambios(actualizados, eliminados)
+    vigentes = catalogo.registros_vigentes()
+    for _ in range(200):
+        consulta = consulta_aleatoria(rnd)
+        assert filtrar_catalogo(catalogo, consulta) == por_predicado(vigentes, consulta), consulta
+
+# Trozos de palabra sí; mayúsculas y tildes dan igual, en un sentido y en el otro
+@pytest.mark.parametrize("dish, esperados", [
+    ("aell", ["rec000000", "rec000001"]),
+    ("Paella", ["rec000000", "rec000001"]),
+    ("paella", ["rec000000", "rec000001"]),
+    ("paella valenciana", ["rec000000"]),
+    ("cafe", ["rec000002", "rec000003"]),
+    ("café", ["rec000002", "rec000003"]),
+    ("CAFÉ CON", ["rec000002", "rec000003"]),
+    ("ano", ["rec000003"]),
+])
+def test_semantica_de_search(dish, esperados):
+    reviews = ["la mejor paella valenciana", "Paella de marisco", "cafe con leche", "Café con leche todo el año"]
+    registros = [
+        {"id": f"rec{i:06d}", "fields": {"location/lat": 40.42, "location/lng": -3.70, "google_reviews": texto}}
+        for i, texto in enumerate(reviews)
+    ]
+    consulta = ConsultaRestaurantes.desde_parametros(dish=dish)
+    assert [r["id"] for r in registros if evaluar_formula(consulta.a_formula(), r)] == esperados
+    for catalogo in (Catalogo(registros), catalogo_indexado(registros)):
+        assert filtrar_catalogo(catalogo, consulta) == esperados
@@ -0,0 +1,60 @@
+# La fórmula de Airtable que sale de ConsultaRestaurantes, evaluada con el intérprete de los benchmarks, tiene que
+# seleccionar los mismos registros que el predicado y que la evaluación por columnas. Y los valores que llegan del
+# usuario (comillas, barras) tienen que ir bien escapados: ni rompen la fórmula ni cambian lo que se busca
+import os
+import sys
+import random
+import numpy as np
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+from filtros import ConsultaRestaurantes, escapar_cadena, construir_columnas, evaluar_columnas
+from formula_airtable import evaluar_formula, compilar_formula
+from diferencial_filtros import registro_aleatorio, consulta_aleatoria
+
+@pytest.fixture(scope="module")
+def registros():
+    rnd = random.Random(3)
+    return [registro_aleatorio(i, rnd) for i in range(400)]
+
+def test_formula_igual_que_predicado_y_columnas(registros):
+    columnas = construir_columnas(registros)
+    rnd = random.Random(5)
+    for _ in range(150):
+        consulta = consulta_aleatoria(rnd)
+        formula = consulta.a_formula()
+        predicado = consulta.predicado()
+        por_formula = [r["id"] for r in registros if evaluar_formula(formula, r)]
+        por_predicado = [r["id"] for r in registros if predicado(r["fields"])]
+        por_columnas = [registros[p]["id"] for p in np.flatnonzero(evaluar_columnas(consulta, columnas))]
+        assert por_formula == por_predicado == por_columnas, formula
+
+@pytest.mark.parametrize("valor, escapado", [
+    ("pizza", "pizza"),
+    ("l'arròs", "l\\'arròs"),
+    ("a\\b", "a\\\\b"),
+    ("\\'", "\\\\\\'"),
+    ("''", "\\'\\'"),
+    ("acaba en \\", "acaba en \\\\"),
+])
+def test_escapar_cadena(valor, escapado):
+    assert escapar_cadena(valor) == escapado
+    # Entre comillas simples, el intérprete de fórmulas lee exactamente el valor original
+    assert evaluar_formula(f"'{escapado}' = '{escapado}'", {"fields": {}})
+    assert compilar_formula(f"FIND('{escapado}', {{title}})")[2][0] == ("const", valor)
+
+# Valores que sin escapar cerrarían la cadena o se comerían la comilla de cierre: la fórmula sigue siendo válida y
+# solo casa con el texto que los contiene de verdad
+@pytest.mark.parametrize("dish", ["O'Donnell", "l'arròs", "a\\b", "acaba en \\", "') > 0, TRUE(), ('"])
+def test_valores_con_comillas_y_barras(dish):
+    registros = [
+        {"id": "rec000000", "fields": {"google_reviews": f"antes {dish} después"}},
+        {"id": "rec000001", "fields": {"google_reviews": "otra cosa"}},
+    ]
+    consulta = ConsultaRestaurantes.desde_parametros(dish=dish)
+    formula = consulta.a_formula()
+    compilar_formula(formula)
+    assert [r["id"] for r in registros if evaluar_formula(formula, r)] == ["rec000000"]
+    assert [r["id"] for r in registros if consulta.predicado()(r["fields"])] == ["rec000000"]
@@ -0,0 +1,100 @@
+# Regiones de las búsquedas en lote: una búsqueda que cae dentro de una región ya descargada se resuelve en local y
+# tiene que devolver lo mismo que la consulta a Airtable. Con una descarga a medias (corte) solo se usa si los
+# resultados se completan por encima del corte; si no, se va a Airtable
+import os
+import sys
+import random
+import asyncio
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+import bistrohunter
+from bistrohunter import consultar_restaurantes, precargar_region, campos_region, proyectar_registro, _regiones_lote
+from catalogo import clave_nbh2
+from filtros import ConsultaRestaurantes
+from geo import calcular_bounding_box
+from formula_airtable import evaluar_formula
+from diferencial_filtros import registro_aleatorio, consulta_aleatoria
+
+# Airtable de pruebas: la vista ordenada por NBH2 desc (los vacíos al final) y filterByFormula con el intérprete
+class AirtableFalso:
+    def __init__(self, registros):
+        self.registros = sorted(registros, key=clave_nbh2)
+        self.llamadas = []
+
+    async def buscar(self, url, headers, params, max_registros=80, campos=None):
+        self.llamadas.append(params)
+        formula = params.get("filterByFormula", "")
+        encontrados = [r for r in self.registros if evaluar_formula(formula, r)][:max_registros]
+        return {"records": [proyectar_registro(r, campos) for r in encontrados]}
+
+@pytest.fixture
+def airtable(monkeypatch):
+    rnd = random.Random(21)
+    falso = AirtableFalso([registro_aleatorio(i, rnd) for i in range(600)])
+    monkeypatch.setattr(bistrohunter, "airtable_buscar", falso.buscar)
+    return falso
+
+# Con 600 restaurantes pocas cajas llegan a 80: se piden menos para que las descargas a medias también sirvan
+def params_de(consulta: ConsultaRestaurantes, bounding_box: dict, max_registros: int = 10) -> dict:
+    return {
+        "filterByFormula": consulta.con_bbox(bounding_box).a_formula(),
+        "sort[0][field]": "NBH2",
+        "sort[0][direction]": "desc",
+        "maxRecords": max_registros,
+    }
+
+def ids(respuesta: dict) -> list:
+    return [r["id"] for r in respuesta["records"]]
+
+@pytest.mark.parametrize("paginas", [1, 2, 6])
+def test_region_igual_que_airtable(airtable, paginas):
+    region = calcular_bounding_box(40.42, -3.70, 4)
+
+    async def prueba():
+        registros, corte = await precargar_region(region, paginas)
+        assert (corte is None) == (len(registros) < paginas * 100)
+        rnd = random.Random(paginas)
+        locales = 0
+        for _ in range(60):
+            consulta = consulta_aleatoria(rnd)
+            caja = calcular_bounding_box(40.42 + rnd.uniform(-0.01, 0.01), -3.70, rnd.uniform(0.5, 3))
+            directa = await airtable.buscar("", {}, params_de(consulta, caja), max_registros=10)
+            antes = len(airtable.llamadas)
+            token = _regiones_lote.set([(region, registros, corte)])
+            try:
+                por_region = await consultar_restaurantes("", {}, params_de(consulta, caja), consulta, caja)
+            finally:
+                _regiones_lote.reset(token)
+            assert ids(por_region) == ids(directa), consulta
+            locales += len(airtable.llamadas) == antes
+        # Con la región entera todo sale en local; a medias, parte sí y parte va a Airtable
+        assert locales == 60 if corte is None else 0 < locales < 60
+    asyncio.run(prueba())
+
+# Una caja que no cabe entera en la región va a Airtable
+def test_caja_fuera_de_la_region(airtable):
+    region = calcular_bounding_box(40.42, -3.70, 1)
+    caja = calcular_bounding_box(40.42, -3.70, 2)
+    consulta = ConsultaRestaurantes()
+
+    async def prueba():
+        registros, corte = await precargar_region(region, 6)
+        token = _regiones_lote.set([(region, registros, corte)])
+        try:
+            await consultar_restaurantes("", {}, params_de(consulta, caja), consulta, caja)
+        finally:
+            _regiones_lote.reset(token)
+    asyncio.run(prueba())
+    assert len(airtable.llamadas) == 2
+
+def test_campos_region():
+    campos = ["cid", "title", "NBH2"]
+    assert campos_region([ConsultaRestaurantes()], None) is None
+    assert campos_region([ConsultaRestaurantes()], campos) == campos + ["location/lat", "location/lng"]
+    consultas = [ConsultaRestaurantes.desde_parametros(dish="paella"), ConsultaRestaurantes.desde_parametros(cocina="x")]
+    assert campos_region(consultas, campos) == campos + [
+        "location/lat", "location/lng", "google_reviews", "categories_string",
+    ]
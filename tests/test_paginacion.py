@@ -0,0 +1,75 @@
+# Cursores de la paginación: lo que se codifica se lee igual (también las claves NBH2 vacías), y un cursor
+# manipulado, firmado con otra clave, de otra versión o caducado se rechaza con un 400
+import os
+import sys
+import json
+import time
+import math
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import paginacion
+from paginacion import codificar_cursor, decodificar_cursor, _b64, _desde_b64, _firma, VERSION_CURSOR
+
+BUSQUEDA = {"city": "Madrid", "zona": "Malasaña", "cocina": ["italiana"]}
+
+def cursor_valido() -> str:
+    return codificar_cursor(BUSQUEDA, 20, 40, 1, (1.234, -87.0, "rec000001"))
+
+def rechazado(cursor: str) -> str:
+    with pytest.raises(HTTPException) as error:
+        decodificar_cursor(cursor)
+    assert error.value.status_code == 400
+    return error.value.detail
+
+def firmado(datos: dict) -> str:
+    cuerpo = _b64(json.dumps(datos).encode())
+    return f"{cuerpo}.{_firma(cuerpo)}"
+
+def test_ida_y_vuelta():
+    datos = decodificar_cursor(cursor_valido())
+    assert (datos["b"], datos["k"], datos["n"], datos["z"]) == (BUSQUEDA, 20, 40, 1)
+    assert datos["c"] == (1.234, -87.0, "rec000001")
+    # NBH2 vacío: la clave es inf y vuelve como inf
+    datos = decodificar_cursor(codificar_cursor(BUSQUEDA, 20, 40, 0, (math.inf, "rec000002")))
+    assert datos["c"] == (math.inf, "rec000002")
+
+def test_cuerpo_manipulado():
+    cuerpo, firma = cursor_valido().split(".")
+    datos = json.loads(_desde_b64(cuerpo))
+    datos["n"] = 0
+    assert rechazado(f"{_b64(json.dumps(datos).encode())}.{firma}") == "Cursor no válido"
+
+def test_firma_manipulada():
+    cuerpo, firma = cursor_valido().split(".")
+    otra = ("A" if firma[0] != "A" else "B") + firma[1:]
+    rechazado(f"{cuerpo}.{otra}")
+    rechazado(cuerpo)
+    rechazado(f"{cuerpo}.{firma}.{firma}")
+
+def test_firmado_con_otra_clave(monkeypatch):
+    cursor = cursor_valido()
+    monkeypatch.setattr(paginacion, "PAGINACION_SECRETO", b"otra clave")
+    rechazado(cursor)
+
+@pytest.mark.parametrize("datos", [
+    {"v": VERSION_CURSOR + 1, "t": 0, "b": {}, "k": 20, "n": 0, "z": 0, "c": []},
+    {"v": VERSION_CURSOR, "b": {}, "k": 20, "n": 0, "z": 0, "c": []},
+    {"v": VERSION_CURSOR, "t": 0, "b": {}, "k": 20, "n": 0, "z": 0, "c": 5},
+], ids=["version", "sin_fecha", "clave_no_lista"])
+def test_firmado_pero_no_valido(datos):
+    datos = dict(datos, t=int(time.time())) if "t" in datos else datos
+    assert rechazado(firmado(datos)) == "Cursor no válido"
+
+@pytest.mark.parametrize("cursor", ["", "basura", "no.base64!", "e30.", "%%%.%%%"])
+def test_cursor_mal_formado(cursor):
+    rechazado(cursor)
+
+def test_caducado(monkeypatch):
+    cursor = cursor_valido()
+    ahora = time.time()
+    monkeypatch.setattr(paginacion.time, "time", lambda: ahora + paginacion.PAGINACION_CURSOR_TTL - 5)
+    assert decodificar_cursor(cursor)["n"] == 40
+    monkeypatch.setattr(paginacion.time, "time", lambda: ahora + paginacion.PAGINACION_CURSOR_TTL + 5)
+    assert "caducado" in rechazado(cursor)
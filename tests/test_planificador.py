@@ -0,0 +1,120 @@
+# Planificador de Airtable: el token bucket da paso antes a las peticiones interactivas, los 429/5xx/errores de red se
+# reintentan (los demás 4xx no), un 429 para todas las peticiones durante el Retry-After y nada espera más que su
+# deadline
+import os
+import sys
+import time
+import asyncio
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import planificador
+from planificador import PlanificadorAirtable, TokenBucket, AirtableError, PRIORIDAD_INTERACTIVA, PRIORIDAD_FONDO
+
+@pytest.fixture(autouse=True)
+def backoff_corto(monkeypatch):
+    monkeypatch.setattr(planificador, "AIRTABLE_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(planificador, "AIRTABLE_BACKOFF_MAX", 0.005)
+
+def respuesta(status_code: int, **cabeceras) -> httpx.Response:
+    return httpx.Response(status_code, headers=cabeceras, json={}, request=httpx.Request("GET", "http://airtable/t"))
+
+def respuestas(*codigos):
+    enviadas = []
+
+    async def enviar():
+        codigo = codigos[min(len(enviadas), len(codigos) - 1)]
+        enviadas.append(time.monotonic())
+        if isinstance(codigo, Exception):
+            raise codigo
+        return codigo if isinstance(codigo, httpx.Response) else respuesta(codigo)
+    return enviar, enviadas
+
+def test_interactiva_antes_que_fondo():
+    async def prueba():
+        bucket = TokenBucket(tasa=20, capacidad=1)
+        limite = time.monotonic() + 5
+        await bucket.adquirir(PRIORIDAD_FONDO, limite)
+        orden = []
+
+        async def pedir(prioridad, nombre):
+            await bucket.adquirir(prioridad, limite)
+            orden.append(nombre)
+        # Sin tokens: las de fondo llegan antes pero sale primero la interactiva
+        tareas = [asyncio.create_task(pedir(PRIORIDAD_FONDO, f"fondo{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        tareas.append(asyncio.create_task(pedir(PRIORIDAD_INTERACTIVA, "interactiva")))
+        await asyncio.gather(*tareas)
+        assert orden == ["interactiva", "fondo0", "fondo1"]
+    asyncio.run(prueba())
+
+def test_respeta_la_tasa():
+    async def prueba():
+        bucket = TokenBucket(tasa=50, capacidad=2)
+        inicio = time.monotonic()
+        await asyncio.gather(*(bucket.adquirir(PRIORIDAD_INTERACTIVA, inicio + 5) for _ in range(7)))
+        # 2 de la ráfaga y 5 más a 50/s
+        assert time.monotonic() - inicio >= 5 / 50 * 0.9
+    asyncio.run(prueba())
+
+@pytest.mark.parametrize("fallo", [
+    503, respuesta(429, **{"Retry-After": "0"}), httpx.ConnectError("sin red")
+], ids=["5xx", "429", "red"])
+def test_reintenta_y_acaba_bien(fallo):
+    async def prueba():
+        plan = PlanificadorAirtable()
+        enviar, enviadas = respuestas(fallo, 200)
+        assert (await plan.ejecutar(enviar)).status_code == 200
+        assert len(enviadas) == 2 and plan.reintentos == 1
+    asyncio.run(prueba())
+
+def test_4xx_no_se_reintenta():
+    async def prueba():
+        plan = PlanificadorAirtable()
+        enviar, enviadas = respuestas(422)
+        with pytest.raises(AirtableError) as error:
+            await plan.ejecutar(enviar)
+        assert error.value.status_code == 422 and len(enviadas) == 1
+    asyncio.run(prueba())
+
+def test_agota_los_reintentos(monkeypatch):
+    monkeypatch.setattr(planificador, "AIRTABLE_REINTENTOS", 2)
+
+    async def prueba():
+        plan = PlanificadorAirtable()
+        enviar, enviadas = respuestas(503)
+        with pytest.raises(AirtableError) as error:
+            await plan.ejecutar(enviar)
+        assert error.value.status_code == 503
+        assert len(enviadas) == 3 and plan.errores_5xx == 3
+    asyncio.run(prueba())
+
+# Tras un 429 no sale nada (tampoco las demás peticiones) hasta que pasa el Retry-After
+def test_429_pausa_todas_las_peticiones():
+    async def prueba():
+        plan = PlanificadorAirtable()
+        enviar, enviadas = respuestas(respuesta(429, **{"Retry-After": "0.2"}), 200)
+        otra, otras = respuestas(200)
+        inicio = time.monotonic()
+        primera = asyncio.create_task(plan.ejecutar(enviar))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(primera, plan.ejecutar(otra))
+        assert enviadas[1] - inicio >= 0.19
+        assert otras[0] - inicio >= 0.19
+        assert plan.errores_429 == 1
+    asyncio.run(prueba())
+
+# Si la pausa no acaba antes del deadline, se falla enseguida en lugar de esperar
+def test_deadline_durante_la_pausa():
+    async def prueba():
+        plan = PlanificadorAirtable()
+        plan.bucket.pausar(60)
+        enviar, enviadas = respuestas(200)
+        inicio = time.monotonic()
+        with pytest.raises(AirtableError) as error:
+            await plan.ejecutar(enviar, deadline=0.1)
+        assert error.value.status_code == 429 and not enviadas
+        assert time.monotonic() - inicio < 1
+        assert plan.bucket.esperas_agotadas == 1
+    asyncio.run(prueba())
@@ -0,0 +1,118 @@
+# SingleFlight: las llamadas idénticas simultáneas comparten una sola, los errores llegan a todos los que esperan y
+# cancelar a quien la pidió no la cancela para los demás
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bistrohunter
+from singleflight import SingleFlight
+from planificador import PRIORIDAD_INTERACTIVA, PRIORIDAD_FONDO
+
+class Llamada:
+    def __init__(self, resultado="ok", error: Exception = None):
+        self.resultado = resultado
+        self.error = error
+        self.llamadas = 0
+        self.seguir = asyncio.Event()
+
+    async def __call__(self):
+        self.llamadas += 1
+        await self.seguir.wait()
+        if self.error is not None:
+            raise self.error
+        return self.resultado
+
+def test_llamadas_identicas_comparten_una():
+    async def prueba():
+        vuelo, llamada = SingleFlight("prueba"), Llamada()
+        tareas = [asyncio.create_task(vuelo.ejecutar("clave", llamada)) for _ in range(5)]
+        await asyncio.sleep(0)
+        llamada.seguir.set()
+        assert await asyncio.gather(*tareas) == ["ok"] * 5
+        assert (llamada.llamadas, vuelo.llamadas, vuelo.colapsadas) == (1, 1, 4)
+        assert vuelo.estadisticas()["en_curso"] == 0
+    asyncio.run(prueba())
+
+def test_claves_distintas_no_se_juntan():
+    async def prueba():
+        vuelo, llamada = SingleFlight("prueba"), Llamada()
+        llamada.seguir.set()
+        await asyncio.gather(vuelo.ejecutar("a", llamada), vuelo.ejecutar("b", llamada))
+        assert llamada.llamadas == 2 and vuelo.colapsadas == 0
+    asyncio.run(prueba())
+
+def test_el_error_llega_a_todos_y_no_se_queda_guardado():
+    async def prueba():
+        vuelo, llamada = SingleFlight("prueba"), Llamada(error=RuntimeError("Airtable caído"))
+        tareas = [asyncio.create_task(vuelo.ejecutar("clave", llamada)) for _ in range(3)]
+        await asyncio.sleep(0)
+        llamada.seguir.set()
+        resultados = await asyncio.gather(*tareas, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in resultados)
+        assert llamada.llamadas == 1
+        # La siguiente vuelve a salir (el fallo no se comparte con quien llega después)
+        llamada.error = None
+        assert await vuelo.ejecutar("clave", llamada) == "ok"
+        assert llamada.llamadas == 2
+    asyncio.run(prueba())
+
+def test_cancelar_al_primero_no_cancela_a_los_demas():
+    async def prueba():
+        vuelo, llamada = SingleFlight("prueba"), Llamada()
+        primero = asyncio.create_task(vuelo.ejecutar("clave", llamada))
+        segundo = asyncio.create_task(vuelo.ejecutar("clave", llamada))
+        await asyncio.sleep(0)
+        primero.cancel()
+        await asyncio.sleep(0)
+        llamada.seguir.set()
+        assert await segundo == "ok"
+        with pytest.raises(asyncio.CancelledError):
+            await primero
+        assert llamada.llamadas == 1
+    asyncio.run(prueba())
+
+# Aunque se cancelen todos los que esperan, la llamada termina (su resultado puede acabar en una caché) y la clave
+# queda libre
+def test_cancelar_a_todos_deja_terminar_la_llamada():
+    async def prueba():
+        vuelo, llamada = SingleFlight("prueba"), Llamada()
+        terminada = asyncio.Event()
+
+        async def funcion():
+            resultado = await llamada()
+            terminada.set()
+            return resultado
+        tareas = [asyncio.create_task(vuelo.ejecutar("clave", funcion)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        llamada.seguir.set()
+        await asyncio.wait_for(terminada.wait(), 1)
+        await asyncio.sleep(0)
+        assert vuelo.estadisticas()["en_curso"] == 0
+    asyncio.run(prueba())
+
+# Una búsqueda de usuario no se suma a una petición de fondo idéntica (haría cola detrás de ella)
+def test_airtable_request_separa_por_prioridad(monkeypatch):
+    async def prueba():
+        prioridades = []
+        seguir = asyncio.Event()
+
+        async def airtable_get(url, headers, params, prioridad=PRIORIDAD_INTERACTIVA):
+            prioridades.append(prioridad)
+            await seguir.wait()
+            return {"records": []}
+        monkeypatch.setattr(bistrohunter, "airtable_get", airtable_get)
+        params = {"filterByFormula": "TRUE()"}
+        tareas = [
+            asyncio.create_task(bistrohunter.airtable_request("http://airtable/t", {}, dict(params), prioridad=p))
+            for p in (PRIORIDAD_FONDO, PRIORIDAD_INTERACTIVA, PRIORIDAD_INTERACTIVA)
+        ]
+        await asyncio.sleep(0)
+        seguir.set()
+        await asyncio.gather(*tareas)
+        assert sorted(prioridades) == [PRIORIDAD_INTERACTIVA, PRIORIDAD_FONDO]
+    asyncio.run(prueba())
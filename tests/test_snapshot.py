@@ -0,0 +1,90 @@
+# Snapshot del catálogo: lo que se escribe se lee igual por mmap (tipos, valores raros, campos ausentes o fuera del
+# esquema), y reescribir el fichero no afecta a quien tiene abierta la foto anterior
+import os
+import sys
+import math
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from snapshot import Snapshot, FilaSnapshot, escribir_snapshot, formatear_restaurante
+
+REGISTROS = [
+    {
+        "id": "rec000000", "createdTime": "2024-01-01T00:00:00.000Z",
+        "fields": {
+            "cid": "1", "title": "Casa Lucío", "bh_message": "Huevos rotos 🍳", "url": "https://ejemplo.es/1",
+            "google_reviews": "La mejor tortilla", "location/lat": 40.4125, "location/lng": -3.7101, "NBH2": 87,
+            "price_range": ["€€"], "categories_string": "Española, Tapas",
+        },
+    },
+    # NBH2 decimal, coordenadas como texto, un None y un campo fuera del esquema con estructura
+    {
+        "id": "rec000001", "createdTime": "2024-01-02T00:00:00.000Z",
+        "fields": {
+            "cid": "2", "title": None, "location/lat": "40.43", "location/lng": -3.69, "NBH2": 71.5,
+            "price_range": ["€", "€€"], "categories_string": "Española, Tapas", "horario": {"lunes": ["13:00"]},
+        },
+    },
+    # Casi sin campos, un entero enorme y un texto con un surrogate suelto
+    {"id": "rec000002", "fields": {"NBH2": 2 ** 60, "google_reviews": "roto \ud800"}},
+    {"id": "rec000003", "createdTime": "2024-01-04T00:00:00.000Z", "fields": {}},
+]
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "catalogo.snap")
+
+def test_ida_y_vuelta(ruta):
+    escribir_snapshot(REGISTROS, ruta, creado_en=1700000000.0, metadatos={"marca_agua": 1700000001.0})
+    snapshot = Snapshot(ruta)
+    assert len(snapshot) == len(REGISTROS)
+    assert snapshot.creado_en == 1700000000.0
+    assert snapshot.metadatos == {"marca_agua": 1700000001.0}
+    assert [fila.a_registro() for fila in snapshot] == REGISTROS
+    assert snapshot.ids() == [r["id"] for r in REGISTROS]
+
+def test_tipos_y_ausentes(ruta):
+    escribir_snapshot(REGISTROS, ruta)
+    snapshot = Snapshot(ruta)
+    nbh2 = [fila["fields"].get("NBH2") for fila in snapshot]
+    assert [type(v) for v in nbh2] == [int, float, int, type(None)]
+    assert nbh2[2] == 2 ** 60
+    fila = snapshot[1]
+    assert fila["fields"]["title"] is None and "title" in fila["fields"]
+    assert "url" not in fila["fields"] and fila["fields"].get("url", "x") == "x"
+    assert "createdTime" not in snapshot[2]
+    # Las columnas numéricas, con el mismo criterio que leer_coordenada: el texto numérico vale, lo que falta es NaN
+    lats = snapshot.numeros("location/lat")
+    assert list(lats[:2]) == [40.4125, 40.43] and all(math.isnan(v) for v in lats[2:])
+
+def test_listas_no_comparten_el_diccionario(ruta):
+    escribir_snapshot(REGISTROS, ruta)
+    snapshot = Snapshot(ruta)
+    snapshot[0]["fields"]["price_range"].append("€€€")
+    assert snapshot[0]["fields"]["price_range"] == ["€€"]
+
+def test_proyeccion_y_respuesta(ruta):
+    escribir_snapshot(REGISTROS, ruta)
+    snapshot = Snapshot(ruta)
+    assert snapshot[0].a_registro(["title", "NBH2", "no_existe"]) == {
+        "id": "rec000000", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"title": "Casa Lucío", "NBH2": 87},
+    }
+    for fila, registro in zip(snapshot, REGISTROS):
+        assert isinstance(fila, FilaSnapshot)
+        assert formatear_restaurante(fila) == formatear_restaurante(registro)
+
+# El fichero se sustituye entero (os.replace): quien tiene abierta la foto vieja la sigue leyendo igual
+def test_reescribir_no_afecta_a_la_foto_abierta(ruta):
+    escribir_snapshot(REGISTROS, ruta)
+    vieja = Snapshot(ruta)
+    escribir_snapshot(REGISTROS[:1], ruta)
+    nueva = Snapshot(ruta)
+    assert len(nueva) == 1
+    assert [fila.a_registro() for fila in vieja] == REGISTROS
+    assert not [f for f in os.listdir(os.path.dirname(ruta)) if f.endswith(".tmp")]
+
+def test_fichero_que_no_es_snapshot(ruta):
+    with open(ruta, "wb") as f:
+        f.write(b"no es un snapshot")
+    with pytest.raises(ValueError):
+        Snapshot(ruta)
@@ -0,0 +1,102 @@
+# Webhook del catálogo: autenticación con el token, y que un cambio solo invalide las búsquedas cacheadas a las que
+# afecta (busqueda_afectada). Los ids que no salen en la vista solo se dan de baja si Airtable confirma que no existen
+import os
+import sys
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+import bistrohunter
+from bistrohunter import clave_resultados, busqueda_afectada
+from cache import CacheResultados
+
+TOKEN = "secreto"
+
+def restaurante(id_registro: str, lat: float, lng: float) -> dict:
+    return {"id": id_registro, "fields": {"cid": id_registro, "location/lat": lat, "location/lng": lng}}
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setattr(main, "CATALOGO_WEBHOOK_TOKEN", TOKEN)
+    return TestClient(main.app)
+
+def test_sin_token_configurado_no_existe(cliente, monkeypatch):
+    monkeypatch.setattr(main, "CATALOGO_WEBHOOK_TOKEN", None)
+    respuesta = cliente.post("/api/catalogo/webhook", json={}, headers={"Authorization": "Bearer "})
+    assert respuesta.status_code == 404
+
+@pytest.mark.parametrize("cabeceras", [{}, {"Authorization": "Bearer otro"}, {"Authorization": TOKEN}])
+def test_token_incorrecto(cliente, cabeceras):
+    assert cliente.post("/api/catalogo/webhook", json={}, headers=cabeceras).status_code == 401
+
+def test_cuerpo_que_no_es_un_objeto(cliente):
+    respuesta = cliente.post("/api/catalogo/webhook", json=[1, 2], headers={"Authorization": f"Bearer {TOKEN}"})
+    assert respuesta.status_code == 400
+
+def test_invalida_solo_las_busquedas_afectadas(cliente, monkeypatch):
+    resultados = CacheResultados(ttl=60, stale=60, compartida=None)
+    monkeypatch.setattr(bistrohunter, "cache_resultados", resultados)
+    # Malasaña (Madrid) está en 40.4262, -3.7046
+    busquedas = {
+        "devolvio_el_cambiado": (clave_resultados("Madrid", zona="Malasaña"),
+                                 ([restaurante("rec1", 40.4262, -3.7046)], "", 40.4262, -3.7046)),
+        "misma_zona": (clave_resultados("Madrid", zona="Malasaña", cocina="italiana"),
+                       ([restaurante("rec2", 40.4262, -3.7046)], "", 40.4262, -3.7046)),
+        "otra_ciudad": (clave_resultados("Barcelona", zona="Gràcia"),
+                        ([restaurante("rec3", 41.4036, 2.1565)], "", 41.4036, 2.1565)),
+        "coordenadas_lejos": (clave_resultados("Sevilla", coordenadas="37.385,-6.003"),
+                              ([restaurante("rec4", 37.385, -6.003)], "", 37.385, -6.003)),
+    }
+
+    async def llenar():
+        for clave, valor in busquedas.values():
+            async def calcular(valor=valor):
+                return valor
+            await resultados.obtener_o_calcular(clave, calcular)
+    asyncio.run(llenar())
+
+    # rec1 se mueve unos metros dentro de Malasaña
+    respuesta = cliente.post(
+        "/api/catalogo/webhook", json={"registros": [restaurante("rec1", 40.4265, -3.7040)]},
+        headers={"Authorization": f"Bearer {TOKEN}"}
+    )
+    assert respuesta.status_code == 200
+    assert respuesta.json() == {"cambiados": 1, "busquedas_invalidadas": 2}
+
+    async def vigentes():
+        return {nombre: await resultados.vigente(clave) for nombre, (clave, _) in busquedas.items()}
+    assert asyncio.run(vigentes()) == {
+        "devolvio_el_cambiado": False, "misma_zona": False, "otra_ciudad": True, "coordenadas_lejos": True,
+    }
+
+# Búsqueda por coordenadas con 80 resultados: solo le afecta un punto dentro del círculo hasta el más lejano
+def test_busqueda_por_coordenadas_llena():
+    restaurantes = [restaurante(f"rec{i}", 40.42 + i * 0.0001, -3.70) for i in range(80)]
+    valor = (restaurantes, "", 40.42, -3.70)
+    clave = clave_resultados("Madrid", coordenadas="40.42,-3.70")
+    assert busqueda_afectada(clave, valor, {"otro"}, [(40.4201, -3.70)])
+    assert not busqueda_afectada(clave, valor, {"otro"}, [(40.45, -3.70)])
+    assert not busqueda_afectada(clave, valor, {"otro"}, [])
+    assert busqueda_afectada(clave, valor, {"rec79"}, [])
+
+def test_ids_que_no_salen_en_la_vista(monkeypatch):
+    async def descargar_por_id(ids, prioridad=None):
+        return [restaurante("rec1", 40.42, -3.70)]
+
+    async def http_get(url, **kwargs):
+        # rec3 está borrado; rec2 existe pero no ha salido en la vista
+        return httpx.Response(404 if url.endswith("/rec3") else 200, json={}, request=httpx.Request("GET", url))
+    aplicados = []
+
+    async def aplicar(actualizados, eliminados=()):
+        aplicados.append(([r["id"] for r in actualizados], list(eliminados)))
+        return {"cambiados": len(actualizados) + len(eliminados), "busquedas_invalidadas": 0}
+    monkeypatch.setattr(bistrohunter, "descargar_restaurantes_por_id", descargar_por_id)
+    monkeypatch.setattr(bistrohunter, "http_get", http_get)
+    monkeypatch.setattr(bistrohunter, "aplicar_cambios_catalogo", aplicar)
+
+    asyncio.run(bistrohunter.procesar_webhook_catalogo({"ids": ["rec1", "rec2", "rec3"], "eliminados": ["rec9"]}))
+    assert aplicados == [(["rec1"], ["rec9", "rec3"])]